@@ -0,0 +1,239 @@
+"""Run KoalaCode programs for the API in a pool of worker processes.
+
+Each worker is a process that has already imported ``koalacode`` and runs
+one program at a time with ``run_koala_code``. A request waits for an
+idle worker, hands it the source over a pipe and waits for the output
+in a thread, so the event loop keeps serving other requests. A worker
+that does not answer within the timeout is killed and replaced by a
+fresh one; a worker that dies is replaced the same way. If a replacement
+cannot be started, the failure is logged and counted, and the pool tries
+again after ``RESPAWN_DELAY`` seconds.
+
+``PoolMetrics`` tracks the queue of requests waiting for a worker, the
+latency of recent requests and how each worker's ``program_cache``
+answered them.
+"""
+import asyncio
+import collections
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from koala_runner import program_cache, run_koala_code
+
+DEFAULT_TIMEOUT = 5.0
+LATENCY_WINDOW = 1000
+RESPAWN_DELAY = 1.0
+
+log = logging.getLogger(__name__)
+
+
+def _serve(conn):
+    """Worker loop: run each program received on ``conn``.
+
+    Sends back its output and how the program cache answered.
+    """
+    conn.send("ready")
+    while True:
+        try:
+            code = conn.recv()
+        except (EOFError, OSError):
+            return
+        output = run_koala_code(code)
+        conn.send((output, program_cache.last))
+
+
+class Worker:
+    """A worker process and the pipe it is driven through."""
+
+    def __init__(self, context):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+        try:
+            self.conn.recv()  # wait until koalacode is imported
+        except BaseException:
+            self.kill()
+            raise
+
+    def run(self, code, timeout):
+        """Return ``(output, cache outcome)``; TimeoutError if it takes too long."""
+        self.conn.send(code)
+        if not self.conn.poll(timeout):
+            raise TimeoutError
+        return self.conn.recv()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class PoolMetrics:
+    """Counters, queue depth and recent latencies (in seconds) of a pool."""
+
+    def __init__(self):
+        self.queued = 0
+        self.max_queued = 0
+        self.running = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.crashes = 0
+        self.spawn_failures = 0
+        self.cache = collections.Counter()
+        self.waits = collections.deque(maxlen=LATENCY_WINDOW)
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def enqueue(self):
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+
+    def start(self):
+        self.queued -= 1
+        self.running += 1
+
+    def finish(self, wait, total, cache=None):
+        self.running -= 1
+        if cache is not None:
+            self.cache[cache] += 1
+        self.completed += 1
+        self.waits.append(wait)
+        self.latencies.append(total)
+
+    def snapshot(self):
+        def ms(values, fraction):
+            return round(_percentile(values, fraction) * 1000, 2)
+        return {
+            "queue_depth": self.queued,
+            "max_queue_depth": self.max_queued,
+            "running": self.running,
+            "completed": self.completed,
+            "timeouts": self.timeouts,
+            "crashes": self.crashes,
+            "spawn_failures": self.spawn_failures,
+            "wait_ms": {"p50": ms(self.waits, 0.5), "p99": ms(self.waits, 0.99)},
+            "latency_ms": {"p50": ms(self.latencies, 0.5), "p95": ms(self.latencies, 0.95),
+                           "p99": ms(self.latencies, 0.99)},
+        }
+
+    def cache_snapshot(self):
+        lookups = sum(self.cache.values())
+        hits = self.cache["hit"] + self.cache["shared"]
+        return {
+            "hits": self.cache["hit"],
+            "shared_hits": self.cache["shared"],
+            "misses": self.cache["miss"],
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class KoalaPool:
+    """A fixed number of pre-started workers shared by all requests.
+
+    ``workers`` defaults to the number of CPUs; ``timeout`` is the
+    wall-clock limit in seconds for one program.
+    """
+
+    def __init__(self, workers=None, timeout=DEFAULT_TIMEOUT):
+        self.size = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.context = multiprocessing.get_context()
+        self.metrics = PoolMetrics()
+        self.idle = None
+        self.executor = None
+        # Every live worker, idle or busy, and the tasks starting new ones.
+        self.workers = set()
+        self.spawning = set()
+        self.closing = False
+
+    async def start(self):
+        self.executor = ThreadPoolExecutor(self.size)
+        self.idle = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        workers = [loop.run_in_executor(self.executor, Worker, self.context)
+                   for _ in range(self.size)]
+        for worker in await asyncio.gather(*workers):
+            self.workers.add(worker)
+            self.idle.put_nowait(worker)
+
+    async def close(self):
+        """Kill every worker, including those still running a program."""
+        self.closing = True
+        await asyncio.gather(*self.spawning)
+        for worker in self.workers:
+            worker.kill()
+        self.workers.clear()
+        self.executor.shutdown()
+
+    async def run(self, code):
+        """Run ``code`` on an idle worker and return what it printed."""
+        loop = asyncio.get_running_loop()
+        metrics = self.metrics
+        queued = time.perf_counter()
+        metrics.enqueue()
+        try:
+            worker = await self.idle.get()
+        except asyncio.CancelledError:
+            metrics.queued -= 1
+            raise
+        started = time.perf_counter()
+        metrics.start()
+        cache = None
+        try:
+            output, cache = await loop.run_in_executor(
+                self.executor, worker.run, code, self.timeout)
+        except TimeoutError:
+            metrics.timeouts += 1
+            output = f"Error: program did not finish within {self.timeout:g} seconds"
+            self._replace(worker)
+        except (EOFError, OSError):
+            metrics.crashes += 1
+            output = "Error: the program's worker process died"
+            self._replace(worker)
+        except asyncio.CancelledError:
+            # The worker may still be running the program, so it cannot be reused.
+            metrics.running -= 1
+            self._replace(worker)
+            raise
+        else:
+            self.idle.put_nowait(worker)
+        metrics.finish(started - queued, time.perf_counter() - queued, cache)
+        return output
+
+    def _replace(self, worker):
+        """Kill ``worker``; a new one joins the idle queue once it has started."""
+        worker.kill()
+        self.workers.discard(worker)
+        if self.closing:
+            return
+        task = asyncio.get_running_loop().create_task(self._respawn())
+        self.spawning.add(task)
+        task.add_done_callback(self.spawning.discard)
+
+    async def _respawn(self):
+        loop = asyncio.get_running_loop()
+        while not self.closing:
+            try:
+                worker = await loop.run_in_executor(self.executor, Worker, self.context)
+            except Exception:
+                self.metrics.spawn_failures += 1
+                log.exception("Could not start a worker process; retrying in %g seconds",
+                              RESPAWN_DELAY)
+                await asyncio.sleep(RESPAWN_DELAY)
+                continue
+            if self.closing:
+                worker.kill()
+            else:
+                self.workers.add(worker)
+                self.idle.put_nowait(worker)
+            return
@@ -1,29 +1,43 @@
-from koalacode.lexer import tokenize
-from koalacode.parser import Parser
 from koalacode.interpreter import Interpreter
-import io
-import contextlib
+from koalacode.limits import Limits
+from koalacode.streams import ListInput, ListOutput
+from program_cache import DEFAULT_SIZE, ProgramCache, SQLiteStore
+import os
 import traceback
 
+# KOALA_CACHE_SIZE bounds the per-process cache; KOALA_CACHE_DB names an
+# SQLite file through which all workers share parsed programs.
+program_cache = ProgramCache(
+    maxsize=int(os.environ.get("KOALA_CACHE_SIZE", DEFAULT_SIZE)),
+    store=SQLiteStore(os.environ["KOALA_CACHE_DB"]) if os.environ.get("KOALA_CACHE_DB") else None,
+)
+
+# Budget of every submitted program (see koalacode.limits): loop iterations
+# plus calls, the total size of the arrays and strings it builds, and the
+# size of the integers it multiplies out.
+RUN_LIMITS = Limits(
+    fuel=int(os.environ.get("KOALA_FUEL", 10_000_000)),
+    array_elements=int(os.environ.get("KOALA_MAX_ARRAY_ELEMENTS", 10_000_000)),
+    string_chars=int(os.environ.get("KOALA_MAX_STRING_CHARS", 50_000_000)),
+    int_bits=int(os.environ.get("KOALA_MAX_INT_BITS", 100_000)),
+)
+
 def run_koala_code(code: str) -> str:
-    output_stream = io.StringIO()
+    # Output is collected per run rather than by redirecting the process's
+    # stdout; a program has no input, so take() fails with EOFError.
+    output = ListOutput()
 
     try:
-        with contextlib.redirect_stdout(output_stream):
-
-            tokens = tokenize(code)
-
-            parser = Parser(tokens)
-            tree = parser.parse()
+        tree = program_cache.parse(code)
 
-            if tree is None:
-                return "No code to run."
+        if tree is None:
+            return "No code to run."
 
-            interpreter = Interpreter()
-            result = interpreter.eval(tree)
+        interpreter = Interpreter(limits=RUN_LIMITS, output=output, input=ListInput(()))
+        result = interpreter.eval(tree)
 
     except Exception as e:
         return f"Error: {str(e)}\n{traceback.format_exc(limit=1)}"
 
-    captured = output_stream.getvalue().strip()
+    captured = output.getvalue().strip()
     return captured if captured else "No output"
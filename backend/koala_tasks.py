@@ -0,0 +1,121 @@
+"""Run KoalaCode programs for the API as cooperative tasks in this process.
+
+Each request compiles its program for the VM and runs it with
+``VM.run_async``: programs take turns on the event loop a time slice of
+instructions at a time, so many run concurrently without a process or a
+thread each. ``RUN_LIMITS`` bound the steps and memory of a program and
+``timeout`` its wall-clock time; a program over the timeout is cancelled
+at the end of its current slice.
+
+This runner is opt-in (``KOALA_RUNNER=tasks``); ``KoalaPool`` is the
+default. Unlike the pool:
+
+* every program shares one core with the server, and parsing, compiling
+  and each instruction run on the event loop, so a single slow
+  instruction (an enormous multiplication, say) holds up every request
+  until it finishes; the timeout only takes effect between slices;
+* programs run on the VM rather than the Interpreter, so the language
+  differs at the edges: a variable may change type, a function without
+  ``return`` gives None, and some error messages are worded differently
+  (see ``koalacode.vm``).
+"""
+import asyncio
+import time
+import traceback
+
+from koalacode.assembler import assemble_program
+from koalacode.compiler import Compiler
+from koalacode.optimizer import Optimizer
+from koalacode.streams import ListInput, ListOutput
+from koalacode.vm import TIME_SLICE, VM
+from koala_pool import DEFAULT_TIMEOUT, PoolMetrics
+from koala_runner import RUN_LIMITS, program_cache
+
+# Programs allowed to run at once; the others wait in the queue.
+DEFAULT_SIZE = 64
+
+
+def compile_tree(tree):
+    """Compile a parsed program for the VM; return ``(bytecode, funcs)``."""
+    comp = Compiler()
+    comp.compile(tree)
+    bytecode = Optimizer().optimize_program(comp.bytecode, comp.funcs)
+    return assemble_program(bytecode, comp.funcs), comp.funcs
+
+
+async def run_task(code, time_slice=TIME_SLICE):
+    """Run ``code`` on its own VM as a task.
+
+    Returns what it printed and how ``program_cache`` answered, as a pool
+    worker does.
+    """
+    output = ListOutput()
+    # A program has no input, so take() fails with EOFError.
+    source = ListInput(())
+
+    async def read():
+        return source.read()
+
+    cache = None
+    try:
+        tree = program_cache.parse(code)
+        cache = program_cache.last
+        if tree is None:
+            return "No code to run.", cache
+        bytecode, funcs = compile_tree(tree)
+        vm = VM(funcs, limits=RUN_LIMITS, output=output, input=source)
+        await vm.run_async(bytecode, read=read, time_slice=time_slice)
+    except Exception as e:
+        return f"Error: {str(e)}\n{traceback.format_exc(limit=1)}", cache
+
+    captured = output.getvalue().strip()
+    return captured if captured else "No output", cache
+
+
+class KoalaTasks:
+    """Runs up to ``size`` programs at once on the event loop.
+
+    ``timeout`` is the wall-clock limit in seconds for one program, from
+    when it starts running. ``metrics`` has the same counters as a pool's.
+    """
+
+    def __init__(self, size=DEFAULT_SIZE, timeout=DEFAULT_TIMEOUT, time_slice=TIME_SLICE):
+        self.size = size
+        self.timeout = timeout
+        self.time_slice = time_slice
+        self.metrics = PoolMetrics()
+        self.slots = None
+
+    async def start(self):
+        self.slots = asyncio.Semaphore(self.size)
+
+    async def close(self):
+        pass
+
+    async def run(self, code):
+        """Run ``code`` as a task once a slot is free; return what it printed."""
+        metrics = self.metrics
+        queued = time.perf_counter()
+        metrics.enqueue()
+        try:
+            await self.slots.acquire()
+        except asyncio.CancelledError:
+            metrics.queued -= 1
+            raise
+        try:
+            started = time.perf_counter()
+            metrics.start()
+            cache = None
+            try:
+                output, cache = await asyncio.wait_for(run_task(code, self.time_slice),
+                                                       self.timeout)
+            except asyncio.TimeoutError:
+                metrics.timeouts += 1
+                output = f"Error: program did not finish within {self.timeout:g} seconds"
+            except asyncio.CancelledError:
+                metrics.running -= 1
+                raise
+            metrics.finish(started - queued, time.perf_counter() - queued, cache)
+        finally:
+            self.slots.release()
+        return output
@@ -1,8 +1,32 @@
+import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from koala_runner import run_koala_code
+from koala_pool import DEFAULT_TIMEOUT, KoalaPool
+from koala_runner import program_cache
+from koala_tasks import DEFAULT_SIZE, KoalaTasks
+
+# Programs run in a pool of KOALA_WORKERS worker processes (by default the
+# number of CPUs); KOALA_TIMEOUT is in seconds. KOALA_RUNNER=tasks instead
+# interleaves them on the event loop with VM.run_async, up to
+# KOALA_MAX_RUNNING at once (see koala_tasks for what that gives up).
+timeout = float(os.environ.get("KOALA_TIMEOUT", DEFAULT_TIMEOUT))
+RUNNER = os.environ.get("KOALA_RUNNER", "pool")
+if RUNNER == "tasks":
+    pool = KoalaTasks(size=int(os.environ.get("KOALA_MAX_RUNNING", DEFAULT_SIZE)),
+                      timeout=timeout)
+else:
+    pool = KoalaPool(workers=int(os.environ.get("KOALA_WORKERS", 0)) or None, timeout=timeout)
+
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    await pool.start()
+    yield
+    await pool.close()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -16,5 +40,16 @@ app.add_middleware(
 async def run_code(request: Request):
     data = await request.json()
     code = data.get("code", "")
-    output = run_koala_code(code)
+    output = await pool.run(code)
     return {"output": output}
+
+@app.get("/metrics")
+async def metrics():
+    return {"runner": RUNNER, "workers": pool.size, "timeout": pool.timeout,
+            **pool.metrics.snapshot()}
+
+@app.get("/cache")
+async def cache():
+    return {"maxsize_per_worker": program_cache.maxsize,
+            "shared_store": program_cache.store is not None,
+            **pool.metrics.cache_snapshot()}
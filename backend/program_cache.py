@@ -0,0 +1,128 @@
+"""Cache of parsed programs for the backend runner.
+
+The playground sees the same snippets over and over (tutorials, examples,
+re-runs), so ``ProgramCache`` keeps the parsed tree of recent sources in a
+size-bounded LRU keyed by the SHA-256 of the source. Trees are never
+modified by the engines, so one tree can be run any number of times.
+
+Each worker process has its own ``ProgramCache``. Given a ``SQLiteStore``
+it also shares trees with the other workers: a local miss looks in the
+store before parsing, and a freshly parsed tree is written to it.
+"""
+import collections
+import json
+import os
+import sqlite3
+
+from koalacode import __version__
+from koalacode.cache import source_hash
+from koalacode.lexer import iter_tokens
+from koalacode.nodes import decode_tree, encode_tree
+from koalacode.parser import Parser
+
+DEFAULT_SIZE = 256
+
+
+def parse(code):
+    return Parser(iter_tokens(code)).parse()
+
+
+class SQLiteStore:
+    """Trees in an SQLite database shared by several processes.
+
+    A tree is stored as JSON of its ``encode_tree`` form, which holds only
+    plain values, so a row written by someone else can at worst make a
+    wrong tree, never run code in the reader.
+
+    The table keeps at most ``maxsize`` rows, dropping the oldest inserts
+    first. Rows written by another koalacode version are ignored. The
+    connection is opened lazily in each process, as sqlite3 connections
+    must not cross a fork.
+    """
+
+    def __init__(self, path, maxsize=4096):
+        self.path = path
+        self.maxsize = maxsize
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        if self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS programs "
+                "(hash BLOB PRIMARY KEY, version TEXT, tree BLOB)")
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key):
+        try:
+            row = self._connection().execute(
+                "SELECT tree FROM programs WHERE hash = ? AND version = ?",
+                (key, __version__)).fetchone()
+            return decode_tree(json.loads(row[0])) if row is not None else None
+        except Exception:
+            # A locked, missing or stale store is just a miss.
+            return None
+
+    def put(self, key, tree):
+        data = json.dumps(encode_tree(tree), separators=(',', ':'))
+        try:
+            conn = self._connection()
+            conn.execute("INSERT OR REPLACE INTO programs VALUES (?, ?, ?)",
+                         (key, __version__, data))
+            conn.execute(
+                "DELETE FROM programs WHERE rowid <= "
+                "(SELECT MAX(rowid) FROM programs) - ?", (self.maxsize,))
+        except sqlite3.Error:
+            pass
+
+
+class ProgramCache:
+    """LRU cache from source text to parsed tree, with hit/miss counters.
+
+    ``last`` is how the most recent ``parse`` was answered: "hit" (this
+    process), "shared" (the store) or "miss" (parsed).
+    """
+
+    def __init__(self, maxsize=DEFAULT_SIZE, store=None):
+        self.maxsize = maxsize
+        self.store = store
+        self.trees = collections.OrderedDict()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.last = None
+
+    def parse(self, code):
+        """Return the tree of ``code``; parse errors propagate and are not cached."""
+        key = source_hash(code)
+        tree = self.trees.get(key)
+        if tree is not None:
+            self.trees.move_to_end(key)
+            self.hits += 1
+            self.last = "hit"
+            return tree
+
+        tree = self.store.get(key) if self.store is not None else None
+        if tree is not None:
+            self.shared_hits += 1
+            self.last = "shared"
+        else:
+            self.misses += 1
+            self.last = "miss"
+            tree = parse(code)
+            if tree is None:
+                return None
+            if self.store is not None:
+                self.store.put(key, tree)
+
+        self.trees[key] = tree
+        if len(self.trees) > self.maxsize:
+            self.trees.popitem(last=False)
+        return tree
+
+    def stats(self):
+        return {"size": len(self.trees), "maxsize": self.maxsize, "hits": self.hits,
+                "shared_hits": self.shared_hits, "misses": self.misses}
@@ -0,0 +1,61 @@
+"""Array-literal cost on the VM versus the depth of the operand stack.
+
+Each level of a non-tail recursion leaves a pending operand on the stack,
+then builds a few array literals. Building an array should only touch its
+own elements, so the time per literal should stay flat as the recursion,
+and with it the operand stack, gets deeper. A flat loop of literals is
+timed as well.
+
+Usage (after `pip install -e .`): python benchmarks/bench_array_literals.py
+"""
+import time
+
+from koalacode.cache import compile_source
+from koalacode.vm import VM
+
+LITERALS = 4
+
+NESTED = """
+func build(n) {
+    this (n < 1) { return 0; }
+    a = [n, n + 1, n + 2];
+    b = [a, []];
+    c = [a[1], n];
+    return 1 + build(n - 1);
+}
+total = 0;
+iter2(i = 0; i < %d; i = i + 1) { total = total + build(%d); }
+"""
+
+FLAT = """
+iter2(i = 0; i < %d; i = i + 1) { a = [i, i, i]; b = [a, []]; c = [a[1], i]; }
+"""
+
+
+def best_of(run, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def time_vm(source):
+    bytecode, funcs = compile_source(source)
+    return best_of(lambda: VM(funcs, jit=False, memoize=False).run(bytecode))
+
+
+def main():
+    literals = 40000
+    flat = time_vm(FLAT % (literals // LITERALS))
+    print(f"flat loop: {flat / literals * 1e9:.0f} ns per literal")
+    print(f"{'depth':>6} {'ns per literal':>15}")
+    for depth in (10, 100, 1000, 5000):
+        rounds = max(1, literals // (LITERALS * depth))
+        seconds = time_vm(NESTED % (rounds, depth))
+        print(f"{depth:>6} {seconds / (rounds * depth * LITERALS) * 1e9:>15.0f}")
+
+
+if __name__ == "__main__":
+    main()
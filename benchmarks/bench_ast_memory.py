@@ -0,0 +1,45 @@
+"""Memory held by the AST of a large generated program.
+
+Measures the peak traced memory while parsing (tokens come lazily from the
+source, so they are not counted) and the size of the finished tree, and
+how much of it is the position table.
+
+Usage (after `pip install -e .`): python benchmarks/bench_ast_memory.py [MB]
+"""
+import gc
+import sys
+import time
+import tracemalloc
+
+from koalacode.lexer import iter_tokens
+from koalacode.parser import Parser
+
+from bench_parser import make_source
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    seconds = time.perf_counter() - start
+    kept, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, kept, peak, seconds
+
+
+def main():
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 1
+    code = make_source(megabytes)
+    tree, kept, peak, seconds = measure(lambda: Parser(iter_tokens(code)).parse())
+    print(f"{len(code) / 2**20:.1f} MB source")
+    print(f"  parse: peak {peak / 2**20:.1f} MB, kept {kept / 2**20:.1f} MB "
+          f"({seconds:.2f}s under tracemalloc)")
+    positions = tree.positions
+    table = (sys.getsizeof(positions.nodes) + sys.getsizeof(positions.lines)
+             + sys.getsizeof(positions.cols))
+    print(f"  position table: {table / 2**20:.1f} MB for {len(positions.nodes)} nodes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Load test for the backend's worker pool: throughput against pool size.
+
+Sends a batch of CPU-bound programs to a ``KoalaPool`` with 1, 2, 4, ...
+workers, up to twice the number of CPUs, all at once, and reports
+programs per second and latency. Throughput should grow with the workers
+until they outnumber the cores, then stay flat.
+
+With ``--url`` the same load goes over HTTP to a running server instead
+(e.g. ``uvicorn main:app --port 8000`` in backend/), with ``--clients``
+concurrent connections, followed by the server's /metrics.
+
+Usage (after `pip install -e .`):
+    python benchmarks/bench_backend_pool.py [--requests N]
+    python benchmarks/bench_backend_pool.py --url http://127.0.0.1:8000 [--clients N]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from koala_pool import KoalaPool, _percentile  # noqa: E402
+
+PROGRAM = """
+s = 0;
+iter2(i = 0; i < 20000; i = i + 1) { s = s + i * 2; }
+give(s);
+"""
+
+
+async def load_pool(workers, requests):
+    pool = KoalaPool(workers=workers, timeout=60)
+    await pool.start()
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*(pool.run(PROGRAM) for _ in range(requests)))
+        seconds = time.perf_counter() - start
+    finally:
+        await pool.close()
+    return seconds, pool.metrics.snapshot()
+
+
+def bench_pool(requests):
+    cpus = os.cpu_count() or 1
+    sizes = []
+    size = 1
+    while size <= 2 * cpus:
+        sizes.append(size)
+        size *= 2
+    print(f"{cpus} CPUs, {requests} requests per run")
+    print(f"{'workers':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'max queue':>10}")
+    for workers in sizes:
+        seconds, metrics = asyncio.run(load_pool(workers, requests))
+        latency = metrics["latency_ms"]
+        print(f"{workers:>7} {requests / seconds:>8.1f} {latency['p50']:>8.1f} "
+              f"{latency['p99']:>8.1f} {metrics['max_queue_depth']:>10}")
+
+
+def post(url, code):
+    request = urllib.request.Request(
+        url + "/run", data=json.dumps({"code": code}).encode(),
+        headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    with urllib.request.urlopen(request) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def bench_server(url, requests, clients):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as executor:
+        latencies = list(executor.map(lambda _: post(url, PROGRAM), range(requests)))
+    seconds = time.perf_counter() - start
+    print(f"{requests} requests, {clients} clients: {requests / seconds:.1f} req/s, "
+          f"p50 {_percentile(latencies, 0.5) * 1000:.1f} ms, "
+          f"p99 {_percentile(latencies, 0.99) * 1000:.1f} ms")
+    with urllib.request.urlopen(url + "/metrics") as response:
+        print("server metrics:", response.read().decode())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--url", help="load a running server instead of an in-process pool")
+    parser.add_argument("--clients", type=int, default=16)
+    args = parser.parse_args()
+    if args.url:
+        bench_server(args.url.rstrip("/"), args.requests, args.clients)
+    else:
+        bench_pool(args.requests)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Cold versus warm start with the .koc bytecode cache.
+
+Cold: tokenize, parse and compile the source, then write the .koc file.
+Warm: read the .koc file back. Both are timed on generated programs of
+increasing size.
+
+Usage (after `pip install -e .`): python benchmarks/bench_cache.py
+"""
+import os
+import shutil
+import tempfile
+import time
+
+from koalacode.cache import cache_path, load_program
+
+FUNC = """
+func f%(i)d(a, b) {
+    t = 0;
+    iter2(k = 0; k < a; k = k + 1) {
+        this (k > b) { t = t + k * 2; } otherwise { t = t - 1; }
+    }
+    return t;
+}
+give(f%(i)d(%(i)d, 3));
+"""
+
+
+def make_program(n_funcs):
+    return "".join(FUNC % {"i": i} for i in range(n_funcs))
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    try:
+        print(f"{'functions':>10} {'source KB':>10} {'cold':>9} {'warm':>9} {'speedup':>8}")
+        for n_funcs in (10, 100, 1000):
+            code = make_program(n_funcs)
+            path = os.path.join(tmp, f"prog{n_funcs}.ko")
+
+            start = time.perf_counter()
+            load_program(code, path)
+            cold = time.perf_counter() - start
+            assert os.path.exists(cache_path(path))
+
+            warm = min(_timed(lambda: load_program(code, path)) for _ in range(5))
+            print(f"{n_funcs:>10} {len(code) / 1024:>10.1f} {cold * 1000:>7.2f}ms "
+                  f"{warm * 1000:>7.2f}ms {cold / warm:>7.1f}x")
+    finally:
+        shutil.rmtree(tmp)
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    main()
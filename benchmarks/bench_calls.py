@@ -0,0 +1,68 @@
+"""Function-call cost versus the number of live globals.
+
+Runs fib(N) after defining an increasing number of unrelated globals. With
+per-call scopes the time per run should stay flat as the global count grows.
+
+Usage (after `pip install -e .`): python benchmarks/bench_calls.py [N]
+"""
+import sys
+import time
+
+from koalacode.lexer import tokenize
+from koalacode.parser import Parser
+from koalacode.interpreter import Interpreter
+from koalacode.compiler import Compiler
+from koalacode.assembler import assemble_program
+from koalacode.vm import VM
+
+FIB = """
+func fib(n) {
+    this (n <= 1) { return n; } otherwise { return fib(n - 1) + fib(n - 2); }
+}
+result = fib(%d);
+"""
+
+
+def make_program(n_globals, n):
+    pad = "".join(f"g{i} = {i};\n" for i in range(n_globals))
+    return pad + FIB % n
+
+
+def call_cost(timer, n_globals, n):
+    """Time of the fib call alone: the full program minus its setup."""
+    return timer(make_program(n_globals, n)) - timer(make_program(n_globals, 0))
+
+
+def best_of(run, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def time_interpreter(code):
+    ast = Parser(tokenize(code)).parse()
+    return best_of(lambda: Interpreter().eval(ast))
+
+
+def time_vm(code):
+    comp = Compiler()
+    comp.compile(Parser(tokenize(code)).parse())
+    code = assemble_program(comp.bytecode, comp.funcs)
+    return best_of(lambda: VM(comp.funcs).run(code))
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print(f"fib({n})")
+    print(f"{'globals':>8} {'interpreter':>12} {'vm':>8}")
+    for n_globals in (0, 10, 100, 1000, 10000):
+        interp = call_cost(time_interpreter, n_globals, n)
+        vm = call_cost(time_vm, n_globals, n)
+        print(f"{n_globals:>8} {interp:>11.3f}s {vm:>7.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Packed ``assembler.Code`` versus lists of ``(opcode, arg)`` tuples.
+
+Compiles a large generated program and compares, for both forms of the
+same bytecode, the memory held, the size of the marshalled data and the
+time to load it back.
+
+Usage (after `pip install -e .`): python benchmarks/bench_code_format.py [MB]
+"""
+import gc
+import marshal
+import sys
+import time
+import tracemalloc
+
+from koalacode.assembler import Code
+from koalacode.cache import compile_source
+
+from bench_parser import make_source
+
+
+def held(build):
+    """Memory still allocated by what ``build`` returns."""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    kept = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, kept
+
+
+def best_of(run, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 0.3
+    bytecode, funcs = compile_source(make_source(megabytes))
+    codes = [bytecode] + [f.code for f in funcs.values()]
+    count = sum(len(c) for c in codes)
+    print(f"{count} instructions in {len(codes)} code objects")
+
+    lists, list_bytes = held(lambda: [c.instructions() for c in codes])
+    packed, packed_bytes = held(lambda: [Code.from_tuple(c.to_tuple()) for c in codes])
+    list_data = marshal.dumps(lists)
+    packed_data = marshal.dumps([c.to_tuple() for c in codes])
+    list_load = best_of(lambda: marshal.loads(list_data))
+    packed_load = best_of(lambda: [Code.from_tuple(t) for t in marshal.loads(packed_data)])
+
+    print(f"{'':>8} {'memory':>10} {'marshal':>10} {'load':>8}")
+    print(f"{'tuples':>8} {list_bytes / 2**20:>8.2f}MB {len(list_data) / 1024:>8.0f}KB "
+          f"{list_load * 1000:>6.1f}ms")
+    print(f"{'packed':>8} {packed_bytes / 2**20:>8.2f}MB {len(packed_data) / 1024:>8.0f}KB "
+          f"{packed_load * 1000:>6.1f}ms  (with line table)")
+
+
+if __name__ == "__main__":
+    main()
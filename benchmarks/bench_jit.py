@@ -0,0 +1,80 @@
+"""Tiered compilation of hot VM functions.
+
+Runs call- and loop-heavy programs on the VM with the JIT off and on and
+prints which functions were promoted.
+
+Usage (after `pip install -e .`): python benchmarks/bench_jit.py [threshold]
+"""
+import sys
+import time
+
+from koalacode.cache import compile_source
+from koalacode.vm import VM, JIT_THRESHOLD
+
+PROGRAMS = {
+    "fib": """
+func fib(n) {
+    this (n <= 1) { return n; } otherwise { return fib(n - 1) + fib(n - 2); }
+}
+r = fib(22);
+""",
+    "primes": """
+func is_prime(n) {
+    this (n < 2) { return false; }
+    d = 2;
+    iter (d * d <= n) {
+        this (n - n / d * d < 1) { return false; }
+        d = d + 1;
+    }
+    return true;
+}
+count = 0;
+iter2 (k = 2; k < 20000; k = k + 1) {
+    this (is_prime(k)) { count = count + 1; }
+}
+""",
+    "sort": """
+func sort(a, n) {
+    iter2 (i = 0; i < n; i = i + 1) {
+        iter2 (j = 0; j < n - 1 - i; j = j + 1) {
+            this (a[j] > a[j + 1]) { t = a[j]; a[j] = a[j + 1]; a[j + 1] = t; }
+        }
+    }
+    return a;
+}
+a = [];
+iter2 (k = 0; k < 300; k = k + 1) { a = a + [(k * 7919) - (k * 7919) / 300 * 300]; }
+s = sort(a, 300);
+""",
+}
+
+
+def best_of(run, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    threshold = int(sys.argv[1]) if len(sys.argv) > 1 else JIT_THRESHOLD
+    print(f"jit threshold {threshold}")
+    print(f"{'program':>8} {'interpreted':>12} {'jit':>8}")
+    for name, code in PROGRAMS.items():
+        bytecode, funcs = compile_source(code)
+        off = best_of(lambda: VM(funcs, jit=False).run(bytecode))
+        on = best_of(lambda: VM(funcs, jit_threshold=threshold).run(bytecode))
+        print(f"{name:>8} {off:11.3f}s {on:7.3f}s")
+
+    print()
+    for name, code in PROGRAMS.items():
+        bytecode, funcs = compile_source(code)
+        vm = VM(funcs, jit_threshold=threshold)
+        vm.run(bytecode)
+        print(name, vm.jit_stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Lexing throughput on large generated sources.
+
+Compares the list-building ``tokenize``, the lazy ``iter_tokens`` and the
+columnar ``TokenStore`` in MB/s, and the memory each keeps per token.
+
+Usage (after `pip install -e .`): python benchmarks/bench_lexer.py [MB]
+"""
+import sys
+import time
+import tracemalloc
+from collections import deque
+
+from koalacode.lexer import TokenStore, iter_tokens, tokenize
+from koalacode.parser import Parser
+
+CHUNK = """
+# running total
+func step%(i)d(a, b) {
+    t = a * 3 + b / 2;
+    this (t >= 100 && a != b) { t = t - 100; } otherwise { t = t + 1; }
+    return t;
+}
+xs = [1, 2, 3, %(i)d];
+name = "chunk %(i)d";
+iter2(k = 0; k < len(xs); k = k + 1) { total = step%(i)d(k, xs[k]); }
+"""
+
+
+def make_source(megabytes):
+    parts, size, i = [], 0, 0
+    while size < megabytes * 1024 * 1024:
+        part = CHUNK % {"i": i}
+        parts.append(part)
+        size += len(part)
+        i += 1
+    return "".join(parts)
+
+
+def best_of(run, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def kept_bytes(build):
+    tracemalloc.start()
+    kept = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def main():
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    code = make_source(megabytes)
+    mb = len(code) / (1024 * 1024)
+    ntokens = len(tokenize(code))
+    print(f"source {mb:.1f} MB, {ntokens} tokens")
+
+    runs = {
+        "tokenize (list)": lambda: tokenize(code),
+        "iter_tokens": lambda: deque(iter_tokens(code), maxlen=0),
+        "TokenStore": lambda: TokenStore.from_source(code),
+        "parse, list": lambda: Parser(tokenize(code)).parse(),
+        "parse, lazy": lambda: Parser(iter_tokens(code)).parse(),
+    }
+    for name, run in runs.items():
+        seconds = best_of(run)
+        print(f"{name:>16} {mb / seconds:7.2f} MB/s")
+
+    print()
+    for name, build in (("token list", lambda: tokenize(code)),
+                        ("TokenStore", lambda: TokenStore.from_source(code))):
+        print(f"{name:>16} {kept_bytes(build) / ntokens:7.1f} bytes/token")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Overhead of running with limits (fuel and memory metering).
+
+Times each program on the Interpreter and on the VM without limits, with
+only a fuel limit and with all three limits, each large enough never to run
+out, and prints the slowdowns. A VM with limits does not JIT, so the VM is
+compared with the JIT off throughout. Runs alternate between the
+configurations with the garbage collector off, and the best time of each is
+kept.
+
+Usage (after `pip install -e .`): python benchmarks/bench_limits.py
+"""
+import contextlib
+import gc
+import glob
+import io
+import os
+import time
+
+from koalacode.cache import compile_source
+from koalacode.interpreter import Interpreter
+from koalacode.lexer import iter_tokens
+from koalacode.limits import Limits
+from koalacode.parser import Parser
+from koalacode.vm import VM
+
+FUEL = Limits(fuel=10 ** 12)
+LIMITS = Limits(fuel=10 ** 12, array_elements=10 ** 12, string_chars=10 ** 12)
+
+PROGRAMS = {
+    "loop": """
+s = 0;
+iter2(i = 0; i < 200000; i = i + 1) { s = s + i * 2; }
+give(s);
+""",
+    "function loop": """
+func f(n) { s = 0; iter2(i = 0; i < n; i = i + 1) { s = s + i * 2; } return s; }
+give(f(200000));
+""",
+    "calls": """
+func add(a, b) { return a + b; }
+s = 0;
+iter2(i = 0; i < 50000; i = i + 1) { s = add(s, i); }
+give(s);
+""",
+    "fib": """
+func fib(n) { this (n < 2) { return n; } return fib(n - 1) + fib(n - 2); }
+give(fib(20));
+""",
+    "strings and arrays": """
+func f(n) {
+    s = "";
+    iter2(i = 0; i < n; i = i + 1) { a = [i, i + 1]; s = s + "x"; }
+    return len(s);
+}
+give(f(20000));
+""",
+}
+
+
+def interp_runner(source, limits):
+    tree = Parser(iter_tokens(source)).parse()
+    return lambda: Interpreter(memoize=False, limits=limits).eval(tree)
+
+
+def vm_runner(source, limits):
+    def run():
+        code, funcs = compile_source(source)
+        VM(funcs, jit=False, memoize=False, limits=limits).run(code)
+    return run
+
+
+def compare(make_runner, source, repeat=9):
+    runs = [make_runner(source, limits) for limits in (None, FUEL, LIMITS)]
+    best = [float("inf")] * len(runs)
+    gc.disable()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(repeat):
+                for i, run in enumerate(runs):
+                    start = time.perf_counter()
+                    run()
+                    best[i] = min(best[i], time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return best
+
+
+def main():
+    root = os.path.join(os.path.dirname(__file__), "..")
+    programs = dict(PROGRAMS)
+    for path in sorted(glob.glob(os.path.join(root, "examples", "*.ko"))):
+        with open(path, encoding="utf-8") as f:
+            programs[os.path.basename(path)] = f.read()
+
+    print(f"{'program':<20} {'engine':<7} {'plain ms':>9} {'fuel ms':>8} {'overhead':>9} "
+          f"{'limits ms':>10} {'overhead':>9}")
+    for name, source in programs.items():
+        for engine, make_runner in (("interp", interp_runner), ("vm", vm_runner)):
+            plain, fuel, metered = compare(make_runner, source)
+            print(f"{name:<20} {engine:<7} {plain * 1000:>9.1f} {fuel * 1000:>8.1f} "
+                  f"{(fuel / plain - 1) * 100:>8.1f}% {metered * 1000:>10.1f} "
+                  f"{(metered / plain - 1) * 100:>8.1f}%")
+
+
+if __name__ == "__main__":
+    main()
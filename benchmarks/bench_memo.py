@@ -0,0 +1,66 @@
+"""Automatic memoization of pure functions.
+
+Runs recursive programs on both engines with memoization off and on and
+prints the cache hit rates.
+
+Usage (after `pip install -e .`): python benchmarks/bench_memo.py
+"""
+import time
+
+from koalacode.cache import compile_source
+from koalacode.interpreter import Interpreter
+from koalacode.lexer import tokenize
+from koalacode.parser import Parser
+from koalacode.vm import VM
+
+PROGRAMS = {
+    "fib": """
+func fib(n) {
+    this (n <= 1) { return n; } otherwise { return fib(n - 1) + fib(n - 2); }
+}
+r = fib(24);
+""",
+    "paths": """
+func paths(r, c) {
+    this (r < 1) { return 1; }
+    this (c < 1) { return 1; }
+    return paths(r - 1, c) + paths(r, c - 1);
+}
+p = paths(10, 10);
+""",
+}
+
+
+def best_of(run, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    print(f"{'program':>8} {'engine':>7} {'off':>8} {'on':>8}")
+    for name, code in PROGRAMS.items():
+        off = best_of(lambda: Interpreter(memoize=False).eval(Parser(tokenize(code)).parse()))
+        on = best_of(lambda: Interpreter().eval(Parser(tokenize(code)).parse()))
+        print(f"{name:>8} {'interp':>7} {off:7.3f}s {on:7.3f}s")
+        bytecode, funcs = compile_source(code)
+        off = best_of(lambda: VM(funcs, memoize=False).run(bytecode))
+        on = best_of(lambda: VM(funcs).run(bytecode))
+        print(f"{name:>8} {'vm':>7} {off:7.3f}s {on:7.3f}s")
+
+    print()
+    for name, code in PROGRAMS.items():
+        interp = Interpreter()
+        interp.eval(Parser(tokenize(code)).parse())
+        bytecode, funcs = compile_source(code)
+        vm = VM(funcs)
+        vm.run(bytecode)
+        print(name, "interp", interp.memo_stats())
+        print(name, "vm", vm.memo_stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Cost of output-heavy programs with each output sink.
+
+Each program gives every value of a long loop. It runs on the Interpreter,
+the VM and the Python backend with these sinks (see koalacode.streams):
+
+print      print() once per value, what engines did before sinks
+per line   BufferedOutput flushing the file after every line, as a
+           terminal's line buffering does
+batched    BufferedOutput with its default batch size
+list       ListOutput, keeping the lines in memory
+callback   CallbackOutput handing batches to a function
+
+File sinks write to a temporary file. The best of several runs is kept.
+
+Usage (after `pip install -e .`): python benchmarks/bench_output.py
+"""
+import contextlib
+import tempfile
+import time
+
+from koalacode.cache import compile_source
+from koalacode.interpreter import Interpreter
+from koalacode.lexer import iter_tokens
+from koalacode.parser import Parser
+from koalacode.streams import BufferedOutput, CallbackOutput, ListOutput
+from koalacode.transpiler import run as run_program, transpile_source
+from koalacode.vm import VM
+
+PROGRAMS = {
+    "ints": """
+iter2(i = 0; i < 100000; i = i + 1) { give(i); }
+""",
+    "strings": """
+s = "koala";
+iter2(i = 0; i < 100000; i = i + 1) { give(s); }
+""",
+    "in a function": """
+func count(n) { iter2(i = 0; i < n; i = i + 1) { give(i * 2); } return n; }
+count(100000);
+""",
+}
+
+
+class PrintOutput:
+    """Calls print() for every value, as give did before output sinks."""
+
+    def write(self, value):
+        print(value)
+
+    def flush(self):
+        pass
+
+
+def sinks(file):
+    return {
+        "print": PrintOutput,
+        "per line": lambda: BufferedOutput(file, size=1),
+        "batched": lambda: BufferedOutput(file),
+        "list": ListOutput,
+        "callback": lambda: CallbackOutput(lambda text: None),
+    }
+
+
+def interp_runner(source):
+    tree = Parser(iter_tokens(source)).parse()
+    return lambda output: Interpreter(output=output).eval(tree)
+
+
+def vm_runner(source):
+    code, funcs = compile_source(source)
+    return lambda output: VM(funcs, output=output).run(code)
+
+
+def py_runner(source):
+    program = transpile_source(source)
+    return lambda output: run_program(program, output=output)
+
+
+def best_of(run, make_output, repeat=5):
+    times = []
+    for _ in range(repeat):
+        output = make_output()
+        start = time.perf_counter()
+        run(output)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    # CPython specializes VM.run only after a few calls; warm it up first.
+    code, funcs = compile_source("x = 1;")
+    for _ in range(10):
+        VM(funcs).run(code)
+
+    with tempfile.TemporaryFile("w") as file, contextlib.redirect_stdout(file):
+        outputs = sinks(file)
+        rows = []
+        for name, source in PROGRAMS.items():
+            for engine, make_runner in (("interp", interp_runner), ("vm", vm_runner),
+                                        ("py", py_runner)):
+                run = make_runner(source)
+                rows.append((name, engine, {sink: best_of(run, make_output)
+                                            for sink, make_output in outputs.items()}))
+
+    print(f"{'program':<14} {'engine':<7}" + "".join(f"{sink + ' ms':>13}" for sink in outputs))
+    for name, engine, times in rows:
+        print(f"{name:<14} {engine:<7}" + "".join(f"{t * 1000:>13.1f}" for t in times.values()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Parse throughput on large generated programs.
+
+Tokens are produced up front so only the parser is timed. Also parses a
+program with deeply nested blocks, which the parser handles without
+recursing per level.
+
+Usage (after `pip install -e .`): python benchmarks/bench_parser.py [MB]
+"""
+import sys
+import time
+
+from koalacode.lexer import TokenStore
+from koalacode.parser import Parser
+
+CHUNK = """
+func step%(i)d(a, b) {
+    t = a * 3 + b / 2 - (a - b) * (a + 1);
+    this (t >= 100 && a != b || t < 0 - 100) { t = t - 100; } otherwise { t = t + 1; }
+    iter (t > 10) { t = t / 2; }
+    return t;
+}
+xs = [1 + 2, 3 * 4, %(i)d, step%(i)d(1, 2)];
+iter2(k = 0; k < len(xs); k = k + 1) { total = step%(i)d(k, xs[k]); }
+"""
+
+
+def make_source(megabytes):
+    parts, size, i = [], 0, 0
+    while size < megabytes * 1024 * 1024:
+        part = CHUNK % {"i": i}
+        parts.append(part)
+        size += len(part)
+        i += 1
+    return "".join(parts)
+
+
+def make_nested(depth):
+    return "this (x < 1) {\n" * depth + "x = 1;\n" + "}\n" * depth
+
+
+def best_of(run, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 1
+    code = make_source(megabytes)
+    tokens = TokenStore.from_source(code)
+    seconds = best_of(lambda: Parser(tokens).parse())
+    mb = len(code) / (1024 * 1024)
+    print(f"{mb:.1f} MB, {len(tokens)} tokens: {seconds:.3f}s, "
+          f"{mb / seconds:.2f} MB/s, {len(tokens) / seconds / 1e6:.2f} Mtokens/s")
+
+    for depth in (100, 1000, 10000):
+        tokens = TokenStore.from_source(make_nested(depth))
+        seconds = best_of(lambda: Parser(tokens).parse())
+        print(f"nesting depth {depth:>6}: {seconds * 1000:8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Cost of getting a tree from the backend's program cache.
+
+For each example program, times a parse from source (a miss), a hit in
+the in-process LRU and a hit in the shared SQLite store, and compares
+them with a full run_koala_code call that hits the cache.
+
+Usage (after `pip install -e .`): python benchmarks/bench_program_cache.py
+"""
+import glob
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from koala_runner import program_cache, run_koala_code  # noqa: E402
+from program_cache import ProgramCache, SQLiteStore, parse  # noqa: E402
+
+
+def best_of(run, repeat=200):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    root = os.path.join(os.path.dirname(__file__), "..")
+    with tempfile.TemporaryDirectory() as directory:
+        store = SQLiteStore(os.path.join(directory, "programs.db"))
+        print(f"{'program':<16} {'parse us':>9} {'hit us':>7} {'shared us':>10} {'run us':>8}")
+        for path in sorted(glob.glob(os.path.join(root, "examples", "*.ko"))):
+            with open(path, encoding="utf-8") as f:
+                code = f.read()
+            ProgramCache(store=store).parse(code)
+            local = ProgramCache()
+            local.parse(code)
+            if "take(" in code:
+                run = None
+            else:
+                run_koala_code(code)
+                run = best_of(lambda: run_koala_code(code), 20)
+            print(f"{os.path.basename(path):<16} "
+                  f"{best_of(lambda: parse(code)) * 1e6:>9.0f} "
+                  f"{best_of(lambda: local.parse(code)) * 1e6:>7.1f} "
+                  f"{best_of(lambda: ProgramCache(store=store).parse(code), 50) * 1e6:>10.0f} "
+                  f"{'-' if run is None else f'{run * 1e6:.0f}':>8}")
+    print("runner cache:", program_cache.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Adaptive specialization (quickening) in the VM.
+
+Runs integer-heavy loops and a string loop with quickening off and on, then
+prints how many instructions were specialized and how often their type
+guards hit or missed.
+
+Usage (after `pip install -e .`): python benchmarks/bench_quicken.py
+"""
+import time
+
+from koalacode.cache import compile_source
+from koalacode.vm import VM
+
+PROGRAMS = {
+    "fib": """
+func fib(n) {
+    this (n <= 1) { return n; } otherwise { return fib(n - 1) + fib(n - 2); }
+}
+r = fib(20);
+""",
+    "count": """
+s = 0;
+iter2 (i = 0; i < 300000; i = i + 1) { s = s + i; }
+""",
+    "strings": """
+func pad(s, n) {
+    iter2 (i = 0; i < n; i = i + 1) { s = s + "."; }
+    return s;
+}
+iter2 (k = 0; k < 300; k = k + 1) { r = pad("", 200); }
+""",
+}
+
+
+def best_of(run, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def time_vm(code, quicken):
+    def run():
+        # Quickening rewrites the code lists, so compile afresh every run.
+        bytecode, funcs = compile_source(code)
+        VM(funcs, quicken=quicken).run(bytecode)
+    return best_of(run)
+
+
+def main():
+    print(f"{'program':>8} {'generic':>9} {'quickened':>10}")
+    for name, code in PROGRAMS.items():
+        generic = time_vm(code, False)
+        quickened = time_vm(code, True)
+        print(f"{name:>8} {generic:9.3f}s {quickened:9.3f}s")
+
+    print()
+    for name, code in PROGRAMS.items():
+        bytecode, funcs = compile_source(code)
+        vm = VM(funcs, stats=True)
+        vm.run(bytecode)
+        print(name, vm.specialization_stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Stack VM versus register VM: instructions executed and wall-clock time.
+
+Both engines run the same programs. The stack VM runs without its JIT and
+memoization, so the two interpreters are compared like for like; its
+optimizer and quickening stay on. Instructions are counted in a separate
+run with a counting wrapper around every handler.
+
+Usage (after `pip install -e .`): python benchmarks/bench_register_vm.py
+"""
+import contextlib
+import glob
+import io
+import os
+import time
+
+from koalacode.cache import compile_source
+from koalacode.regcompiler import compile_source as compile_registers
+from koalacode.regvm import RegisterVM
+from koalacode.vm import VM
+
+PROGRAMS = {
+    "globals loop": """
+s = 0;
+iter2(i = 0; i < 100000; i = i + 1) { s = s + i * 2; }
+give(s);
+""",
+    "locals loop": """
+func f(n) { s = 0; iter2(i = 0; i < n; i = i + 1) { s = s + i * 2; } return s; }
+give(f(100000));
+""",
+    "array updates": """
+func f(n) {
+    a = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0];
+    iter2(i = 0; i < n; i = i + 1) { a[i / 10000] = a[i / 10000] + 1; }
+    return a[3];
+}
+give(f(100000));
+""",
+    "fib": """
+func fib(n) { this (n < 2) { return n; } return fib(n - 1) + fib(n - 2); }
+give(fib(18));
+""",
+}
+
+ENGINES = {
+    "stack": (compile_source, lambda funcs: VM(funcs, jit=False, memoize=False)),
+    "register": (compile_registers, RegisterVM),
+}
+
+
+def count_instructions(vm):
+    """Wrap every handler of ``vm``; return the list holding the count."""
+    count = [0]
+
+    def counting(handler):
+        def run(*operands):
+            count[0] += 1
+            handler(*operands)
+        return run
+    vm.handlers = [counting(h) for h in vm.handlers]
+    return count
+
+
+def measure(engine, source, repeat=5):
+    compile_program, make_vm = ENGINES[engine]
+    with contextlib.redirect_stdout(io.StringIO()):
+        code, funcs = compile_program(source)
+        vm = make_vm(funcs)
+        count = count_instructions(vm)
+        vm.run(code)
+        best = None
+        for _ in range(repeat):
+            code, funcs = compile_program(source)
+            vm = make_vm(funcs)
+            start = time.perf_counter()
+            vm.run(code)
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+    return count[0], best
+
+
+def main():
+    root = os.path.join(os.path.dirname(__file__), "..")
+    programs = dict(PROGRAMS)
+    for path in sorted(glob.glob(os.path.join(root, "examples", "*.ko"))):
+        with open(path, encoding="utf-8") as f:
+            programs[os.path.basename(path)] = f.read()
+
+    print(f"{'program':<16} {'stack ins':>10} {'reg ins':>10} {'ratio':>6} "
+          f"{'stack ms':>9} {'reg ms':>9} {'ratio':>6}")
+    for name, source in programs.items():
+        stack_count, stack_time = measure("stack", source)
+        reg_count, reg_time = measure("register", source)
+        print(f"{name:<16} {stack_count:>10} {reg_count:>10} {reg_count / stack_count:>6.2f} "
+              f"{stack_time * 1000:>9.1f} {reg_time * 1000:>9.1f} {reg_time / stack_time:>6.2f}")
+
+
+if __name__ == "__main__":
+    main()
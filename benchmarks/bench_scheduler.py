@@ -0,0 +1,118 @@
+"""Fairness and latency of programs sharing one thread through VM.run_async.
+
+Three measurements:
+
+overhead   one program alone, VM.run against VM.run_async
+fairness   N copies of the same long program started together; with fair
+           turns they all finish close to the end, so the spread between
+           the first and last to finish is small
+latency    a short program submitted while N long programs are running,
+           for several time slices, against running it alone and against
+           waiting for the long programs to finish one after another
+
+The VMs run without the JIT, which tasks do not use, and without
+memoization, which would answer most of the short program's calls.
+
+Usage (after `pip install -e .`): python benchmarks/bench_scheduler.py
+"""
+import asyncio
+import time
+
+from koalacode.cache import compile_source
+from koalacode.vm import VM
+
+LONG = """
+s = 0;
+iter2(i = 0; i < 100000; i = i + 1) { s = s + i; }
+"""
+
+SHORT = """
+func fib(n) { this (n < 2) { return n; } return fib(n - 1) + fib(n - 2); }
+x = fib(14);
+"""
+
+SLICES = (100, 1000, 10000)
+
+
+def best_of(run, repeat=7):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def new_vm(program):
+    code, funcs = compile_source(program)
+    return VM(funcs, jit=False, memoize=False), code
+
+
+async def timed(program, time_slice, start):
+    """Run ``program`` as a task; return its finish time since ``start``."""
+    vm, code = new_vm(program)
+    await vm.run_async(code, time_slice=time_slice)
+    return time.perf_counter() - start
+
+
+def overhead():
+    # CPython specializes a function's bytecode only after it has been
+    # called a few times, and VM.run is a single long call: warm it up so
+    # the comparison is with a specialized run loop.
+    vm, code = new_vm("x = 1;")
+    for _ in range(10):
+        vm.run(code)
+    vm, code = new_vm(LONG)
+    plain = best_of(lambda: vm.run(code))
+    print(f"{'overhead':<10} run {plain * 1000:.1f} ms")
+    for time_slice in SLICES:
+        task = best_of(lambda: asyncio.run(vm.run_async(code, time_slice=time_slice)))
+        print(f"{'':<10} run_async slice={time_slice:<6} {task * 1000:.1f} ms "
+              f"({(task / plain - 1) * 100:+.1f}%)")
+
+
+def fairness(tasks=8):
+    async def race(time_slice):
+        start = time.perf_counter()
+        return await asyncio.gather(*(timed(LONG, time_slice, start) for _ in range(tasks)))
+
+    for time_slice in SLICES:
+        finished = asyncio.run(race(time_slice))
+        first, last = min(finished), max(finished)
+        print(f"{'fairness':<10} {tasks} tasks slice={time_slice:<6} first {first * 1000:.0f} ms, "
+              f"last {last * 1000:.0f} ms, spread {(last - first) / last * 100:.1f}%")
+
+
+def latency(background=4):
+    async def submit_alone():
+        return await timed(SHORT, 1000, time.perf_counter())
+
+    alone = min(asyncio.run(submit_alone()) for _ in range(7))
+    vm, code = new_vm(LONG)
+    queued = best_of(lambda: vm.run(code), 3) * background + alone
+    print(f"{'latency':<10} short program alone {alone * 1000:.2f} ms, "
+          f"after {background} long ones in turn {queued * 1000:.1f} ms")
+
+    async def submit(time_slice):
+        start = time.perf_counter()
+        running = [asyncio.ensure_future(timed(LONG, time_slice, start)) for _ in range(background)]
+        await asyncio.sleep(0)
+        submitted = time.perf_counter()
+        done = await timed(SHORT, time_slice, submitted)
+        await asyncio.gather(*running)
+        return done
+
+    for time_slice in SLICES:
+        waited = min(asyncio.run(submit(time_slice)) for _ in range(3))
+        print(f"{'':<10} with {background} long ones running, slice={time_slice:<6} "
+              f"{waited * 1000:.2f} ms")
+
+
+def main():
+    overhead()
+    fairness()
+    latency()
+
+
+if __name__ == "__main__":
+    main()
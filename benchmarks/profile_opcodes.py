@@ -0,0 +1,72 @@
+"""Dynamic opcode n-gram profile of the VM over a corpus of programs.
+
+Counts how often each sequence of 1-4 consecutive executed instructions
+occurs (sequences never span a jump or call). The most frequent sequences
+are the candidates for superinstructions. Programs are compiled at -O1 so
+that no superinstructions are present yet.
+
+Usage (after `pip install -e .`):
+    python benchmarks/profile_opcodes.py [program.ko ...]   (default: examples/*.ko)
+"""
+import collections
+import contextlib
+import glob
+import io
+import os
+import sys
+
+from koalacode.cache import compile_source
+from koalacode.opcodes import OPNAMES
+from koalacode.vm import STACK_SIZE, VM
+
+MAX_N = 4
+
+
+class ProfilingVM(VM):
+    def __init__(self, funcs, counts):
+        super().__init__(funcs)
+        self.counts = counts
+
+    def run(self, code):
+        self.code = code
+        self.ops = code.ops
+        self.args = code.operands or code.decode()
+        self.ip = 0
+        self.stack = [None] * max(STACK_SIZE, code.stacksize)
+        self.sp = 0
+        handlers = self.handlers
+        window = []
+        while self.ip < len(self.ops):
+            ip = self.ip
+            op, arg = self.ops[ip], self.args[ip]
+            self.ip += 1
+            window.append(op)
+            del window[:-MAX_N]
+            for n in range(1, len(window) + 1):
+                self.counts[tuple(window[-n:])] += 1
+            ops = self.ops
+            handlers[op](arg)
+            if self.ops is not ops or self.ip != ip + 1:
+                window = []
+
+
+def main():
+    root = os.path.join(os.path.dirname(__file__), "..")
+    paths = sys.argv[1:] or sorted(glob.glob(os.path.join(root, "examples", "*.ko")))
+    counts = collections.Counter()
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            bytecode, funcs = compile_source(f.read(), opt_level=1)
+        with contextlib.redirect_stdout(io.StringIO()):
+            ProfilingVM(funcs, counts).run(bytecode)
+
+    total = sum(c for seq, c in counts.items() if len(seq) == 1)
+    for n in range(1, MAX_N + 1):
+        print(f"\nTop {n}-grams")
+        top = sorted(((c, seq) for seq, c in counts.items() if len(seq) == n), reverse=True)
+        for c, seq in top[:10]:
+            print(f"{100 * c / total:6.2f}%  {' '.join(OPNAMES[op] for op in seq)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+# koalacode/assembler.py
+"""Packing of instruction lists into the ``Code`` objects the VM runs.
+
+The Compiler and the Optimizer work on lists of ``(opcode, arg, position)``
+instructions. ``assemble`` turns such a list into a ``Code``:
+
+* ``ops`` and ``args``: parallel ``array('i')`` of opcodes and operands;
+* ``consts``: the deduplicated constant pool. Constants, and the tuple
+  arguments of calls and superinstructions, are stored there and the
+  operand is their index;
+* ``names``: the global and function names used by the ``NAME_OPS``;
+* ``linetable``: the source positions, compressed (see
+  ``encode_linetable``) and only decoded when an error is reported;
+* ``stacksize``: the most operand stack slots the code uses at once (see
+  ``max_stack_depth``), so the VM can reserve them when a frame starts.
+
+Operands of the ``INT_OPS`` (slots, counts, jump targets) are stored as they
+are; ``NO_ARG_OPS`` store 0.
+
+The VM dispatches on ``ops`` and hands each handler its argument from
+``operands``, a list of the decoded arguments that ``decode`` builds the
+first time a ``Code`` runs. A function that is never called is never
+decoded, and quickening rewrites ``ops`` only.
+"""
+from array import array
+
+from .compiler import CompileError
+from .opcodes import (
+    NAME_OPS, INT_OPS, NO_ARG_OPS, JUMP, RETURN, JUMP_OPS, jump_target, stack_effect,
+)
+
+
+class Code:
+    """Packed bytecode of a module or function."""
+    __slots__ = ("ops", "args", "consts", "names", "linetable", "stacksize", "operands")
+
+    def __init__(self, ops, args, consts, names, linetable, stacksize):
+        self.ops = ops
+        self.args = args
+        self.consts = consts
+        self.names = names
+        self.linetable = linetable
+        self.stacksize = stacksize
+        self.operands = None
+
+    def __len__(self):
+        return len(self.ops)
+
+    def instruction(self, index):
+        """The ``(opcode, arg)`` at ``index`` with its argument decoded."""
+        op, arg = self.ops[index], self.args[index]
+        if op in NAME_OPS:
+            return op, self.names[arg]
+        if op in INT_OPS:
+            return op, arg
+        if op in NO_ARG_OPS:
+            return op, None
+        return op, self.consts[arg]
+
+    def instructions(self):
+        """All instructions as a list of ``(opcode, arg)`` pairs."""
+        return [self.instruction(i) for i in range(len(self.ops))]
+
+    def decode(self):
+        """Build, keep and return ``operands``."""
+        self.operands = [self.instruction(i)[1] for i in range(len(self.ops))]
+        return self.operands
+
+    def position(self, index):
+        """Source ``(line, col)`` of the instruction at ``index``, or None."""
+        return linetable_position(self.linetable, index)
+
+    def to_tuple(self):
+        """Plain data for ``marshal``; ``from_tuple`` reverses it."""
+        return (self.ops.tobytes(), self.args.tobytes(), tuple(self.consts),
+                tuple(self.names), self.linetable, self.stacksize)
+
+    @classmethod
+    def from_tuple(cls, data):
+        ops, args, consts, names, linetable, stacksize = data
+        return cls(array('i', ops), array('i', args), list(consts), list(names),
+                   linetable, stacksize)
+
+
+def _const_key(value):
+    """Dedup key for a constant: ``1``, ``True`` and ``(1,)`` stay distinct."""
+    if type(value) is tuple:
+        return (tuple, tuple(_const_key(v) for v in value))
+    return (type(value), value)
+
+
+def assemble(instructions):
+    """Pack a list of ``(opcode, arg, position)`` into a ``Code``."""
+    ops, args = array('i'), array('i')
+    consts, const_index = [], {}
+    names, name_index = [], {}
+    for op, arg, _ in instructions:
+        ops.append(op)
+        if op in NAME_OPS:
+            if arg not in name_index:
+                name_index[arg] = len(names)
+                names.append(arg)
+            args.append(name_index[arg])
+        elif op in INT_OPS:
+            args.append(arg)
+        elif op in NO_ARG_OPS:
+            args.append(0)
+        else:
+            key = _const_key(arg)
+            if key not in const_index:
+                const_index[key] = len(consts)
+                consts.append(arg)
+            args.append(const_index[key])
+    linetable = encode_linetable([pos for _, _, pos in instructions])
+    return Code(ops, args, consts, names, linetable, max_stack_depth(instructions))
+
+
+def max_stack_depth(instructions):
+    """Deepest the operand stack gets while running ``instructions``.
+
+    Follows every path from the first instruction. The Compiler leaves the
+    stack balanced at each statement, so paths that meet agree on the
+    depth; a disagreement means the bytecode is broken.
+    """
+    depths = {}
+    todo = [(0, 0)]
+    deepest = 0
+    while todo:
+        i, depth = todo.pop()
+        while i < len(instructions):
+            seen = depths.get(i)
+            if seen is not None:
+                if seen != depth:
+                    raise CompileError(f"Stack depth {depth} at {i} was {seen} on another path")
+                break
+            depths[i] = depth
+            op, arg, _ = instructions[i]
+            depth += stack_effect(op, arg)
+            if depth < 0:
+                raise CompileError(f"Operand stack underflow at {i}")
+            deepest = max(deepest, depth)
+            if op == RETURN:
+                break
+            if op in JUMP_OPS:
+                target = jump_target(op, arg)
+                if op == JUMP:
+                    i = target
+                    continue
+                todo.append((target, depth))
+            i += 1
+    return deepest
+
+
+def assemble_program(bytecode, funcs):
+    """Assemble module bytecode and, in place, every compiled function."""
+    for func in funcs.values():
+        func.code = assemble(func.code)
+    return assemble(bytecode)
+
+
+# The line table is a sequence of runs ``(count, line delta, col)``: the
+# next ``count`` instructions share one position, whose line is the
+# previous run's line plus ``line delta``. Numbers are varints, with the
+# line delta zigzag-encoded since it can be negative. Line 0 stands for an
+# unknown position.
+
+def _varint(out, n):
+    while n >= 0x80:
+        out.append(n & 0x7F | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def encode_linetable(positions):
+    """Compress a list of ``(line, col)`` positions, or None, into bytes."""
+    out = bytearray()
+    runs = []
+    for pos in positions:
+        pos = pos or (0, 0)
+        if runs and runs[-1][1] == pos:
+            runs[-1][0] += 1
+        else:
+            runs.append([1, pos])
+    line = 0
+    for count, (new_line, col) in runs:
+        delta = new_line - line
+        line = new_line
+        _varint(out, count)
+        _varint(out, delta << 1 if delta >= 0 else (-delta << 1) - 1)
+        _varint(out, col)
+    return bytes(out)
+
+
+def linetable_position(table, index):
+    """The position at ``index`` in a table from ``encode_linetable``, or None."""
+    line = 0
+    for count, line_delta, col in _decode(table):
+        line += line_delta
+        if index < count:
+            return (line, col) if line else None
+        index -= count
+    return None
+
+
+def _decode(table):
+    numbers = []
+    n = shift = 0
+    for byte in table:
+        n |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            numbers.append(n)
+            n = shift = 0
+    for i in range(0, len(numbers), 3):
+        count, delta, col = numbers[i:i + 3]
+        yield count, (delta >> 1) if not delta & 1 else -((delta + 1) >> 1), col
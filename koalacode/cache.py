@@ -0,0 +1,121 @@
+# koalacode/cache.py
+"""On-disk cache of compiled bytecode (.koc files).
+
+Like CPython's ``__pycache__``, compiled programs are written next to their
+source in a ``__koalacache__`` directory. A .koc file is::
+
+    MAGIC (4 bytes) | BYTECODE_VERSION (uint16) | optimization level (uint8)
+    | SHA-256 of source (32 bytes) | marshal((bytecode, functions))
+
+where the module and function code are packed ``assembler.Code`` objects in
+their ``to_tuple`` form, so loading is mostly copying byte strings into
+arrays.
+
+A cached file is only used when the version, optimization level and source
+hash all match, so editing the source, changing ``-O`` or upgrading the
+compiler transparently recompiles.
+"""
+import hashlib
+import marshal
+import os
+import struct
+
+from .assembler import Code, assemble_program
+from .compiler import Compiler, Function
+from .lexer import iter_tokens
+from .opcodes import BYTECODE_VERSION
+from .optimizer import DEFAULT_LEVEL, Optimizer
+from .parser import Parser
+from .typecheck import check
+
+MAGIC = b"KOC\x00"
+CACHE_DIR = "__koalacache__"
+_HEADER = struct.Struct("<4sHB32s")
+
+
+def source_hash(code):
+    return hashlib.sha256(code.encode("utf-8")).digest()
+
+
+def cache_path(source_path):
+    """Return the .koc path used for ``source_path``."""
+    directory, filename = os.path.split(os.path.abspath(source_path))
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, CACHE_DIR, stem + ".koc")
+
+
+def dumps(code, bytecode, funcs, opt_level=DEFAULT_LEVEL):
+    """Serialize a compiled program for the source text ``code``."""
+    functions = [(f.name, f.params, f.varnames, f.code.to_tuple()) for f in funcs.values()]
+    header = _HEADER.pack(MAGIC, BYTECODE_VERSION, opt_level, source_hash(code))
+    return header + marshal.dumps((bytecode.to_tuple(), functions))
+
+
+def loads(data, code, opt_level=DEFAULT_LEVEL):
+    """Return ``(bytecode, funcs)`` from .koc data, or None if it is stale."""
+    if len(data) < _HEADER.size:
+        return None
+    magic, version, level, digest = _HEADER.unpack_from(data)
+    if (magic != MAGIC or version != BYTECODE_VERSION or level != opt_level
+            or digest != source_hash(code)):
+        return None
+    try:
+        bytecode, functions = marshal.loads(data[_HEADER.size:])
+        funcs = {}
+        for name, params, varnames, body in functions:
+            funcs[name] = Function(name, params, varnames, Code.from_tuple(body))
+        return Code.from_tuple(bytecode), funcs
+    except (EOFError, ValueError, TypeError):
+        return None
+
+
+def compile_source(code, opt_level=DEFAULT_LEVEL, optimizer=None, warn=None):
+    """Tokenize, parse, type-check, compile, optimize and assemble ``code``.
+
+    Returns ``(bytecode, funcs)`` holding ``assembler.Code``; certain type
+    errors are passed to ``warn`` (see ``typecheck.check``). Pass an
+    ``Optimizer`` to read its instruction counts afterwards; by default one
+    for ``opt_level`` is used.
+    """
+    tree = Parser(iter_tokens(code)).parse()
+    check(tree, warn=warn)
+    comp = Compiler()
+    comp.compile(tree)
+    if optimizer is None:
+        optimizer = Optimizer(opt_level)
+    bytecode = optimizer.optimize_program(comp.bytecode, comp.funcs)
+    return assemble_program(bytecode, comp.funcs), comp.funcs
+
+
+def load_program(code, source_path=None, use_cache=True, opt_level=DEFAULT_LEVEL,
+                 optimizer=None, warn=None):
+    """Compile ``code``, going through the .koc cache when possible.
+
+    ``source_path`` locates the cache file; without it (or with
+    ``use_cache=False``) the source is always compiled from scratch, as it
+    is when an ``optimizer`` is given, whose counts a cache hit would leave
+    empty. Type warnings go to ``warn`` only when the source is compiled.
+    """
+    if not use_cache or source_path is None or optimizer is not None:
+        return compile_source(code, opt_level, optimizer, warn)
+
+    path = cache_path(source_path)
+    try:
+        with open(path, "rb") as f:
+            cached = loads(f.read(), code, opt_level)
+        if cached is not None:
+            return cached
+    except OSError:
+        pass
+
+    bytecode, funcs = compile_source(code, opt_level, warn=warn)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(dumps(code, bytecode, funcs, opt_level))
+        os.replace(tmp, path)
+    except OSError:
+        # An unwritable cache only costs us the speedup.
+        pass
+    return bytecode, funcs
@@ -1,13 +1,26 @@
 # koalacode/cli.py
+import argparse
 import sys
-from .lexer import tokenize
+from .lexer import iter_tokens
 from .parser import Parser
 from .interpreter import Interpreter, RuntimeError_
+from .limits import Limits
+from .stackless import StacklessInterpreter
+from .cache import load_program
+from .optimizer import DEFAULT_LEVEL, MAX_LEVEL, Optimizer
+from .regcompiler import compile_source as compile_registers
+from .regvm import RegisterVM
+from .transpiler import transpile, run as run_program
+from .vm import VM, JIT_THRESHOLD
+
+def warn(message):
+    """Report a type error the checker found before the program runs."""
+    print("Type Warning:", message, file=sys.stderr)
 
 def run_code(code, interp):
     """Tokenize, parse, and evaluate KoalaCode source code."""
     try:
-        tokens = tokenize(code)
+        tokens = iter_tokens(code)
         parser = Parser(tokens)
         ast = parser.parse()
         return interp.eval(ast)
@@ -16,15 +29,115 @@ def run_code(code, interp):
     except Exception as e:
         print("Internal Error:", e)
 
-def main():
-    interp = Interpreter()
+def run_vm_code(code, vm, path=None, use_cache=True, opt_level=DEFAULT_LEVEL, opt_stats=False):
+    """Compile KoalaCode source (through the .koc cache for files) and run it on the VM.
+
+    With ``opt_stats`` the optimizer's instruction counts go to stderr.
+    """
+    try:
+        optimizer = Optimizer(opt_level) if opt_stats else None
+        bytecode, funcs = load_program(code, path, use_cache, opt_level, optimizer, warn)
+        if optimizer is not None:
+            print(optimizer.report(), file=sys.stderr)
+        vm.funcs.update(funcs)
+        vm.run(bytecode)
+    except RuntimeError_ as e:
+        print("Runtime Error:", e)
+    except Exception as e:
+        print("Internal Error:", e)
+
+def run_register_code(code, vm):
+    """Compile KoalaCode source to register code and run it on the register VM."""
+    try:
+        module, funcs = compile_registers(code, warn)
+        vm.funcs.update(funcs)
+        vm.run(module)
+    except RuntimeError_ as e:
+        print("Runtime Error:", e)
+    except Exception as e:
+        print("Internal Error:", e)
+
+def run_py_code(code, namespace, path=None, emit=False):
+    """Transpile KoalaCode source to Python and run it (or print it with ``emit``)."""
+    try:
+        program = transpile(Parser(iter_tokens(code)).parse(), f"<koalacode:{path or 'input'}>",
+                            warn=warn)
+        if emit:
+            print(program.source, end="")
+            return
+        run_program(program, namespace)
+    except RuntimeError_ as e:
+        print("Runtime Error:", e)
+    except Exception as e:
+        print("Internal Error:", e)
+
+def build_arg_parser():
+    ap = argparse.ArgumentParser(prog="koalacode", description="Run KoalaCode programs.")
+    ap.add_argument("file", nargs="?", help="program to run; starts a REPL when omitted")
+    ap.add_argument("--backend", choices=("interp", "vm", "py"), default="interp",
+                    help="execution engine: tree interpreter (default), bytecode VM, "
+                         "or translation to Python")
+    ap.add_argument("--vm", choices=("stack", "register"), default="stack",
+                    help="with --backend=vm, the bytecode engine: stack machine (default) "
+                         "or register machine")
+    ap.add_argument("--no-cache", dest="cache", action="store_false",
+                    help="with --backend=vm, do not read or write __koalacache__/*.koc")
+    ap.add_argument("-O", dest="opt_level", type=int, default=DEFAULT_LEVEL,
+                    choices=range(MAX_LEVEL + 1),
+                    help=f"bytecode optimization level for --backend=vm (default {DEFAULT_LEVEL})")
+    ap.add_argument("--opt-stats", action="store_true",
+                    help="with --backend=vm, print the instructions each optimizer pass "
+                         "removed to stderr")
+    ap.add_argument("--no-jit", dest="jit", action="store_false",
+                    help="with --backend=vm, never compile hot functions to Python")
+    ap.add_argument("--jit-threshold", type=int, default=JIT_THRESHOLD,
+                    help=f"calls plus loop iterations before --backend=vm compiles a "
+                         f"function (default {JIT_THRESHOLD})")
+    ap.add_argument("--stackless", action="store_true",
+                    help="with --backend=interp, run calls without Python recursion "
+                         "so deep recursion does not overflow")
+    ap.add_argument("--no-memo", dest="memoize", action="store_false",
+                    help="do not cache the results of pure functions")
+    ap.add_argument("--fuel", type=int,
+                    help="stop a run after this many steps (loop iterations plus calls); "
+                         "not supported by --vm=register or --backend=py")
+    ap.add_argument("--max-array-elements", type=int,
+                    help="stop a run once its arrays total more elements than this")
+    ap.add_argument("--max-string-chars", type=int,
+                    help="stop a run once the strings it builds total more characters than this")
+    ap.add_argument("--max-int-bits", type=int,
+                    help="stop a run before it multiplies out an integer of more bits than this")
+    ap.add_argument("--emit-py", action="store_true",
+                    help="with --backend=py, print the generated Python instead of running it")
+    return ap
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    limits = None
+    budgets = (args.fuel, args.max_array_elements, args.max_string_chars, args.max_int_bits)
+    if budgets != (None, None, None, None):
+        limits = Limits(*budgets)
+    if args.backend == "vm" and args.vm == "register":
+        vm = RegisterVM()
+        run = lambda code, path=None: run_register_code(code, vm)
+    elif args.backend == "vm":
+        vm = VM(jit=args.jit, jit_threshold=args.jit_threshold, memoize=args.memoize,
+                limits=limits)
+        run = lambda code, path=None: run_vm_code(code, vm, path, args.cache, args.opt_level,
+                                                  args.opt_stats)
+    elif args.backend == "py":
+        namespace = {"__name__": "__koalacode__"}
+        run = lambda code, path=None: run_py_code(code, namespace, path, args.emit_py)
+    else:
+        engine = StacklessInterpreter if args.stackless else Interpreter
+        interp = engine(incremental=not args.file, memoize=args.memoize, limits=limits, warn=warn)
+        run = lambda code, path=None: run_code(code, interp)
 
     # Run from file
-    if len(sys.argv) > 1:
-        path = sys.argv[1]
-        with open(path, "r", encoding="utf-8") as f:
+    if args.file:
+        with open(args.file, "r", encoding="utf-8") as f:
             code = f.read()
-        run_code(code, interp)
+        run(code, args.file)
         return
 
     # REPL mode
@@ -39,5 +152,5 @@ def main():
 
         buf += line + "\n"
         if line.strip().endswith(";") or line.strip().endswith("}"):
-            run_code(buf, interp)
+            run(buf)
             buf = ""
@@ -1,153 +1,241 @@
+from .nodes import CONSTANTS, positions_of
+from .opcodes import (
+    PUSH_CONST, POP, LOAD_GLOBAL, STORE_GLOBAL, LOAD_FAST, STORE_FAST,
+    BUILD_ARRAY, BINARY_SUBSCR, STORE_SUBSCR, PRINT, INPUT,
+    JUMP, JUMP_IF_FALSE, MAKE_FUNC, CALL_FUNC, RETURN, TAIL_CALL, BINARY_OPS,
+)
+
+
 class CompileError(Exception):
     pass
 
 
+# Statements that push a value, which a statement must not leave behind.
+VALUE_STATEMENTS = ("func_call", "take")
+
+
+class Function:
+    """A compiled function: its bytecode plus the layout of its local slots.
+
+    Parameters occupy the first ``len(params)`` slots, followed by every other
+    name the body assigns to.
+    """
+    __slots__ = ("name", "params", "varnames", "code")
+
+    def __init__(self, name, params, varnames, code):
+        self.name = name
+        self.params = params
+        self.varnames = varnames
+        self.code = code
+
+    @property
+    def nlocals(self):
+        return len(self.varnames)
+
+
+def assigned_names(node, names=None):
+    """Collect the variable names assigned anywhere in ``node``.
+
+    Nested function definitions are not descended into; they have their own
+    scope.
+    """
+    if names is None:
+        names = []
+    if node.kind == "assign" and node.name not in names:
+        names.append(node.name)
+    elif node.kind == "func_def":
+        return names
+    for child in node.children():
+        assigned_names(child, names)
+    return names
+
+
 class Compiler:
-    def __init__(self):
+    """Compiles a tree into ``(opcode, arg, position)`` instructions.
+
+    ``position`` is the ``(line, col)`` of the innermost node with a known
+    position that produced the instruction; the positions come from the
+    tree's table unless ``positions`` is given.
+    """
+    def __init__(self, varnames=None, funcs=None, positions=None):
         self.bytecode = []
-        self.funcs = {}
+        self.funcs = {} if funcs is None else funcs
+        # Slot numbers of a function's locals; None while compiling module code.
+        self.slots = None
+        if varnames is not None:
+            self.slots = {name: i for i, name in enumerate(varnames)}
+        self.positions = positions
+        self.position = None
 
     def emit(self, op, arg=None):
-        self.bytecode.append((op, arg))
+        self.bytecode.append((op, arg, self.position))
+
+    def patch(self, index):
+        """Point the jump at ``index`` to the next instruction emitted."""
+        op, _, position = self.bytecode[index]
+        self.bytecode[index] = (op, len(self.bytecode), position)
+
+    def emit_load(self, name):
+        if self.slots is not None and name in self.slots:
+            self.emit(LOAD_FAST, self.slots[name])
+        else:
+            self.emit(LOAD_GLOBAL, name)
+
+    def emit_store(self, name):
+        if self.slots is not None:
+            self.emit(STORE_FAST, self.slots[name])
+        else:
+            self.emit(STORE_GLOBAL, name)
 
     def compile(self, node):
-        kind = node[0]
+        if self.positions is None:
+            self.positions = positions_of(node)
+        outer = self.position
+        self.position = self.positions.get(node) or outer
+        self._compile(node)
+        self.position = outer
+
+    def compile_statement(self, node):
+        """Compile ``node`` as a statement, leaving the operand stack as it was.
+
+        Calls and ``take()`` are also expressions; as statements their value
+        is discarded.
+        """
+        self.compile(node)
+        if node.kind in VALUE_STATEMENTS:
+            self.emit(POP)
+
+    def _compile(self, node):
+        kind = node.kind
 
         if kind == "block":
-            _, stmts, line, col = node
-            for stmt in stmts:
-                self.compile(stmt)
+            for stmt in node.stmts:
+                self.compile_statement(stmt)
             return
 
         if kind == "give":
-            _, expr, line, col = node
-            self.compile(expr)
-            self.emit("PRINT")
+            self.compile(node.expr)
+            self.emit(PRINT)
             return
 
         if kind == "take":
-            _, line, col = node
-            self.emit("INPUT")
+            self.emit(INPUT)
             return
 
         if kind == "assign":
-            _, name, expr, line, col = node
-            self.compile(expr)
-            self.emit("STORE_VAR", name)
+            self.compile(node.value)
+            self.emit_store(node.name)
             return
 
         if kind == "assign_index":
-            _, name, idx, val, line, col = node
-            self.compile(idx)
-            self.compile(val)
-            self.emit("STORE_INDEX", name)
+            self.emit_load(node.name)
+            self.compile(node.index)
+            self.compile(node.value)
+            self.emit(STORE_SUBSCR)
             return
 
         if kind == "var":
-            _, name, line, col = node
-            self.emit("LOAD_VAR", name)
+            self.emit_load(node.name)
             return
 
         if kind == "array":
-            _, elems, line, col = node
-            for e in elems:
+            for e in node.elems:
                 self.compile(e)
-            self.emit("BUILD_ARRAY", len(elems))
+            self.emit(BUILD_ARRAY, len(node.elems))
             return
 
         if kind == "index":
-            _, name, idx, line, col = node
-            self.compile(idx)
-            self.emit("LOAD_INDEX", name)
+            self.emit_load(node.name)
+            self.compile(node.index)
+            self.emit(BINARY_SUBSCR)
             return
 
-        if kind == "num":
-            _, val, line, col = node
-            self.emit("PUSH_CONST", val)
-            return
-        if kind == "str":
-            _, val, line, col = node
-            self.emit("PUSH_CONST", val)
-            return
-        if kind == "bool":
-            _, val, line, col = node
-            self.emit("PUSH_CONST", val)
+        if kind in CONSTANTS:
+            self.emit(PUSH_CONST, node.value)
             return
 
         if kind == "binop":
-            _, op, left, right, line, col = node
-            self.compile(left)
-            self.compile(right)
-            self.emit("BINARY_OP", op)
+            op = node.op
+            self.compile(node.left)
+            self.compile(node.right)
+            if op not in BINARY_OPS:
+                raise CompileError(f"Unknown binary operator {op}")
+            self.emit(BINARY_OPS[op])
             return
 
         if kind == "if":
-            _, cond, then_branch, else_branch, line, col = node
-            self.compile(cond)
+            self.compile(node.cond)
             jmp_false_pos = len(self.bytecode)
-            self.emit("JUMP_IF_FALSE", None)
-            self.compile(then_branch)
-            if else_branch:
+            self.emit(JUMP_IF_FALSE, None)
+            self.compile_statement(node.then)
+            if node.orelse:
                 jmp_end_pos = len(self.bytecode)
-                self.emit("JUMP", None)
-                self.bytecode[jmp_false_pos] = ("JUMP_IF_FALSE", len(self.bytecode))
-                self.compile(else_branch)
-                self.bytecode[jmp_end_pos] = ("JUMP", len(self.bytecode))
+                self.emit(JUMP, None)
+                self.patch(jmp_false_pos)
+                self.compile_statement(node.orelse)
+                self.patch(jmp_end_pos)
             else:
-                self.bytecode[jmp_false_pos] = ("JUMP_IF_FALSE", len(self.bytecode))
+                self.patch(jmp_false_pos)
             return
 
         if kind == "while":
-            _, cond, body, line, col = node
             loop_start = len(self.bytecode)
-            self.compile(cond)
+            self.compile(node.cond)
             jmp_false_pos = len(self.bytecode)
-            self.emit("JUMP_IF_FALSE", None)
-            self.compile(body)
-            self.emit("JUMP", loop_start)
-            self.bytecode[jmp_false_pos] = ("JUMP_IF_FALSE", len(self.bytecode))
+            self.emit(JUMP_IF_FALSE, None)
+            self.compile_statement(node.body)
+            self.emit(JUMP, loop_start)
+            self.patch(jmp_false_pos)
             return
 
         if kind == "for":
-            _, init, cond, step, body, line, col = node
-            self.compile(init)
+            self.compile(node.init)
             loop_start = len(self.bytecode)
-            self.compile(cond)
+            self.compile(node.cond)
             jmp_false_pos = len(self.bytecode)
-            self.emit("JUMP_IF_FALSE", None)
-            self.compile(body)
-            self.compile(step)
-            self.emit("JUMP", loop_start)
-            self.bytecode[jmp_false_pos] = ("JUMP_IF_FALSE", len(self.bytecode))
+            self.emit(JUMP_IF_FALSE, None)
+            self.compile_statement(node.body)
+            self.compile(node.step)
+            self.emit(JUMP, loop_start)
+            self.patch(jmp_false_pos)
             return
 
         if kind == "func_def":
-            _, name, params, body, line, col = node
-            inner = Compiler()
-            inner.compile(body)
-            inner.emit("PUSH_CONST", None)
-            inner.emit("RETURN")
-            self.funcs[name] = (params, inner.bytecode)
-            self.emit("MAKE_FUNC", name)
+            name, params, body = node.name, node.params, node.body
+            varnames = list(params)
+            varnames += [n for n in assigned_names(body) if n not in varnames]
+            inner = Compiler(varnames, self.funcs, self.positions)
+            inner.compile_statement(body)
+            inner.emit(PUSH_CONST, None)
+            inner.emit(RETURN)
+            self.funcs[name] = Function(name, params, varnames, inner.bytecode)
+            self.emit(MAKE_FUNC, name)
             return
 
         if kind == "func_call":
-            _, name, args, line, col = node
-            for a in args:
+            for a in node.args:
                 self.compile(a)
-            self.emit("CALL_FUNC", (name, len(args)))
+            self.emit(CALL_FUNC, (node.name, len(node.args)))
             return
 
         if kind == "return":
-            _, val, line, col = node
-            self.compile(val)
-            self.emit("RETURN")
+            val = node.value
+            if self.slots is not None and val.kind == "func_call" and val.name != "len":
+                for a in val.args:
+                    self.compile(a)
+                # Errors in the call are reported at the call, as for CALL_FUNC.
+                outer = self.position
+                self.position = self.positions.get(val) or outer
+                self.emit(TAIL_CALL, (val.name, len(val.args)))
+                self.position = outer
+            else:
+                self.compile(val)
+            self.emit(RETURN)
             return
 
         if kind == "expr":
-            _, expr, line, col = node
-            self.compile(expr)
-            self.emit("POP")
+            self.compile(node.expr)
+            self.emit(POP)
             return
 
         raise CompileError(f"Unknown node {kind}")
@@ -1,160 +1,679 @@
-class RuntimeError_(Exception): 
+import operator
+
+from .limits import FUEL_BATCH, Meter
+from .memo import LRUCache, MISSING, make_key, pure_func_defs, still_pure
+from .nodes import CONSTANTS, positions_of
+from .streams import BufferedOutput, StdinInput
+from .typecheck import check
+
+
+class RuntimeError_(Exception):
     pass
 
-class ReturnException(Exception):
-    def __init__(self, value): 
+class ReturnValue:
+    """Completion signal produced by a 'return' statement.
+
+    Blocks and loops that contain a 'return' hand it straight back to their
+    caller, and the enclosing function call unwraps it, so returning never
+    raises a Python exception.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
         self.value = value
 
 
+def contains_return(node):
+    """True if ``node`` has a 'return' outside any nested function body."""
+    if node.kind == 'return':
+        return True
+    if node.kind == 'func_def':
+        return False
+    for child in node.children():
+        if contains_return(child):
+            return True
+    return False
+
+
+# Operator implementations used by compiled 'binop' closures. Both operands
+# are always evaluated, so '&&' and '||' do not short-circuit.
+BINARY_OPERATORS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.floordiv,
+    '<': operator.lt,
+    '>': operator.gt,
+    '<=': operator.le,
+    '>=': operator.ge,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '!': lambda lval, rval: not lval,
+    '&&': lambda lval, rval: lval and rval,
+    '||': lambda lval, rval: lval or rval,
+}
+
+
 class Interpreter:
-    def __init__(self):
+    """Tree-walking engine.
+
+    ``eval`` first turns the AST into nested Python closures, one specialized
+    closure per node, and then runs the result. Every closure takes the
+    current scope as its only argument, so re-executing a loop body never
+    looks at the node type again.
+
+    ``self.env`` is the global scope. A function call runs its body in a new
+    dict holding only its parameters and the names it assigns; names that are
+    not found there are looked up in the global scope.
+
+    Unless ``typecheck`` is false, ``eval`` runs the static type checker
+    first: assignments it proves safe are compiled without a run-time type
+    check, and the errors it finds certain are passed to ``warn`` before the
+    program runs; they are still raised as run-time errors if reached.
+    Pass ``incremental=True`` when more programs will be evaluated in the
+    same interpreter afterwards (a REPL), so proofs about function bodies do
+    not rely on globals that a later program could still create.
+
+    With ``memoize`` (the default) calls of pure functions (see
+    ``koalacode.memo``) are answered from a per-function LRU cache;
+    ``memo_stats`` reports the hit rates.
+
+    Nodes do not store their source position; compiled closures report
+    errors through ``self._error``, which ``eval`` binds to the position
+    table of the tree being compiled.
+
+    With ``limits`` (a ``koalacode.limits.Limits``) each ``eval`` gets that
+    budget: loops and calls charge fuel, and array literals, ``take()`` and
+    ``+`` / ``*`` the array and string budgets, in closures compiled only
+    for the budgets that are set. Loops charge their steps in batches (see
+    ``koalacode.limits``). Without limits the closures are the unmetered
+    ones.
+
+    ``give`` writes to ``output`` and ``take()`` reads from ``input`` (see
+    ``koalacode.streams``); by default output goes to stdout in batches and
+    input comes from stdin. ``eval`` flushes the output before every
+    ``take()`` and when it returns or raises.
+    """
+
+    def __init__(self, typecheck=True, incremental=False, memoize=True, limits=None,
+                 output=None, input=None, warn=None):
         self.env = {}
         self.funcs = {}
+        self.typecheck = typecheck
+        self.incremental = incremental
+        self.warn = warn
+        self.memoize = memoize
+        self.memo_caches = {}
+        self.meter = meter = Meter(limits) if limits is not None else None
+        # The meter, where its fuel or its memory budgets are checked.
+        self._fuel = meter if meter is not None and meter.counts_fuel else None
+        self._memory = meter if meter is not None and meter.counts_memory else None
+        self.output = BufferedOutput() if output is None else output
+        self.input = StdinInput() if input is None else input
+        self._proven = set()
+        self._pure = {}
+        # Names each memoized function calls, to re-check its purity when
+        # a function is redefined.
+        self._memo_calls = {}
+        self._error = self.error
+        self._compilers = {
+            'block': self._compile_block,
+            'give': self._compile_give,
+            'take': self._compile_take,
+            'if': self._compile_if,
+            'while': self._compile_while,
+            'for': self._compile_for,
+            'assign': self._compile_assign,
+            'assign_index': self._compile_assign_index,
+            'expr': self._compile_expr,
+            'binop': self._compile_binop,
+            'num': self._compile_const,
+            'str': self._compile_const,
+            'bool': self._compile_const,
+            'var': self._compile_var,
+            'array': self._compile_array,
+            'index': self._compile_index,
+            'func_def': self._compile_func_def,
+            'func_call': self._compile_func_call,
+            'return': self._compile_return,
+        }
 
-    def error(self, message, node=None):
+    def error(self, message, node=None, positions=None):
         """Attach line/col info if available."""
-        if node and len(node) >= 3:
-            line, col = node[-2], node[-1]
-            raise RuntimeError_(f"[Line {line}, Col {col}] {message}")
+        if node is not None and positions is not None:
+            message = positions.where(node) + message
         raise RuntimeError_(message)
 
     def eval(self, node):
-        ntype = node[0]
+        positions = positions_of(node)
+        error = self.error
+        if self.meter is not None:
+            self.meter.reset()
+        if self.typecheck:
+            self._proven = check(node, self.env, self.funcs, self.incremental, self.warn)
+        if self.memoize:
+            self._pure = pure_func_defs(node, self._proven)
+        self._error = lambda message, at=None: error(message, at, positions)
+        try:
+            run = self.compile(node)
+        finally:
+            self._proven = set()
+            self._pure = {}
+            self._error = error
+        try:
+            res = self.execute(run)
+        finally:
+            self.output.flush()
+        if res.__class__ is ReturnValue:
+            return res.value
+        return res
 
-        if ntype == 'block':
+    def execute(self, run):
+        """Run a compiled program in the global scope."""
+        return run(self.env)
+
+    def compile(self, node):
+        """Return a closure ``run(env)`` that evaluates ``node``."""
+        compiler = self._compilers.get(node.kind)
+        if compiler is None:
+            self._error(f"Unknown node {node.kind}", node)
+        return compiler(node)
+
+    def compile_body(self, node):
+        """Compile a function body into the closure stored in ``funcs``."""
+        return self.compile(node)
+
+    def _compile_block(self, node):
+        stmts = [self.compile(stmt) for stmt in node.stmts]
+        if not stmts:
+            return lambda env: None
+        if len(stmts) == 1:
+            return stmts[0]
+
+        if not contains_return(node):
+            def run(env):
+                res = None
+                for stmt in stmts:
+                    res = stmt(env)
+                return res
+            return run
+
+        def run(env):
             res = None
-            for stmt in node[1]:
-                res = self.eval(stmt)
+            for stmt in stmts:
+                res = stmt(env)
+                if res.__class__ is ReturnValue:
+                    return res
             return res
+        return run
+
+    def _compile_give(self, node):
+        expr = self.compile(node.expr)
+        write = self.output.write
 
-        if ntype == 'give':
-            val = self.eval(node[1])
-            print(val)
+        def run(env):
+            val = expr(env)
+            write(val)
             return val
+        return run
 
-        if ntype == 'take':
-            return input()
+    def _compile_take(self, node):
+        meter = self._memory
+        flush, read = self.output.flush, self.input.read
+        if meter is None:
+            def run(env):
+                flush()
+                return read()
+            return run
+        error = self._error
 
-        if ntype == 'if':
-            _, cond, then_branch, else_branch, line, col = node
-            if self.eval(cond):
-                return self.eval(then_branch)
-            elif else_branch:
-                return self.eval(else_branch)
-            return None
+        def run(env):
+            flush()
+            val = read()
+            meter.charge_string(len(val), error, node)
+            return val
+        return run
+
+    def _compile_if(self, node):
+        else_branch = node.orelse
+        cond = self.compile(node.cond)
+        then_branch = self.compile(node.then)
+        if not else_branch:
+            def run(env):
+                if cond(env):
+                    return then_branch(env)
+                return None
+            return run
+
+        else_branch = self.compile(else_branch)
+
+        def run(env):
+            if cond(env):
+                return then_branch(env)
+            return else_branch(env)
+        return run
+
+    def _compile_while(self, node):
+        returns = contains_return(node.body)
+        cond, body = self.compile(node.cond), self.compile(node.body)
+        meter = self._fuel
+
+        if meter is not None:
+            error = self._error
+
+            if not returns:
+                def run(env):
+                    res = None
+                    steps = 0
+                    while cond(env):
+                        res = body(env)
+                        steps += 1
+                        if steps == FUEL_BATCH:
+                            meter.spend(steps, error, node)
+                            steps = 0
+                    meter.spend(steps, error, node)
+                    return res
+                return run
+
+            def run(env):
+                res = None
+                steps = 0
+                while cond(env):
+                    res = body(env)
+                    if res.__class__ is ReturnValue:
+                        break
+                    steps += 1
+                    if steps == FUEL_BATCH:
+                        meter.spend(steps, error, node)
+                        steps = 0
+                meter.spend(steps, error, node)
+                return res
+            return run
+
+        if not returns:
+            def run(env):
+                res = None
+                while cond(env):
+                    res = body(env)
+                return res
+            return run
 
-        if ntype == 'while':
-            _, cond, body, line, col = node
+        def run(env):
             res = None
-            while self.eval(cond):
-                res = self.eval(body)
+            while cond(env):
+                res = body(env)
+                if res.__class__ is ReturnValue:
+                    return res
             return res
+        return run
 
-        if ntype == 'for':
-            _, init, cond, step, body, line, col = node
-            self.eval(init)
+    def _compile_for(self, node):
+        returns = contains_return(node.body)
+        init, cond = self.compile(node.init), self.compile(node.cond)
+        step, body = self.compile(node.step), self.compile(node.body)
+        meter = self._fuel
+
+        if meter is not None:
+            error = self._error
+
+            if not returns:
+                def run(env):
+                    init(env)
+                    res = None
+                    steps = 0
+                    while cond(env):
+                        res = body(env)
+                        step(env)
+                        steps += 1
+                        if steps == FUEL_BATCH:
+                            meter.spend(steps, error, node)
+                            steps = 0
+                    meter.spend(steps, error, node)
+                    return res
+                return run
+
+            def run(env):
+                init(env)
+                res = None
+                steps = 0
+                while cond(env):
+                    res = body(env)
+                    if res.__class__ is ReturnValue:
+                        break
+                    step(env)
+                    steps += 1
+                    if steps == FUEL_BATCH:
+                        meter.spend(steps, error, node)
+                        steps = 0
+                meter.spend(steps, error, node)
+                return res
+            return run
+
+        if not returns:
+            def run(env):
+                init(env)
+                res = None
+                while cond(env):
+                    res = body(env)
+                    step(env)
+                return res
+            return run
+
+        def run(env):
+            init(env)
             res = None
-            while self.eval(cond):
-                res = self.eval(body)
-                self.eval(step)
+            while cond(env):
+                res = body(env)
+                if res.__class__ is ReturnValue:
+                    return res
+                step(env)
             return res
+        return run
 
-        if ntype == 'assign':
-            _, name, expr, line, col = node
-            val = self.eval(expr)
-            if name in self.env and type(val) is not type(self.env[name]):
-                self.error(
-                    f"Type error: {name} was {type(self.env[name]).__name__}, got {type(val).__name__}", 
+    def _compile_assign(self, node):
+        name = node.name
+        expr = self.compile(node.value)
+        error = self._error
+        genv = self.env
+
+        if id(node) in self._proven:
+            def run(env):
+                val = expr(env)
+                env[name] = val
+                return val
+            return run
+
+        def run(env):
+            val = expr(env)
+            if name in env:
+                prev = env[name]
+            elif name in genv:
+                prev = genv[name]
+            else:
+                env[name] = val
+                return val
+            if type(val) is not type(prev):
+                error(
+                    f"Type error: {name} was {type(prev).__name__}, got {type(val).__name__}",
                     node
                 )
-            self.env[name] = val
+            env[name] = val
             return val
+        return run
 
-        if ntype == 'assign_index':
-            _, name, idx, val, line, col = node
-            if name not in self.env:
-                self.error(f"Undefined array {name}", node)
-            arr = self.env[name]
+    def _compile_assign_index(self, node):
+        name = node.name
+        idx, val = self.compile(node.index), self.compile(node.value)
+        error = self._error
+        genv = self.env
+
+        def run(env):
+            if name in env:
+                arr = env[name]
+            elif name in genv:
+                arr = genv[name]
+            else:
+                error(f"Undefined array {name}", node)
             try:
-                arr[self.eval(idx)] = self.eval(val)
+                arr[idx(env)] = val(env)
             except Exception:
-                self.error(f"Index out of bounds in array {name}", node)
+                error(f"Index out of bounds in array {name}", node)
             return arr
+        return run
+
+    def _compile_expr(self, node):
+        return self.compile(node.expr)
 
-        if ntype == 'expr':
-            return self.eval(node[1])
+    def _compile_binop(self, node):
+        # Unlike the VM's instructions (see ``koalacode.vm``), binop closures
+        # are not quickened by operand type. A closure cannot replace itself
+        # in the closure that calls it, so re-specialising would cost an
+        # extra call per operation. A Python-level int guard also costs more
+        # than the C operator call it would save. The try/except is free
+        # unless the operation fails.
+        op, right_node = node.op, node.right
+        left, right = self.compile(node.left), self.compile(right_node)
+        error = self._error
+        fn = BINARY_OPERATORS.get(op)
+        if fn is None:
+            def run(env):
+                left(env), right(env)
+                error(f"Unknown operator {op}", node)
+            return run
 
-        if ntype == 'binop':
-            _, op, left, right, line, col = node
-            lval, rval = self.eval(left), self.eval(right)
+        # With limits, '+' and '*' charge the strings and arrays they build;
+        # adding a constant that is not a string never builds one, nor does
+        # an operation the type checker proved only produces numbers. With
+        # an integer limit, every '*' checks its numbers too (``ints``).
+        meter = self._memory
+        charge = None
+        ints = meter is not None and op == '*' and meter.counts_ints
+        if ints:
+            charge = meter.charge_mul
+        elif meter is not None and op in ('+', '*') and id(node) not in self._proven:
+            charge = meter.charge_add if op == '+' else meter.charge_mul
+            if op == '+' and right_node.kind in CONSTANTS and right_node.value.__class__ is not str:
+                charge = None
+
+        if right_node.kind in CONSTANTS:
+            # Constant right operand (n - 1, i < 10): skip its closure call.
+            rval = right_node.value
+
+            if charge is not None and rval.__class__ is int and not ints:
+                def run(env):
+                    lval = left(env)
+                    if lval.__class__ is not int:
+                        charge(lval, rval, error, node)
+                    try:
+                        return fn(lval, rval)
+                    except Exception:
+                        error(f"Invalid operation {op} between {type(lval).__name__} and {type(rval).__name__}", node)
+                return run
+
+            if charge is not None:
+                def run(env):
+                    lval = left(env)
+                    charge(lval, rval, error, node)
+                    try:
+                        return fn(lval, rval)
+                    except Exception:
+                        error(f"Invalid operation {op} between {type(lval).__name__} and {type(rval).__name__}", node)
+                return run
+
+            def run(env):
+                lval = left(env)
+                try:
+                    return fn(lval, rval)
+                except Exception:
+                    error(f"Invalid operation {op} between {type(lval).__name__} and {type(rval).__name__}", node)
+            return run
+
+        if charge is not None and ints:
+            def run(env):
+                lval, rval = left(env), right(env)
+                charge(lval, rval, error, node)
+                try:
+                    return fn(lval, rval)
+                except Exception:
+                    error(f"Invalid operation {op} between {type(lval).__name__} and {type(rval).__name__}", node)
+            return run
+
+        if charge is not None:
+            def run(env):
+                lval, rval = left(env), right(env)
+                if lval.__class__ is not int or rval.__class__ is not int:
+                    charge(lval, rval, error, node)
+                try:
+                    return fn(lval, rval)
+                except Exception:
+                    error(f"Invalid operation {op} between {type(lval).__name__} and {type(rval).__name__}", node)
+            return run
+
+        def run(env):
+            lval, rval = left(env), right(env)
             try:
-                if op == '+': return lval + rval
-                if op == '-': return lval - rval
-                if op == '*': return lval * rval
-                if op == '/': return lval // rval
-                if op == '<': return lval < rval
-                if op == '>': return lval > rval
-                if op == '<=': return lval <= rval
-                if op == '>=': return lval >= rval
-                if op == '==': return lval == rval
-                if op == '!=': return lval != rval
-                if op == '!': return not lval
-                if op == '&&': return lval and rval
-                if op == '||': return lval or rval
+                return fn(lval, rval)
             except Exception:
-                self.error(f"Invalid operation {op} between {type(lval).__name__} and {type(rval).__name__}", node)
-            self.error(f"Unknown operator {op}", node)
-
-        if ntype in ('num','str','bool'):
-            return node[1]
-
-        if ntype == 'var':
-            name = node[1]
-            if name in self.env:
-                return self.env[name]
-            self.error(f"Undefined variable {name}", node)
-
-        if ntype == 'array':
-            return [self.eval(e) for e in node[1]]
-
-        if ntype == 'index':
-            _, name, idx, line, col = node
-            if name not in self.env:
-                self.error(f"Undefined array {name}", node)
-            arr = self.env[name]
-            index_val = self.eval(idx)
+                error(f"Invalid operation {op} between {type(lval).__name__} and {type(rval).__name__}", node)
+        return run
+
+    def _compile_const(self, node):
+        val = node.value
+        return lambda env: val
+
+    def _compile_var(self, node):
+        name = node.name
+        error = self._error
+        genv = self.env
+
+        def run(env):
+            try:
+                return env[name]
+            except KeyError:
+                pass
+            try:
+                return genv[name]
+            except KeyError:
+                error(f"Undefined variable {name}", node)
+        return run
+
+    def _compile_array(self, node):
+        elems = [self.compile(e) for e in node.elems]
+        meter = self._memory
+        if meter is None:
+            return lambda env: [e(env) for e in elems]
+        error = self._error
+
+        def run(env):
+            vals = [e(env) for e in elems]
+            meter.array_elements -= len(vals)
+            if meter.array_elements < 0:
+                meter.check(error, node)
+            return vals
+        return run
+
+    def _compile_index(self, node):
+        name = node.name
+        idx = self.compile(node.index)
+        error = self._error
+        genv = self.env
+
+        def run(env):
+            if name in env:
+                arr = env[name]
+            elif name in genv:
+                arr = genv[name]
+            else:
+                error(f"Undefined array {name}", node)
+            index_val = idx(env)
             try:
                 return arr[index_val]
             except Exception:
-                self.error(f"Index {index_val} out of bounds in array {name}", node)
+                error(f"Index {index_val} out of bounds in array {name}", node)
+        return run
 
-        if ntype == 'func_def':
-            _, name, params, body, line, col = node
-            self.funcs[name] = (params, body)
+    def _compile_func_def(self, node):
+        name, params = node.name, node.params
+        body = self.compile_body(node.body)
+        funcs = self.funcs
+        memo_caches = self.memo_caches
+        memo_calls = self._memo_calls
+        calls = self._pure.get(id(node))
+        cache = LRUCache() if calls is not None else None
+        forget_impure_callers = self._forget_impure_callers
+
+        def run(env):
+            if name in funcs:
+                # Cached results may depend on the definition being replaced.
+                for other in memo_caches.values():
+                    other.data.clear()
+            funcs[name] = (params, body, cache)
+            if cache is not None:
+                memo_caches[name] = cache
+                memo_calls[name] = calls
+            else:
+                memo_caches.pop(name, None)
+                memo_calls.pop(name, None)
+                if memo_calls:
+                    forget_impure_callers()
             return None
+        return run
+
+    def _forget_impure_callers(self):
+        """Stop memoizing functions that now call an impure one.
+
+        A function is memoized when everything it calls was pure as its
+        program defined it; a later program (a REPL input) may replace one
+        of those with an impure function.
+        """
+        pure = still_pure(self._memo_calls, self.funcs)
+        for name in list(self._memo_calls):
+            if name not in pure:
+                params, body, _ = self.funcs[name]
+                self.funcs[name] = (params, body, None)
+                del self.memo_caches[name]
+                del self._memo_calls[name]
+
+    def _compile_func_call(self, node):
+        name = node.name
+        args = [self.compile(a) for a in node.args]
+        error = self._error
+        meter = self._fuel
+        if name == 'len':
+            if not args:
+                def run(env):
+                    error("Function len expects 1 args, got 0", node)
+                return run
+            arg = args[0]
+            if meter is None:
+                return lambda env: len(arg(env))
 
-        if ntype == 'func_call':
-            _, name, args, line, col = node
-            if name == 'len':
-                return len(self.eval(args[0]))
-            if name not in self.funcs:
-                self.error(f"Undefined function {name}", node)
-            params, body = self.funcs[name]
+            def run(env):
+                val = arg(env)
+                meter.step(error, node)
+                return len(val)
+            return run
+        funcs = self.funcs
+
+        def run(env):
+            if name not in funcs:
+                error(f"Undefined function {name}", node)
+            params, body, cache = funcs[name]
             if len(params) != len(args):
-                self.error(f"Function {name} expects {len(params)} args, got {len(args)}", node)
+                error(f"Function {name} expects {len(params)} args, got {len(args)}", node)
 
-            old_env = self.env.copy()
-            self.env.update({p: self.eval(a) for p,a in zip(params,args)})
-            try:
-                res = self.eval(body)
-            except ReturnException as r:
-                self.env = old_env
-                return r.value
-            self.env = old_env
+            if cache is None:
+                scope = {p: a(env) for p, a in zip(params, args)}
+                if meter is not None:
+                    meter.fuel -= 1
+                    if meter.fuel < 0:
+                        meter.check(error, node)
+                res = body(scope)
+                if res.__class__ is ReturnValue:
+                    return res.value
+                return res
+
+            vals = [a(env) for a in args]
+            if meter is not None:
+                meter.step(error, node)
+            key = make_key(vals)
+            if key is not None:
+                res = cache.get(key)
+                if res is not MISSING:
+                    return res
+            res = body(dict(zip(params, vals)))
+            if res.__class__ is ReturnValue:
+                res = res.value
+            if key is not None:
+                cache.put(key, res)
             return res
+        return run
+
+    def memo_stats(self):
+        """Hits, misses, hit rate and size of each pure function's cache."""
+        return {name: cache.stats() for name, cache in self.memo_caches.items()}
 
-        if ntype == 'return':
-            _, val, line, col = node
-            raise ReturnException(self.eval(val))
+    def _compile_return(self, node):
+        val = self.compile(node.value)
 
-        self.error(f"Unknown node {ntype}", node)
+        return lambda env: ReturnValue(val(env))
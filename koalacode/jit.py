@@ -0,0 +1,348 @@
+# koalacode/jit.py
+"""Translation of hot VM functions into Python functions.
+
+``compile_function`` turns the bytecode of a ``compiler.Function`` (decoded
+from its ``assembler.Code``) into the source of an equivalent Python
+function and compiles it with CPython. Each basic block becomes a branch
+of a ``pc`` dispatch loop; inside a block the operand stack is resolved at
+translation time, so locals become Python variables and instructions
+become ordinary Python statements.
+
+Every value an instruction computes is assigned to a temporary in
+instruction order, so operations run (and fail) in the same order as on the
+VM. Each generated line comes from one instruction, and the compiled
+function's globals keep the map from line numbers to instructions
+(``LINE_ORIGINS``), so an error is reported at the source position the VM
+would report, looked up only once one is raised.
+
+Bytecode the translator does not handle, or whose operand stack is not
+empty at a jump, makes ``compile_function`` return None and the function
+stays interpreted.
+"""
+from .opcodes import (
+    PUSH_CONST, POP, LOAD_GLOBAL, STORE_GLOBAL, LOAD_FAST, STORE_FAST, DUP_TOP,
+    BUILD_ARRAY, BINARY_SUBSCR, STORE_SUBSCR, PRINT, INPUT, JUMP, JUMP_IF_FALSE,
+    MAKE_FUNC, CALL_FUNC, RETURN, TAIL_CALL,
+    BINARY_ADD, BINARY_SUB, BINARY_MUL, BINARY_FLOORDIV, COMPARE_LT, COMPARE_GT,
+    COMPARE_LE, COMPARE_GE, COMPARE_EQ, COMPARE_NE, BINARY_AND, BINARY_OR,
+    INC_FAST, INC_GLOBAL, COMPARE_JUMP, COMPARE_FAST_CONST_JUMP,
+    COMPARE_GLOBAL_CONST_JUMP, BINARY_OP_FAST_CONST, LOAD_FAST_FAST,
+    LOAD_INDEX_FAST, LOAD_INDEX_GLOBAL,
+    COMPARE_JUMP_GENERIC, COMPARE_FAST_CONST_JUMP_GENERIC,
+    COMPARE_GLOBAL_CONST_JUMP_GENERIC, BINARY_OP_FAST_CONST_GENERIC,
+    COMPARE_LT_JUMP_INT, COMPARE_LE_JUMP_INT, COMPARE_GT_JUMP_INT, COMPARE_GE_JUMP_INT,
+    COMPARE_FAST_CONST_LT_JUMP_INT, COMPARE_FAST_CONST_LE_JUMP_INT,
+    COMPARE_FAST_CONST_GT_JUMP_INT, COMPARE_FAST_CONST_GE_JUMP_INT,
+    COMPARE_GLOBAL_CONST_LT_JUMP_INT, COMPARE_GLOBAL_CONST_LE_JUMP_INT,
+    COMPARE_GLOBAL_CONST_GT_JUMP_INT, COMPARE_GLOBAL_CONST_GE_JUMP_INT,
+    BINARY_ADD_FAST_CONST_INT, BINARY_SUB_FAST_CONST_INT, BINARY_ADD_FAST_CONST_STR,
+    JUMP_OPS, jump_target,
+)
+
+PY_OPERATORS = {
+    BINARY_ADD: "+", BINARY_SUB: "-", BINARY_MUL: "*", BINARY_FLOORDIV: "//",
+    COMPARE_LT: "<", COMPARE_GT: ">", COMPARE_LE: "<=", COMPARE_GE: ">=",
+    COMPARE_EQ: "==", COMPARE_NE: "!=", BINARY_AND: "and", BINARY_OR: "or",
+}
+
+# Quickened forms translate exactly like the superinstruction they came from.
+_FAMILY = {
+    COMPARE_JUMP_GENERIC: COMPARE_JUMP,
+    COMPARE_FAST_CONST_JUMP_GENERIC: COMPARE_FAST_CONST_JUMP,
+    COMPARE_GLOBAL_CONST_JUMP_GENERIC: COMPARE_GLOBAL_CONST_JUMP,
+    BINARY_OP_FAST_CONST_GENERIC: BINARY_OP_FAST_CONST,
+    BINARY_ADD_FAST_CONST_INT: BINARY_OP_FAST_CONST,
+    BINARY_SUB_FAST_CONST_INT: BINARY_OP_FAST_CONST,
+    BINARY_ADD_FAST_CONST_STR: BINARY_OP_FAST_CONST,
+}
+for _op in (COMPARE_LT_JUMP_INT, COMPARE_LE_JUMP_INT, COMPARE_GT_JUMP_INT, COMPARE_GE_JUMP_INT):
+    _FAMILY[_op] = COMPARE_JUMP
+for _op in (COMPARE_FAST_CONST_LT_JUMP_INT, COMPARE_FAST_CONST_LE_JUMP_INT,
+            COMPARE_FAST_CONST_GT_JUMP_INT, COMPARE_FAST_CONST_GE_JUMP_INT):
+    _FAMILY[_op] = COMPARE_FAST_CONST_JUMP
+for _op in (COMPARE_GLOBAL_CONST_LT_JUMP_INT, COMPARE_GLOBAL_CONST_LE_JUMP_INT,
+            COMPARE_GLOBAL_CONST_GT_JUMP_INT, COMPARE_GLOBAL_CONST_GE_JUMP_INT):
+    _FAMILY[_op] = COMPARE_GLOBAL_CONST_JUMP
+del _op
+
+INDENT = "    "
+
+# Key, in a compiled function's globals, of ``(code, origins)``: the
+# function's ``assembler.Code`` and the map from line numbers of the
+# generated source to instruction indexes in it.
+LINE_ORIGINS = "__koala_origins__"
+
+
+class Unsupported(Exception):
+    """The function's bytecode cannot be translated."""
+
+
+class _Block:
+    """Translates one basic block, simulating the operand stack."""
+
+    def __init__(self, translator):
+        self.t = translator
+        self.lines = []
+        # Index of the instruction each line comes from.
+        self.origins = []
+        self.index = None
+        self.stack = []
+        # Non-parameter slots assigned earlier in this block.
+        self.bound = set()
+
+    def emit(self, line):
+        self.lines.append(line)
+        self.origins.append(self.index)
+
+    def temp(self, expr):
+        name = self.t.new_temp()
+        self.emit(f"{name} = {expr}")
+        return name
+
+    def pop(self, n=1):
+        if len(self.stack) < n:
+            raise Unsupported("operand stack underflow")
+        values = self.stack[-n:]
+        del self.stack[-n:]
+        return values
+
+    def local(self, slot):
+        name = f"l{slot}"
+        if slot >= self.t.nparams and slot not in self.bound:
+            varname = self.t.func.varnames[slot]
+            self.emit(f"if {name} is UNBOUND: undefined({varname!r})")
+            self.bound.add(slot)
+        return name
+
+    def store_local(self, slot, expr):
+        name = f"l{slot}"
+        # A load of the old value may still be waiting on the stack.
+        for i, entry in enumerate(self.stack):
+            if entry == name:
+                self.stack[i] = self.temp(name)
+        self.emit(f"{name} = {expr}")
+        self.bound.add(slot)
+
+    def global_(self, name):
+        return self.temp(f"G[{name!r}]")
+
+    def branch_if_false(self, cond, target):
+        if self.stack:
+            raise Unsupported("values on the stack at a jump")
+        self.emit(f"if not ({cond}): pc = {target}; continue")
+
+    def binary(self, op, a, b):
+        return self.temp(f"{a} {PY_OPERATORS[op]} {b}")
+
+    def instruction(self, op, arg):
+        """Translate one instruction; return False if the block ends here."""
+        op = _FAMILY.get(op, op)
+        push = self.stack.append
+        if op == PUSH_CONST:
+            push(repr(arg))
+        elif op == POP:
+            self.pop()
+        elif op == DUP_TOP:
+            push(self.stack[-1])
+        elif op == LOAD_GLOBAL:
+            push(self.global_(arg))
+        elif op == STORE_GLOBAL:
+            self.emit(f"G[{arg!r}] = {self.pop()[0]}")
+        elif op == LOAD_FAST:
+            push(self.local(arg))
+        elif op == STORE_FAST:
+            self.store_local(arg, self.pop()[0])
+        elif op == BUILD_ARRAY:
+            push(self.temp("[" + ", ".join(self.pop(arg) if arg else []) + "]"))
+        elif op == BINARY_SUBSCR:
+            arr, idx = self.pop(2)
+            push(self.temp(f"{arr}[{idx}]"))
+        elif op == STORE_SUBSCR:
+            arr, idx, val = self.pop(3)
+            self.emit(f"{arr}[{idx}] = {val}")
+        elif op == PRINT:
+            self.emit(f"write({self.pop()[0]})")
+        elif op == INPUT:
+            push(self.temp("read()"))
+        elif op == MAKE_FUNC:
+            pass
+        elif op == CALL_FUNC:
+            name, argc = arg
+            args = self.pop(argc) if argc else []
+            if name == "len":
+                if argc < 1:
+                    raise Unsupported("len() without an argument")
+                push(self.temp(f"len({args[0]})"))
+            else:
+                push(self.temp(f"call({name!r}, [{', '.join(args)}])"))
+        elif op == TAIL_CALL:
+            name, argc = arg
+            args = self.pop(argc) if argc else []
+            if name != self.t.func.name:
+                push(self.temp(f"call({name!r}, [{', '.join(args)}])"))
+                return True
+            # Self-recursion in tail position: rebind the parameters and
+            # start over, like the VM reusing the frame.
+            if args:
+                params = [f"l{i}" for i in range(self.t.nparams)]
+                self.emit(f"{', '.join(params)} = {', '.join(args)}")
+            others = [f"l{i}" for i in range(self.t.nparams, self.t.func.nlocals)]
+            if others:
+                self.emit(" = ".join(others) + " = UNBOUND")
+            self.emit("pc = 0; continue")
+            return False
+        elif op in PY_OPERATORS:
+            a, b = self.pop(2)
+            push(self.binary(op, a, b))
+        elif op == INC_FAST:
+            slot, const = arg
+            self.store_local(slot, f"{self.local(slot)} + {const!r}")
+        elif op == INC_GLOBAL:
+            name, const = arg
+            self.emit(f"G[{name!r}] = G[{name!r}] + {const!r}")
+        elif op == BINARY_OP_FAST_CONST:
+            binop, slot, const = arg
+            push(self.binary(binop, self.local(slot), repr(const)))
+        elif op == LOAD_FAST_FAST:
+            push(self.local(arg[0]))
+            push(self.local(arg[1]))
+        elif op == LOAD_INDEX_FAST:
+            arr, idx = self.local(arg[0]), self.local(arg[1])
+            push(self.temp(f"{arr}[{idx}]"))
+        elif op == LOAD_INDEX_GLOBAL:
+            arr, idx = self.global_(arg[0]), self.global_(arg[1])
+            push(self.temp(f"{arr}[{idx}]"))
+        elif op == JUMP:
+            if self.stack:
+                raise Unsupported("values on the stack at a jump")
+            self.emit(f"pc = {arg}; continue")
+            return False
+        elif op == JUMP_IF_FALSE:
+            self.branch_if_false(self.pop()[0], arg)
+        elif op == COMPARE_JUMP:
+            cmp, target = arg
+            a, b = self.pop(2)
+            self.branch_if_false(f"{a} {PY_OPERATORS[cmp]} {b}", target)
+        elif op == COMPARE_FAST_CONST_JUMP:
+            cmp, slot, const, target = arg
+            self.branch_if_false(f"{self.local(slot)} {PY_OPERATORS[cmp]} {const!r}", target)
+        elif op == COMPARE_GLOBAL_CONST_JUMP:
+            cmp, name, const, target = arg
+            self.branch_if_false(f"G[{name!r}] {PY_OPERATORS[cmp]} {const!r}", target)
+        elif op == RETURN:
+            self.emit(f"return {self.pop()[0]}")
+            return False
+        else:
+            raise Unsupported(f"opcode {op}")
+        return True
+
+
+class _Translator:
+    def __init__(self, func):
+        self.func = func
+        self.nparams = len(func.params)
+        self.ntemps = 0
+        self.origins = {}
+
+    def new_temp(self):
+        self.ntemps += 1
+        return f"t{self.ntemps}"
+
+    def leaders(self):
+        code = self.func.code.instructions()
+        starts = {0}
+        for i, (op, arg) in enumerate(code):
+            if op in JUMP_OPS:
+                starts.add(jump_target(op, arg))
+                starts.add(i + 1)
+            elif op == RETURN:
+                starts.add(i + 1)
+        return sorted(s for s in starts if s < len(code))
+
+    def translate(self):
+        code = self.func.code.instructions()
+        starts = self.leaders()
+        params = ", ".join(f"l{i}" for i in range(self.nparams))
+        lines = [f"def jit_{self.func.name}({params}):"]
+        others = [f"l{i}" for i in range(self.nparams, self.func.nlocals)]
+        if others:
+            lines.append(INDENT + " = ".join(others) + " = UNBOUND")
+        lines.append(INDENT + "pc = 0")
+        lines.append(INDENT + "while True:")
+        for n, start in enumerate(starts):
+            end = starts[n + 1] if n + 1 < len(starts) else len(code)
+            block = _Block(self)
+            falls_through = True
+            for index in range(start, end):
+                block.index = index
+                falls_through = block.instruction(*code[index])
+                if not falls_through:
+                    break
+            if falls_through:
+                if end >= len(code):
+                    raise Unsupported("control runs off the end of the function")
+                if block.stack:
+                    raise Unsupported("values on the stack between blocks")
+                block.emit(f"pc = {end}; continue")
+            keyword = "if" if n == 0 else "elif"
+            lines.append(INDENT * 2 + f"{keyword} pc == {start}:")
+            for line, index in zip(block.lines, block.origins):
+                lines.append(INDENT * 3 + line)
+                if index is not None:
+                    self.origins[len(lines)] = index
+        return "\n".join(lines) + "\n"
+
+
+def translate(func):
+    """Return ``(source, origins)`` for ``jit_<name>``, or raise Unsupported.
+
+    ``origins`` maps line numbers of ``source`` to the index of the
+    instruction the line was generated from.
+    """
+    if not len(func.code):
+        raise Unsupported("empty function")
+    translator = _Translator(func)
+    return translator.translate(), translator.origins
+
+
+def error_position(tb, stop):
+    """Source position of the compiled code that raised, from traceback ``tb``.
+
+    Returns ``(found, position)``. ``found`` is False when the innermost
+    frame of interest is not compiled code: no compiled frame is on ``tb``,
+    or a frame running ``stop`` (a code object) is inside the last one.
+    """
+    origin = None
+    while tb is not None:
+        frame = tb.tb_frame
+        compiled = frame.f_globals.get(LINE_ORIGINS)
+        if compiled is not None:
+            origin = compiled, tb.tb_lineno
+        elif frame.f_code is stop:
+            origin = None
+        tb = tb.tb_next
+    if origin is None:
+        return False, None
+    (code, origins), line = origin
+    index = origins.get(line)
+    return True, None if index is None else code.position(index)
+
+
+def compile_function(func, namespace):
+    """Compile ``func`` to a Python function, or return None if unsupported.
+
+    ``namespace`` supplies the names the generated code uses: ``G`` (the
+    VM's globals), ``call(name, args)``, ``undefined(name)``, ``UNBOUND``,
+    and ``write(value)`` and ``read()`` for PRINT and INPUT.
+    The generated source is kept on the result as ``koala_source``.
+    """
+    try:
+        source, origins = translate(func)
+    except Unsupported:
+        return None
+    env = dict(namespace)
+    env[LINE_ORIGINS] = (func.code, origins)
+    exec(compile(source, f"<jit {func.name}>", "exec"), env)
+    fn = env[f"jit_{func.name}"]
+    fn.koala_source = source
+    return fn
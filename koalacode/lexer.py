@@ -1,4 +1,5 @@
 import re
+from array import array
 
 TOKEN_SPEC = [
     ('NUMBER',   r'\d+'),
@@ -19,9 +20,14 @@ TOKEN_SPEC = [
     ('MISMATCH', r'.'),
 ]
 
+# Compiled once; every tokenizer call reuses it.
+TOKEN_REGEX = re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern in TOKEN_SPEC))
+
 KEYWORDS = {"give", "take", "this", "otherwise", "iter", "iter2", "true", "false", "func", "return"}
 
 class Token:
+    __slots__ = ('type', 'value', 'line', 'col')
+
     def __init__(self, type_, value, line, col):
         self.type = type_
         self.value = value
@@ -30,13 +36,18 @@ class Token:
     def __repr__(self):
         return f"Token({self.type},{self.value}, line={self.line}, col={self.col})"
 
-def tokenize(code):
+def iter_tokens(code):
+    """Yield the tokens of ``code`` one at a time, ending with an EOF token.
+
+    A bad character raises when the scan reaches it, so a consumer that
+    stops early (or fails first) never sees it.
+    """
     code = code.replace("\r\n", "\n").replace("\r", "\n")
-    tok_regex = '|'.join(f'(?P<{name}>{pattern})' for name, pattern in TOKEN_SPEC)
+    keywords = KEYWORDS
     line_num = 1
     line_start = 0
-    tokens = []
-    for mo in re.finditer(tok_regex, code):
+    column = 1
+    for mo in TOKEN_REGEX.finditer(code):
         kind = mo.lastgroup
         value = mo.group()
         column = mo.start() - line_start + 1
@@ -45,8 +56,9 @@ def tokenize(code):
             value = int(value)
         elif kind == 'STRING':
             value = value[1:-1]
-        elif kind == 'ID' and value in KEYWORDS:
-            kind = value.upper()
+        elif kind == 'ID':
+            if value in keywords:
+                kind = value.upper()
         elif kind == 'SKIP':
             if '\n' in value:
                 line_num += value.count('\n')
@@ -57,6 +69,50 @@ def tokenize(code):
         elif kind == 'MISMATCH':
             raise RuntimeError(f"[Line {line_num}, Col {column}] Unexpected token: {value}")
 
-        tokens.append(Token(kind, value, line_num, column))
-    tokens.append(Token('EOF', None, line_num, column))
-    return tokens
+        yield Token(kind, value, line_num, column)
+    yield Token('EOF', None, line_num, column)
+
+def tokenize(code):
+    """Return all tokens of ``code`` as a list (see ``iter_tokens``)."""
+    return list(iter_tokens(code))
+
+
+class TokenStore:
+    """All tokens of a source kept in parallel arrays.
+
+    Types are stored as small integers into ``TYPES`` and lines and columns
+    as machine integers, so a large source costs a few bytes per token plus
+    its values. Iterating yields ``Token`` objects, so a ``Parser`` can read
+    a store directly; ``len`` and indexing work as on a token list.
+    """
+    TYPES = [name for name, _ in TOKEN_SPEC] + [kw.upper() for kw in sorted(KEYWORDS)] + ['EOF']
+    _TYPE_INDEX = {name: i for i, name in enumerate(TYPES)}
+
+    def __init__(self, tokens=()):
+        self.types = array('B')
+        self.values = []
+        self.lines = array('i')
+        self.cols = array('i')
+        for tok in tokens:
+            self.append(tok)
+
+    @classmethod
+    def from_source(cls, code):
+        return cls(iter_tokens(code))
+
+    def append(self, tok):
+        self.types.append(self._TYPE_INDEX[tok.type])
+        self.values.append(tok.value)
+        self.lines.append(tok.line)
+        self.cols.append(tok.col)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, i):
+        return Token(self.TYPES[self.types[i]], self.values[i], self.lines[i], self.cols[i])
+
+    def __iter__(self):
+        types = self.TYPES
+        for t, value, line, col in zip(self.types, self.values, self.lines, self.cols):
+            yield Token(types[t], value, line, col)
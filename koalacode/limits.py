@@ -0,0 +1,182 @@
+# koalacode/limits.py
+"""Resource limits for running untrusted programs.
+
+``Limits`` is the budget of one run:
+
+``fuel``            steps, where a step is a loop iteration or a call
+``array_elements``  total elements of the arrays the program creates
+``string_chars``    total characters of the strings it creates with ``+``,
+                    ``*`` or ``take()``
+``int_bits``        bits of the largest integer a ``*`` may produce
+
+The budgets are cumulative over a run, so they bound what a program can
+allocate rather than what it holds at one moment; building a string by
+repeated ``+`` is charged for every intermediate string. ``int_bits`` is
+a cap on one value instead: repeated squaring doubles an integer's size
+with every step, while ``+`` and ``-`` grow it by a bit at most, so only
+products are checked. ``None`` leaves a budget unlimited. Literals are free, and so on the VM are the short strings
+the optimizer folds from them.
+
+Engines keep the remaining budget in a ``Meter`` and only check it where
+it can change: loop iterations (on the VM, backward jumps) and calls for
+fuel, and the operations that make a new array, string or product for
+memory. Only the budgets that are set are checked. The size of an array,
+string or product is charged before it is built. Going over a budget ends the run with a
+RuntimeError_ at the offending position.
+
+Fuel is counted in batches of ``FUEL_BATCH`` steps. The VM takes a batch
+from the meter at a time and gives back what it did not use, so it stops
+at the exact step. The interpreters' loops count their iterations locally
+and charge them every ``FUEL_BATCH`` iterations and when the loop ends, so
+a run may go on for less than ``FUEL_BATCH`` steps past the budget in each
+loop in progress.
+"""
+import sys
+
+# Remaining budget of an unlimited counter; never runs out in practice.
+UNLIMITED = sys.maxsize
+
+# Steps of fuel charged at a time by loops and the VM.
+FUEL_BATCH = 64
+
+
+class LimitExceeded(RuntimeError):
+    """A budget of a ``Meter`` ran out (the VM reports it with a position)."""
+
+
+class Limits:
+    """The budgets of one run; ``None`` means unlimited."""
+    __slots__ = ('fuel', 'array_elements', 'string_chars', 'int_bits')
+
+    def __init__(self, fuel=None, array_elements=None, string_chars=None, int_bits=None):
+        self.fuel = fuel
+        self.array_elements = array_elements
+        self.string_chars = string_chars
+        self.int_bits = int_bits
+
+    def __repr__(self):
+        return (f"Limits(fuel={self.fuel}, array_elements={self.array_elements}, "
+                f"string_chars={self.string_chars}, int_bits={self.int_bits})")
+
+
+class Meter:
+    """What is left of a ``Limits`` during a run.
+
+    Hot paths decrement a counter themselves and call ``check`` only once
+    it goes negative; the ``charge`` methods do both. ``error(message, at)``
+    is the engine's error callback and position; without one, going over
+    a budget raises LimitExceeded. Engines leave out the checks of fuel
+    unless ``counts_fuel``, those of arrays, strings and products unless
+    ``counts_memory``, and those of products of numbers unless
+    ``counts_ints``.
+    """
+    __slots__ = ('limits', 'fuel', 'array_elements', 'string_chars', 'int_bits',
+                 'counts_fuel', 'counts_memory', 'counts_ints')
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.counts_fuel = limits.fuel is not None
+        self.counts_ints = limits.int_bits is not None
+        self.counts_memory = (limits.array_elements is not None
+                              or limits.string_chars is not None or self.counts_ints)
+        self.int_bits = UNLIMITED if limits.int_bits is None else limits.int_bits
+        self.reset()
+
+    def reset(self):
+        """Restore the full budget for a new run."""
+        limits = self.limits
+        self.fuel = UNLIMITED if limits.fuel is None else limits.fuel
+        self.array_elements = (UNLIMITED if limits.array_elements is None
+                               else limits.array_elements)
+        self.string_chars = (UNLIMITED if limits.string_chars is None
+                             else limits.string_chars)
+
+    def check(self, error=None, at=None):
+        """Report the budget that is overdrawn, if any."""
+        limits = self.limits
+        if self.fuel < 0:
+            message = f"Step limit exceeded ({limits.fuel} steps)"
+        elif self.array_elements < 0:
+            message = f"Array limit exceeded ({limits.array_elements} elements)"
+        elif self.string_chars < 0:
+            message = f"String limit exceeded ({limits.string_chars} characters)"
+        else:
+            return
+        self._exceeded(message, error, at)
+
+    def _exceeded(self, message, error, at):
+        if error is None:
+            raise LimitExceeded(message)
+        error(message, at)
+
+    def step(self, error=None, at=None):
+        """Charge one step (a loop iteration or a call)."""
+        self.fuel -= 1
+        if self.fuel < 0:
+            self.check(error, at)
+
+    def spend(self, steps, error=None, at=None):
+        """Charge ``steps`` steps counted by a loop."""
+        self.fuel -= steps
+        if self.fuel < 0:
+            self.check(error, at)
+
+    def take(self, steps):
+        """Take up to ``steps`` steps of fuel; return how many were taken.
+
+        Taking from an empty budget overdraws it by one step and reports it.
+        """
+        taken = min(steps, self.fuel)
+        if taken <= 0:
+            self.fuel -= 1
+            self.check()
+        self.fuel -= taken
+        return taken
+
+    def charge_array(self, size, error=None, at=None):
+        self.array_elements -= size
+        if self.array_elements < 0:
+            self.check(error, at)
+
+    def charge_string(self, size, error=None, at=None):
+        self.string_chars -= size
+        if self.string_chars < 0:
+            self.check(error, at)
+
+    # charge_add and charge_mul run for every '+' and '*' that can build a
+    # string or an array, so they charge without calling charge_*.
+
+    def charge_add(self, a, b, error=None, at=None):
+        """Charge ``a + b`` if it builds a string or an array."""
+        if a.__class__ is str and b.__class__ is str:
+            self.string_chars -= len(a) + len(b)
+            if self.string_chars < 0:
+                self.check(error, at)
+        elif a.__class__ is list and b.__class__ is list:
+            self.array_elements -= len(a) + len(b)
+            if self.array_elements < 0:
+                self.check(error, at)
+
+    def charge_mul(self, a, b, error=None, at=None):
+        """Charge ``a * b`` if it repeats a string or an array.
+
+        A product of two integers is checked against ``int_bits``, by the
+        most bits it can have.
+        """
+        if a.__class__ is int and b.__class__ is int:
+            if a.bit_length() + b.bit_length() > self.int_bits:
+                self._exceeded(f"Integer limit exceeded ({self.limits.int_bits} bits)",
+                               error, at)
+            return
+        if isinstance(a, int):
+            a, b = b, a
+        if not isinstance(b, int):
+            return
+        if a.__class__ is str:
+            self.string_chars -= len(a) * max(b, 0)
+            if self.string_chars < 0:
+                self.check(error, at)
+        elif a.__class__ is list:
+            self.array_elements -= len(a) * max(b, 0)
+            if self.array_elements < 0:
+                self.check(error, at)
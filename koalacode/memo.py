@@ -0,0 +1,241 @@
+# koalacode/memo.py
+"""Purity analysis and result caching for KoalaCode functions.
+
+A function is pure when its result depends only on its arguments and
+calling it has no visible effect: it does no ``give``/``take``, reads and
+writes no globals, assigns no array elements, defines no functions and
+calls only pure functions (recursion included). Both engines serve calls
+of pure functions from a bounded ``LRUCache`` per function.
+
+Only calls whose arguments are hashable are cached, and list results are
+never cached, since the caller could mutate them. Errors are not cached
+either: a failing call raises every time.
+"""
+from collections import OrderedDict
+
+from .opcodes import (
+    PRINT, INPUT, LOAD_GLOBAL, STORE_GLOBAL, STORE_SUBSCR, CALL_FUNC, TAIL_CALL,
+    INC_GLOBAL, COMPARE_GLOBAL_CONST_JUMP, LOAD_INDEX_GLOBAL,
+    COMPARE_GLOBAL_CONST_JUMP_GENERIC,
+    COMPARE_GLOBAL_CONST_LT_JUMP_INT, COMPARE_GLOBAL_CONST_LE_JUMP_INT,
+    COMPARE_GLOBAL_CONST_GT_JUMP_INT, COMPARE_GLOBAL_CONST_GE_JUMP_INT,
+)
+
+# Results kept per function.
+MEMO_SIZE = 1024
+
+MISSING = object()
+
+# Instructions that do I/O or touch global or shared state.
+IMPURE_OPS = {
+    PRINT, INPUT, LOAD_GLOBAL, STORE_GLOBAL, STORE_SUBSCR, INC_GLOBAL,
+    COMPARE_GLOBAL_CONST_JUMP, COMPARE_GLOBAL_CONST_JUMP_GENERIC,
+    COMPARE_GLOBAL_CONST_LT_JUMP_INT, COMPARE_GLOBAL_CONST_LE_JUMP_INT,
+    COMPARE_GLOBAL_CONST_GT_JUMP_INT, COMPARE_GLOBAL_CONST_GE_JUMP_INT,
+    LOAD_INDEX_GLOBAL,
+}
+
+
+class LRUCache:
+    """Bounded mapping from argument keys to results, with hit counters."""
+    __slots__ = ("maxsize", "data", "hits", "misses")
+
+    def __init__(self, maxsize=MEMO_SIZE):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached result for ``key``, or MISSING."""
+        data = self.data
+        if key in data:
+            data.move_to_end(key)
+            self.hits += 1
+            return data[key]
+        self.misses += 1
+        return MISSING
+
+    def put(self, key, value):
+        if value.__class__ is list:
+            return
+        self.data[key] = value
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def stats(self):
+        calls = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / calls if calls else 0.0,
+            "size": len(self.data),
+        }
+
+
+def make_key(args):
+    """Cache key for a call with ``args``, or None if they are unhashable.
+
+    Argument types are part of the key so that ``f(1)`` and ``f(true)``,
+    which Python considers equal, are cached separately.
+    """
+    key = (*args, *[a.__class__ for a in args])
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _solve(candidates, calls):
+    """Drop candidates that call a non-candidate, until nothing changes.
+
+    ``calls`` maps each candidate to the names it calls. What is left is
+    the largest set of functions that call only each other (or ``len``).
+    """
+    pure = set(candidates)
+    changed = True
+    while changed:
+        changed = False
+        for name in list(pure):
+            if any(callee != "len" and callee not in pure for callee in calls[name]):
+                pure.discard(name)
+                changed = True
+    return pure
+
+
+# Tree interpreter: analysis of the AST.
+
+class _BodyScan:
+    """Checks one function body, tracking which locals are surely assigned.
+
+    A variable read before the function has certainly assigned it may find
+    a global, so it makes the function impure. So does such an assignment,
+    because its type check compares against the global, unless the type
+    checker proved that check away (``proven``).
+    """
+
+    def __init__(self, params, proven):
+        self.defined = set(params)
+        self.proven = proven
+        self.calls = set()
+        self.pure = True
+
+    def stmt(self, node):
+        kind = node.kind
+        if kind in ('give', 'take', 'assign_index', 'func_def'):
+            self.pure = False
+        elif kind == 'block':
+            for stmt in node.stmts:
+                self.stmt(stmt)
+        elif kind == 'assign':
+            self.expr(node.value)
+            if node.name not in self.defined and id(node) not in self.proven:
+                self.pure = False
+            self.defined.add(node.name)
+        elif kind == 'if':
+            self.expr(node.cond)
+            before = set(self.defined)
+            self.stmt(node.then)
+            after_then, self.defined = self.defined, before
+            if node.orelse:
+                self.stmt(node.orelse)
+                self.defined &= after_then
+        elif kind in ('while', 'for'):
+            step = None
+            if kind == 'for':
+                self.stmt(node.init)
+                step = node.step
+            self.expr(node.cond)
+            before = set(self.defined)
+            self.stmt(node.body)
+            if step is not None:
+                self.stmt(step)
+            self.defined = before
+        elif kind == 'return':
+            self.expr(node.value)
+        else:
+            self.expr(node)
+
+    def expr(self, node):
+        kind = node.kind
+        if kind == 'expr':
+            self.expr(node.expr)
+        elif kind == 'var':
+            self.read(node.name)
+        elif kind == 'index':
+            self.read(node.name)
+            self.expr(node.index)
+        elif kind == 'binop':
+            self.expr(node.left)
+            self.expr(node.right)
+        elif kind == 'array':
+            for elem in node.elems:
+                self.expr(elem)
+        elif kind == 'func_call':
+            self.calls.add(node.name)
+            for arg in node.args:
+                self.expr(arg)
+
+    def read(self, name):
+        if name not in self.defined:
+            self.pure = False
+
+
+def _func_defs(node, out):
+    if node.kind == 'func_def':
+        out.append(node)
+    for child in node.children():
+        _func_defs(child, out)
+    return out
+
+
+def pure_func_defs(tree, proven=()):
+    """Map the id of each pure 'func_def' node in ``tree`` to the names it calls.
+
+    ``proven`` holds the ids of 'assign' nodes that need no type check (see
+    ``typecheck.check``). A name defined more than once is only pure if
+    every definition is.
+    """
+    defs = _func_defs(tree, [])
+    calls = {}
+    impure = set()
+    for node in defs:
+        scan = _BodyScan(node.params, proven)
+        scan.stmt(node.body)
+        calls.setdefault(node.name, set()).update(scan.calls)
+        if not scan.pure:
+            impure.add(node.name)
+    pure = _solve(set(calls) - impure, calls)
+    return {id(node): calls[node.name] for node in defs if node.name in pure}
+
+
+def still_pure(calls, defined):
+    """Return the names in ``calls`` (name -> names it calls) that stay pure.
+
+    For use after a definition changes: a pure function stays pure while
+    every function it calls is pure too, or not ``defined`` yet, since
+    calling an undefined function raises and errors are not cached.
+    """
+    return _solve(set(calls), {name: {callee for callee in callees if callee in defined}
+                               for name, callees in calls.items()})
+
+
+# VM: analysis of compiled bytecode.
+
+def pure_functions(funcs):
+    """Return the names in ``funcs`` (name -> compiler.Function) that are pure."""
+    calls = {}
+    candidates = set()
+    for name, func in funcs.items():
+        calls[name] = set()
+        code = func.code.instructions()
+        if any(op in IMPURE_OPS for op, _ in code):
+            continue
+        for op, arg in code:
+            if op == CALL_FUNC or op == TAIL_CALL:
+                calls[name].add(arg[0])
+        # Slots other than parameters start unbound; a VM read of one
+        # raises instead of finding a global, so reads need no tracking.
+        candidates.add(name)
+    return _solve(candidates, calls)
@@ -0,0 +1,348 @@
+# koalacode/nodes.py
+"""AST node classes produced by the ``Parser``.
+
+Every kind of node is a class whose ``__slots__`` are its fields, so a node
+costs no instance ``__dict__`` and engines read ``node.cond`` instead of
+unpacking tuples. ``kind`` names the node for dispatch and ``fields`` lists
+the slots in source order.
+
+Source positions are not stored on nodes. The Parser records them in a
+``Positions`` table, which the root ``Module`` carries; it is only looked
+at when an error is reported.
+"""
+from array import array
+
+
+class Node:
+    __slots__ = ()
+    kind = None
+    fields = ()
+
+    def children(self):
+        """Yield the nodes directly below this one."""
+        for name in self.fields:
+            value = getattr(self, name)
+            if isinstance(value, Node):
+                yield value
+            elif isinstance(value, list):
+                for item in value:
+                    if isinstance(item, Node):
+                        yield item
+
+    def __repr__(self):
+        values = ", ".join(repr(getattr(self, name)) for name in self.fields)
+        return f"{type(self).__name__}({values})"
+
+
+class Block(Node):
+    __slots__ = fields = ('stmts',)
+    kind = 'block'
+
+    def __init__(self, stmts):
+        self.stmts = stmts
+
+
+class Module(Block):
+    """The root of a parsed program: a block plus its position table."""
+    __slots__ = ('positions',)
+
+    def __init__(self, stmts, positions):
+        self.stmts = stmts
+        self.positions = positions
+
+
+class Give(Node):
+    __slots__ = fields = ('expr',)
+    kind = 'give'
+
+    def __init__(self, expr):
+        self.expr = expr
+
+
+class Take(Node):
+    __slots__ = ()
+    kind = 'take'
+
+
+class If(Node):
+    __slots__ = fields = ('cond', 'then', 'orelse')
+    kind = 'if'
+
+    def __init__(self, cond, then, orelse):
+        self.cond = cond
+        self.then = then
+        self.orelse = orelse
+
+
+class While(Node):
+    __slots__ = fields = ('cond', 'body')
+    kind = 'while'
+
+    def __init__(self, cond, body):
+        self.cond = cond
+        self.body = body
+
+
+class For(Node):
+    __slots__ = fields = ('init', 'cond', 'step', 'body')
+    kind = 'for'
+
+    def __init__(self, init, cond, step, body):
+        self.init = init
+        self.cond = cond
+        self.step = step
+        self.body = body
+
+
+class Assign(Node):
+    __slots__ = fields = ('name', 'value')
+    kind = 'assign'
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+
+class AssignIndex(Node):
+    __slots__ = fields = ('name', 'index', 'value')
+    kind = 'assign_index'
+
+    def __init__(self, name, index, value):
+        self.name = name
+        self.index = index
+        self.value = value
+
+
+class ExprStmt(Node):
+    __slots__ = fields = ('expr',)
+    kind = 'expr'
+
+    def __init__(self, expr):
+        self.expr = expr
+
+
+class Return(Node):
+    __slots__ = fields = ('value',)
+    kind = 'return'
+
+    def __init__(self, value):
+        self.value = value
+
+
+class FuncDef(Node):
+    __slots__ = fields = ('name', 'params', 'body')
+    kind = 'func_def'
+
+    def __init__(self, name, params, body):
+        self.name = name
+        self.params = params
+        self.body = body
+
+
+class BinOp(Node):
+    __slots__ = fields = ('op', 'left', 'right')
+    kind = 'binop'
+
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+
+
+class Num(Node):
+    __slots__ = fields = ('value',)
+    kind = 'num'
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Str(Node):
+    __slots__ = fields = ('value',)
+    kind = 'str'
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Bool(Node):
+    __slots__ = fields = ('value',)
+    kind = 'bool'
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Var(Node):
+    __slots__ = fields = ('name',)
+    kind = 'var'
+
+    def __init__(self, name):
+        self.name = name
+
+
+class Array(Node):
+    __slots__ = fields = ('elems',)
+    kind = 'array'
+
+    def __init__(self, elems):
+        self.elems = elems
+
+
+class Index(Node):
+    __slots__ = fields = ('name', 'index')
+    kind = 'index'
+
+    def __init__(self, name, index):
+        self.name = name
+        self.index = index
+
+
+class FuncCall(Node):
+    __slots__ = fields = ('name', 'args')
+    kind = 'func_call'
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+
+# Node kinds whose only field is a literal value.
+CONSTANTS = ('num', 'str', 'bool')
+
+# The fields of each class that hold a node, a list of nodes or None; the
+# others hold plain values (names, operators, literals).
+CHILD_FIELDS = {
+    Block: ('stmts',), Module: ('stmts',), Give: ('expr',), Take: (),
+    If: ('cond', 'then', 'orelse'), While: ('cond', 'body'),
+    For: ('init', 'cond', 'step', 'body'), Assign: ('value',),
+    AssignIndex: ('index', 'value'), ExprStmt: ('expr',), Return: ('value',),
+    FuncDef: ('body',), BinOp: ('left', 'right'), Num: (), Str: (), Bool: (),
+    Var: (), Array: ('elems',), Index: ('index',), FuncCall: ('args',),
+}
+NODE_CLASSES = {cls.__name__: cls for cls in CHILD_FIELDS}
+
+
+class Positions:
+    """Side table of the source ``(line, col)`` of the nodes of a tree.
+
+    Literals (``Num``, ``Str``, ``Bool``) cannot fail and are not recorded.
+
+    Positions are appended in parallel arrays as the parser creates nodes;
+    the lookup index from node to row is only built the first time ``get``
+    is called, which normally means an error is being reported.
+    """
+    __slots__ = ('nodes', 'lines', 'cols', '_rows')
+
+    def __init__(self):
+        self.nodes = []
+        self.lines = array('i')
+        self.cols = array('i')
+        self._rows = None
+
+    def add(self, node, line, col):
+        """Record where ``node`` starts; return ``node``."""
+        self.nodes.append(node)
+        self.lines.append(line)
+        self.cols.append(col)
+        self._rows = None
+        return node
+
+    def __getstate__(self):
+        # The row index is keyed by id(), which means nothing once
+        # unpickled; it is rebuilt on demand.
+        return None, {'nodes': self.nodes, 'lines': self.lines, 'cols': self.cols, '_rows': None}
+
+    def get(self, node):
+        """Return ``(line, col)`` for ``node``, or None if it is not known."""
+        if self._rows is None:
+            self._rows = {id(n): i for i, n in enumerate(self.nodes)}
+        row = self._rows.get(id(node))
+        if row is None:
+            return None
+        return self.lines[row], self.cols[row]
+
+    def where(self, node):
+        """``"[Line l, Col c] "`` for ``node``, or an empty string."""
+        pos = self.get(node) if node is not None else None
+        if pos is None:
+            return ""
+        return f"[Line {pos[0]}, Col {pos[1]}] "
+
+
+def positions_of(tree):
+    """The position table of a parsed tree (empty for hand-built trees)."""
+    positions = getattr(tree, 'positions', None)
+    return positions if positions is not None else Positions()
+
+
+def encode_tree(tree):
+    """Flatten ``tree`` and its positions into lists, tuples and plain values.
+
+    Returns ``(records, rows)``. ``records`` has one ``(class name,
+    *fields)`` tuple per node, children before their parent and the root
+    last; a child field holds the index of its node's record. ``rows`` are
+    the ``(record, line, col)`` of the position table. The result can be
+    stored as JSON and read back with ``decode_tree``, which only ever
+    builds node classes, unlike unpickling.
+    """
+    order = []
+    stack = [(tree, False)]
+    while stack:
+        node, done = stack.pop()
+        if done:
+            order.append(node)
+            continue
+        stack.append((node, True))
+        stack.extend((child, False) for child in reversed(list(node.children())))
+    index = {id(node): i for i, node in enumerate(order)}
+
+    records = []
+    for node in order:
+        cls = type(node)
+        children = CHILD_FIELDS[cls]
+        record = [cls.__name__]
+        for name in cls.fields:
+            value = getattr(node, name)
+            if name in children:
+                if isinstance(value, list):
+                    value = [index[id(child)] for child in value]
+                elif value is not None:
+                    value = index[id(value)]
+            record.append(value)
+        records.append(tuple(record))
+    positions = positions_of(tree)
+    rows = [(index[id(node)], line, col)
+            for node, line, col in zip(positions.nodes, positions.lines, positions.cols)
+            if id(node) in index]
+    return records, rows
+
+
+def decode_tree(data):
+    """Rebuild a tree from ``encode_tree`` output; ValueError if it is malformed."""
+    try:
+        records, rows = data
+        nodes = []
+        for record in records:
+            cls = NODE_CLASSES[record[0]]
+            if len(record) != len(cls.fields) + 1:
+                raise ValueError(f"{record[0]} record has {len(record) - 1} fields")
+            children = CHILD_FIELDS[cls]
+            node = cls.__new__(cls)
+            for name, value in zip(cls.fields, record[1:]):
+                if name in children:
+                    if isinstance(value, list):
+                        value = [nodes[i] for i in value]
+                    elif value is not None:
+                        value = nodes[value]
+                setattr(node, name, value)
+            nodes.append(node)
+        positions = Positions()
+        for i, line, col in rows:
+            positions.add(nodes[i], line, col)
+        root = nodes[-1]
+    except (KeyError, IndexError, TypeError, ValueError) as exc:
+        raise ValueError(f"malformed tree data: {exc}") from None
+    if isinstance(root, Module):
+        root.positions = positions
+    return root
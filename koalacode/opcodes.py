@@ -0,0 +1,241 @@
+# koalacode/opcodes.py
+"""Opcode numbers shared by the Compiler and the VM.
+
+Module-level variables live in a dict and are reached with the ``*_GLOBAL``
+opcodes; a function's parameters and locals are resolved by the Compiler to
+numbered slots in the frame and use the ``*_FAST`` opcodes.
+
+Every instruction in ``Compiler.bytecode`` is an ``(opcode, arg, position)``
+triple where ``opcode`` is one of the integers below and ``position`` the
+source ``(line, col)`` it was compiled from. Each binary operator has an
+opcode of its own, so the VM never looks at an operator string at run time;
+it indexes its handler table with the opcode instead. The VM runs packed
+``assembler.Code`` objects, in which ``NAME_OPS``, ``INT_OPS`` and
+``NO_ARG_OPS`` decide how an argument is stored.
+
+The optimizer may also fuse frequent instruction sequences into the
+superinstructions defined at the end of the table; their argument is a
+tuple of the operands of the instructions they replace.
+"""
+import operator
+
+PUSH_CONST = 0       # arg: constant value
+POP = 1
+LOAD_GLOBAL = 2      # arg: variable name
+STORE_GLOBAL = 3     # arg: variable name
+LOAD_FAST = 4        # arg: local slot number
+STORE_FAST = 5       # arg: local slot number
+BUILD_ARRAY = 6      # arg: element count
+BINARY_SUBSCR = 7    # pops index, array; pushes array[index]
+STORE_SUBSCR = 8     # pops value, index, array; sets array[index] = value
+PRINT = 9
+INPUT = 10
+JUMP = 11            # arg: absolute target
+JUMP_IF_FALSE = 12   # arg: absolute target; pops condition
+MAKE_FUNC = 13       # arg: function name
+CALL_FUNC = 14       # arg: (name, argc)
+RETURN = 15
+
+# Binary operators: pop b, pop a, push (a <op> b).
+BINARY_ADD = 16
+BINARY_SUB = 17
+BINARY_MUL = 18
+BINARY_FLOORDIV = 19
+COMPARE_LT = 20
+COMPARE_GT = 21
+COMPARE_LE = 22
+COMPARE_GE = 23
+COMPARE_EQ = 24
+COMPARE_NE = 25
+BINARY_AND = 26
+BINARY_OR = 27
+
+# Emitted by the optimizer.
+DUP_TOP = 28         # pushes a second reference to the top of the stack
+
+# Superinstructions, also emitted by the optimizer. The patterns come from
+# running benchmarks/profile_opcodes.py over the example programs.
+INC_FAST = 29                    # (slot, const): x = x + const
+INC_GLOBAL = 30                  # (name, const): x = x + const
+COMPARE_JUMP = 31                # (compare op, target): compare, JUMP_IF_FALSE
+COMPARE_FAST_CONST_JUMP = 32     # (compare op, slot, const, target)
+COMPARE_GLOBAL_CONST_JUMP = 33   # (compare op, name, const, target)
+BINARY_OP_FAST_CONST = 34        # (binary op, slot, const): push x <op> const
+LOAD_FAST_FAST = 35              # (slot, slot): push two locals
+LOAD_INDEX_FAST = 36             # (array slot, index slot): push a[i]
+LOAD_INDEX_GLOBAL = 37           # (array name, index name): push a[i]
+
+# Quickened forms. The VM rewrites an instruction in place into one of these
+# after watching it run (see VM._warm); they keep the argument of the
+# instruction they replace. The *_GENERIC forms are the final fallback when
+# the operands are not of a specializable type or a specialized guard fails.
+COMPARE_JUMP_GENERIC = 38
+COMPARE_FAST_CONST_JUMP_GENERIC = 39
+COMPARE_GLOBAL_CONST_JUMP_GENERIC = 40
+BINARY_OP_FAST_CONST_GENERIC = 41
+COMPARE_LT_JUMP_INT = 42
+COMPARE_LE_JUMP_INT = 43
+COMPARE_GT_JUMP_INT = 44
+COMPARE_GE_JUMP_INT = 45
+COMPARE_FAST_CONST_LT_JUMP_INT = 46
+COMPARE_FAST_CONST_LE_JUMP_INT = 47
+COMPARE_FAST_CONST_GT_JUMP_INT = 48
+COMPARE_FAST_CONST_GE_JUMP_INT = 49
+COMPARE_GLOBAL_CONST_LT_JUMP_INT = 50
+COMPARE_GLOBAL_CONST_LE_JUMP_INT = 51
+COMPARE_GLOBAL_CONST_GT_JUMP_INT = 52
+COMPARE_GLOBAL_CONST_GE_JUMP_INT = 53
+BINARY_ADD_FAST_CONST_INT = 54
+BINARY_SUB_FAST_CONST_INT = 55
+BINARY_ADD_FAST_CONST_STR = 56
+
+# Emitted by the Compiler for 'return f(...)' inside a function, followed by
+# a RETURN. The VM replaces the current frame with the callee's instead of
+# pushing a new one; when it cannot, it behaves as CALL_FUNC and the RETURN
+# hands the result back.
+TAIL_CALL = 57       # arg: (name, argc)
+
+# Source operator -> opcode, used by the Compiler.
+BINARY_OPS = {
+    "+": BINARY_ADD,
+    "-": BINARY_SUB,
+    "*": BINARY_MUL,
+    "/": BINARY_FLOORDIV,
+    "<": COMPARE_LT,
+    ">": COMPARE_GT,
+    "<=": COMPARE_LE,
+    ">=": COMPARE_GE,
+    "==": COMPARE_EQ,
+    "!=": COMPARE_NE,
+    "&&": BINARY_AND,
+    "||": BINARY_OR,
+}
+
+COMPARE_OPS = (COMPARE_LT, COMPARE_GT, COMPARE_LE, COMPARE_GE, COMPARE_EQ, COMPARE_NE)
+
+# Python equivalents of the binary opcodes, for constant folding and for the
+# superinstructions that carry a binary opcode in their argument.
+BINARY_FUNCS = {
+    BINARY_ADD: operator.add,
+    BINARY_SUB: operator.sub,
+    BINARY_MUL: operator.mul,
+    BINARY_FLOORDIV: operator.floordiv,
+    COMPARE_LT: operator.lt,
+    COMPARE_GT: operator.gt,
+    COMPARE_LE: operator.le,
+    COMPARE_GE: operator.ge,
+    COMPARE_EQ: operator.eq,
+    COMPARE_NE: operator.ne,
+    BINARY_AND: lambda a, b: a and b,
+    BINARY_OR: lambda a, b: a or b,
+}
+
+# Opcodes that may jump, mapped to the position of the target in their
+# argument (None when the argument is the target itself).
+JUMP_OPS = {
+    JUMP: None,
+    JUMP_IF_FALSE: None,
+    COMPARE_JUMP: 1,
+    COMPARE_FAST_CONST_JUMP: 3,
+    COMPARE_GLOBAL_CONST_JUMP: 3,
+    COMPARE_JUMP_GENERIC: 1,
+    COMPARE_FAST_CONST_JUMP_GENERIC: 3,
+    COMPARE_GLOBAL_CONST_JUMP_GENERIC: 3,
+    COMPARE_LT_JUMP_INT: 1,
+    COMPARE_LE_JUMP_INT: 1,
+    COMPARE_GT_JUMP_INT: 1,
+    COMPARE_GE_JUMP_INT: 1,
+    COMPARE_FAST_CONST_LT_JUMP_INT: 3,
+    COMPARE_FAST_CONST_LE_JUMP_INT: 3,
+    COMPARE_FAST_CONST_GT_JUMP_INT: 3,
+    COMPARE_FAST_CONST_GE_JUMP_INT: 3,
+    COMPARE_GLOBAL_CONST_LT_JUMP_INT: 3,
+    COMPARE_GLOBAL_CONST_LE_JUMP_INT: 3,
+    COMPARE_GLOBAL_CONST_GT_JUMP_INT: 3,
+    COMPARE_GLOBAL_CONST_GE_JUMP_INT: 3,
+}
+
+
+# How ``assembler.assemble`` stores arguments: as an index into the names
+# table, as the number itself, or not at all. Any other argument goes into
+# the constant pool.
+NAME_OPS = frozenset((LOAD_GLOBAL, STORE_GLOBAL, MAKE_FUNC))
+INT_OPS = frozenset((LOAD_FAST, STORE_FAST, BUILD_ARRAY, JUMP, JUMP_IF_FALSE))
+NO_ARG_OPS = frozenset((
+    POP, BINARY_SUBSCR, STORE_SUBSCR, PRINT, INPUT, RETURN, DUP_TOP,
+    *BINARY_FUNCS,
+))
+
+
+# Net change in operand stack depth of the opcodes whose effect does not
+# depend on their argument. Quickened forms behave like the instruction they
+# replace.
+STACK_EFFECTS = {
+    PUSH_CONST: 1, POP: -1, DUP_TOP: 1,
+    LOAD_GLOBAL: 1, STORE_GLOBAL: -1, LOAD_FAST: 1, STORE_FAST: -1,
+    BINARY_SUBSCR: -1, STORE_SUBSCR: -3, PRINT: -1, INPUT: 1,
+    JUMP: 0, JUMP_IF_FALSE: -1, MAKE_FUNC: 0, RETURN: -1,
+    **{op: -1 for op in BINARY_FUNCS},
+    INC_FAST: 0, INC_GLOBAL: 0, COMPARE_JUMP: -2,
+    COMPARE_FAST_CONST_JUMP: 0, COMPARE_GLOBAL_CONST_JUMP: 0,
+    BINARY_OP_FAST_CONST: 1, LOAD_FAST_FAST: 2,
+    LOAD_INDEX_FAST: 1, LOAD_INDEX_GLOBAL: 1,
+    COMPARE_JUMP_GENERIC: -2, BINARY_OP_FAST_CONST_GENERIC: 1,
+    COMPARE_FAST_CONST_JUMP_GENERIC: 0, COMPARE_GLOBAL_CONST_JUMP_GENERIC: 0,
+    COMPARE_LT_JUMP_INT: -2, COMPARE_LE_JUMP_INT: -2,
+    COMPARE_GT_JUMP_INT: -2, COMPARE_GE_JUMP_INT: -2,
+    COMPARE_FAST_CONST_LT_JUMP_INT: 0, COMPARE_FAST_CONST_LE_JUMP_INT: 0,
+    COMPARE_FAST_CONST_GT_JUMP_INT: 0, COMPARE_FAST_CONST_GE_JUMP_INT: 0,
+    COMPARE_GLOBAL_CONST_LT_JUMP_INT: 0, COMPARE_GLOBAL_CONST_LE_JUMP_INT: 0,
+    COMPARE_GLOBAL_CONST_GT_JUMP_INT: 0, COMPARE_GLOBAL_CONST_GE_JUMP_INT: 0,
+    BINARY_ADD_FAST_CONST_INT: 1, BINARY_SUB_FAST_CONST_INT: 1,
+    BINARY_ADD_FAST_CONST_STR: 1,
+}
+
+
+def stack_effect(op, arg):
+    """Net change in operand stack depth when ``op`` runs with ``arg``."""
+    if op == BUILD_ARRAY:
+        return 1 - arg
+    if op == CALL_FUNC or op == TAIL_CALL:
+        return 1 - arg[1]
+    return STACK_EFFECTS[op]
+
+
+def jump_target(op, arg):
+    pos = JUMP_OPS[op]
+    return arg if pos is None else arg[pos]
+
+
+def with_jump_target(op, arg, target):
+    """Return ``arg`` with its jump target replaced by ``target``."""
+    pos = JUMP_OPS[op]
+    if pos is None:
+        return target
+    return arg[:pos] + (target,) + arg[pos + 1:]
+
+
+OPNAMES = {}
+for _name, _value in list(globals().items()):
+    if _name.isupper() and isinstance(_value, int) and not isinstance(_value, bool):
+        OPNAMES[_value] = _name
+del _name, _value
+
+NUM_OPCODES = max(OPNAMES) + 1
+
+# Bump whenever opcode numbers, the instruction format or the shape of
+# optimized code change; cached bytecode written under another version is
+# ignored.
+BYTECODE_VERSION = 7
+
+
+def disassemble(code):
+    """Return a readable listing of instructions or of an ``assembler.Code``."""
+    if hasattr(code, "instructions"):
+        code = code.instructions()
+    lines = []
+    for pos, (op, arg, *_) in enumerate(code):
+        name = OPNAMES.get(op, f"<{op}>")
+        shown = "" if arg is None and op != PUSH_CONST else repr(arg)
+        lines.append(f"{pos:4} {name:<16} {shown}".rstrip())
+    return "\n".join(lines)
@@ -0,0 +1,305 @@
+# koalacode/optimizer.py
+"""Bytecode optimizer run between ``Compiler.compile`` and ``VM.run``.
+
+Each pass is a function taking a list of ``(opcode, arg, position)``
+instructions and returning a new, equivalent list. An instruction that
+replaces others keeps the position of the one whose error it can
+raise. Passes never change what a program prints or which error it
+raises; anything that could fail at run time is left alone.
+``Optimizer`` runs the passes enabled for its level:
+
+    level 0   no optimization
+    level 1   constant folding, jump threading, dead-code elimination
+    level 2   level 1 plus redundant load/store removal and superinstructions
+
+Passes are registered in ``PASSES`` and can be replaced per ``Optimizer``.
+"""
+from .opcodes import (
+    PUSH_CONST, POP, LOAD_GLOBAL, STORE_GLOBAL, LOAD_FAST, STORE_FAST, DUP_TOP,
+    BINARY_SUBSCR, JUMP, JUMP_IF_FALSE, RETURN, BINARY_ADD, BINARY_MUL,
+    INC_FAST, INC_GLOBAL, COMPARE_JUMP, COMPARE_FAST_CONST_JUMP,
+    COMPARE_GLOBAL_CONST_JUMP, BINARY_OP_FAST_CONST, LOAD_FAST_FAST,
+    LOAD_INDEX_FAST, LOAD_INDEX_GLOBAL,
+    BINARY_FUNCS, COMPARE_OPS, JUMP_OPS, jump_target, with_jump_target,
+)
+
+# Instructions after which control never falls through to the next one.
+TERMINATORS = (JUMP, RETURN)
+
+# Folded strings longer than this stay as run-time operations so that
+# "x" * 1000000 does not bloat the bytecode.
+MAX_FOLDED_STR = 256
+
+
+def jump_targets(code):
+    """Return the set of instruction indices some jump lands on."""
+    return {jump_target(op, arg) for op, arg, _ in code if op in JUMP_OPS}
+
+
+def remove_instructions(code, removed):
+    """Drop the instructions at indices ``removed`` and fix up jump targets.
+
+    A jump to a removed instruction lands on the next instruction that is
+    kept, which is right both for no-ops and for unreachable code.
+    """
+    if not removed:
+        return list(code)
+    new_index = []
+    kept = 0
+    for i in range(len(code)):
+        new_index.append(kept)
+        if i not in removed:
+            kept += 1
+    new_index.append(kept)
+    out = []
+    for i, (op, arg, pos) in enumerate(code):
+        if i in removed:
+            continue
+        if op in JUMP_OPS:
+            arg = with_jump_target(op, arg, new_index[jump_target(op, arg)])
+        out.append((op, arg, pos))
+    return out
+
+
+def _repeated_length(a, b):
+    """Length of ``a * b`` if it repeats a string, else 0."""
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(a, str) and isinstance(b, int):
+        return len(a) * max(b, 0)
+    return 0
+
+
+def fold_constants(code):
+    """Evaluate binary operators on constants and branches on constants.
+
+    ``PUSH_CONST 2; PUSH_CONST 3; BINARY_ADD`` becomes ``PUSH_CONST 5``, and
+    ``PUSH_CONST c; JUMP_IF_FALSE t`` becomes ``JUMP t`` or nothing.
+    Operations that raise (such as division by zero) are kept so the error
+    still happens at run time.
+    """
+    code = list(code)
+    targets = jump_targets(code)
+    removed = set()
+
+    def previous(i):
+        i -= 1
+        while i >= 0 and i in removed:
+            i -= 1
+        return i
+
+    for i, (op, arg, pos) in enumerate(code):
+        if op in BINARY_FUNCS and i not in targets:
+            b = previous(i)
+            a = previous(b)
+            if a < 0 or b in targets or code[a][0] != PUSH_CONST or code[b][0] != PUSH_CONST:
+                continue
+            if op == BINARY_MUL and _repeated_length(code[a][1], code[b][1]) > MAX_FOLDED_STR:
+                continue
+            try:
+                value = BINARY_FUNCS[op](code[a][1], code[b][1])
+            except Exception:
+                continue
+            if isinstance(value, str) and len(value) > MAX_FOLDED_STR:
+                continue
+            code[i] = (PUSH_CONST, value, pos)
+            removed.update((a, b))
+        elif op == JUMP_IF_FALSE and i not in targets:
+            c = previous(i)
+            if c < 0 or code[c][0] != PUSH_CONST:
+                continue
+            if code[c][1]:
+                removed.update((c, i))
+            else:
+                code[i] = (JUMP, arg, pos)
+                removed.add(c)
+    return remove_instructions(code, removed)
+
+
+def thread_jumps(code):
+    """Point jumps straight at the final target of a chain of JUMPs.
+
+    Jumps to the very next instruction are dropped (or, for JUMP_IF_FALSE,
+    reduced to popping the condition). A conditional jump is not threaded
+    into a backward JUMP, so every loop's back edge stays a plain JUMP,
+    which is where a metered VM charges fuel.
+    """
+    code = list(code)
+    removed = set()
+    for i, (op, arg, pos) in enumerate(code):
+        if op not in JUMP_OPS:
+            continue
+        target, seen = jump_target(op, arg), set()
+        while target < len(code) and code[target][0] == JUMP and target not in seen:
+            if op != JUMP and code[target][1] <= target:
+                break
+            seen.add(target)
+            target = code[target][1]
+        if target == i + 1 and op == JUMP:
+            removed.add(i)
+        elif target == i + 1 and op == JUMP_IF_FALSE:
+            code[i] = (POP, None, pos)
+        else:
+            code[i] = (op, with_jump_target(op, arg, target), pos)
+    return remove_instructions(code, removed)
+
+
+def eliminate_dead_code(code):
+    """Remove instructions no control-flow path can reach.
+
+    This drops, among others, the implicit ``PUSH_CONST None; RETURN`` tail
+    of a function whose every path already returns.
+    """
+    reachable = set()
+    todo = [0]
+    while todo:
+        i = todo.pop()
+        while i < len(code) and i not in reachable:
+            reachable.add(i)
+            op, arg, _ = code[i]
+            if op in JUMP_OPS:
+                todo.append(jump_target(op, arg))
+            if op in TERMINATORS:
+                break
+            i += 1
+    return remove_instructions(code, set(range(len(code))) - reachable)
+
+
+def remove_redundant_loads(code):
+    """Drop loads whose value is already on the stack or is thrown away.
+
+    ``STORE x; LOAD x`` becomes ``DUP_TOP; STORE x`` and a constant that is
+    pushed only to be popped is removed. Loads of variables followed by POP
+    are kept because they raise for undefined names.
+    """
+    code = list(code)
+    targets = jump_targets(code)
+    removed = set()
+    for i in range(len(code) - 1):
+        if i in removed or i + 1 in targets:
+            continue
+        (op, arg, pos), (next_op, next_arg, _) = code[i], code[i + 1]
+        if (op, next_op) in ((STORE_FAST, LOAD_FAST), (STORE_GLOBAL, LOAD_GLOBAL)) and arg == next_arg:
+            code[i] = (DUP_TOP, None, pos)
+            code[i + 1] = (op, arg, pos)
+        elif op == PUSH_CONST and next_op == POP:
+            removed.update((i, i + 1))
+    return remove_instructions(code, removed)
+
+
+def _fuse(code, i, targets):
+    """Return ``(superinstruction, length)`` for a pattern starting at ``i``."""
+    window = code[i:i + 4]
+    ops = tuple(op for op, _, _ in window)
+    args = [arg for _, arg, _ in window]
+    positions = [pos for _, _, pos in window]
+    # A jump into the middle of a pattern would skip part of the fused work.
+    interior = range(i + 1, i + len(window))
+
+    def clear(n):
+        return not any(j in targets for j in interior[:n - 1])
+
+    if len(ops) == 4 and clear(4):
+        if (ops[:3] == (LOAD_FAST, PUSH_CONST, BINARY_ADD) and ops[3] == STORE_FAST
+                and args[0] == args[3]):
+            return (INC_FAST, (args[0], args[1]), positions[2]), 4
+        if (ops[:3] == (LOAD_GLOBAL, PUSH_CONST, BINARY_ADD) and ops[3] == STORE_GLOBAL
+                and args[0] == args[3]):
+            return (INC_GLOBAL, (args[0], args[1]), positions[2]), 4
+        if ops[1] == PUSH_CONST and ops[2] in COMPARE_OPS and ops[3] == JUMP_IF_FALSE:
+            if ops[0] == LOAD_FAST:
+                return (COMPARE_FAST_CONST_JUMP, (ops[2], args[0], args[1], args[3]), positions[2]), 4
+            if ops[0] == LOAD_GLOBAL:
+                return (COMPARE_GLOBAL_CONST_JUMP, (ops[2], args[0], args[1], args[3]), positions[2]), 4
+    if len(ops) >= 3 and clear(3):
+        if ops[:3] == (LOAD_FAST, LOAD_FAST, BINARY_SUBSCR):
+            return (LOAD_INDEX_FAST, (args[0], args[1]), positions[2]), 3
+        if ops[:3] == (LOAD_GLOBAL, LOAD_GLOBAL, BINARY_SUBSCR):
+            return (LOAD_INDEX_GLOBAL, (args[0], args[1]), positions[2]), 3
+        if ops[:2] == (LOAD_FAST, PUSH_CONST) and ops[2] in BINARY_FUNCS:
+            return (BINARY_OP_FAST_CONST, (ops[2], args[0], args[1]), positions[2]), 3
+    if len(ops) >= 2 and clear(2):
+        if ops[0] in COMPARE_OPS and ops[1] == JUMP_IF_FALSE:
+            return (COMPARE_JUMP, (ops[0], args[1]), positions[0]), 2
+        if ops[:2] == (LOAD_FAST, LOAD_FAST):
+            return (LOAD_FAST_FAST, (args[0], args[1]), positions[0]), 2
+    return None, 1
+
+
+def fuse_superinstructions(code):
+    """Replace frequent instruction sequences with one superinstruction.
+
+    Longer patterns win: ``LOAD_FAST n; PUSH_CONST 1; COMPARE_LE;
+    JUMP_IF_FALSE t`` becomes a single ``COMPARE_FAST_CONST_JUMP`` rather
+    than a load followed by a ``COMPARE_JUMP``.
+    """
+    targets = jump_targets(code)
+    code = list(code)
+    removed = set()
+    i = 0
+    while i < len(code):
+        fused, length = _fuse(code, i, targets)
+        if fused is not None:
+            code[i] = fused
+            removed.update(range(i + 1, i + length))
+        i += length
+    return remove_instructions(code, removed)
+
+
+# (name, lowest level that enables it, pass function), in running order.
+PASSES = [
+    ("fold_constants", 1, fold_constants),
+    ("thread_jumps", 1, thread_jumps),
+    ("eliminate_dead_code", 1, eliminate_dead_code),
+    ("remove_redundant_loads", 2, remove_redundant_loads),
+    ("fuse_superinstructions", 2, fuse_superinstructions),
+]
+
+DEFAULT_LEVEL = 2
+MAX_LEVEL = 2
+
+# One pass can expose work for an earlier one (dead-code elimination leaves
+# jumps to the next instruction, for instance), so the pipeline is repeated
+# until nothing changes, up to this many times.
+MAX_ROUNDS = 4
+
+
+class Optimizer:
+    """Runs the passes enabled at ``level`` and records instruction counts.
+
+    ``stats`` maps each pass name to the number of instructions it removed,
+    and ``before``/``after`` hold the totals over everything optimized so far.
+    """
+
+    def __init__(self, level=DEFAULT_LEVEL, passes=None):
+        self.level = level
+        if passes is None:
+            passes = [(name, fn) for name, min_level, fn in PASSES if level >= min_level]
+        self.passes = passes
+        self.stats = {name: 0 for name, _ in self.passes}
+        self.before = 0
+        self.after = 0
+
+    def optimize(self, code):
+        self.before += len(code)
+        for _ in range(MAX_ROUNDS):
+            start = code
+            for name, fn in self.passes:
+                new_code = fn(code)
+                self.stats[name] += len(code) - len(new_code)
+                code = new_code
+            if code == start:
+                break
+        self.after += len(code)
+        return code
+
+    def optimize_program(self, bytecode, funcs):
+        """Optimize module bytecode and, in place, every compiled function."""
+        for func in funcs.values():
+            func.code = self.optimize(func.code)
+        return self.optimize(bytecode)
+
+    def report(self):
+        lines = [f"instructions: {self.before} -> {self.after}"]
+        lines += [f"  {name}: -{removed}" for name, removed in self.stats.items()]
+        return "\n".join(lines)
@@ -1,12 +1,67 @@
+import gc
+
+from .nodes import (
+    Array, Assign, AssignIndex, BinOp, Block, Bool, ExprStmt, For, FuncCall,
+    FuncDef, Give, If, Index, Module, Num, Positions, Return, Str, Take, Var,
+    While,
+)
+
+# Binding power of each binary operator; all of them are left-associative.
+# Comparisons and the logical operators share the lowest level.
+COMPARISON, ADDITIVE, MULTIPLICATIVE = 1, 2, 3
+
+BINARY_PRECEDENCE = {
+    '<': COMPARISON, '>': COMPARISON, '<=': COMPARISON, '>=': COMPARISON,
+    '==': COMPARISON, '!=': COMPARISON, '&&': COMPARISON, '||': COMPARISON,
+    '+': ADDITIVE, '-': ADDITIVE,
+    '*': MULTIPLICATIVE, '/': MULTIPLICATIVE,
+}
+
+
 class Parser:
+    """Parser producing the AST of ``koalacode.nodes`` classes.
+
+    ``tokens`` is any iterable of tokens ending with EOF: a list from
+    ``tokenize``, a ``TokenStore``, or the generator from ``iter_tokens``.
+    The parser only ever looks at the current token, so a generator is
+    consumed lazily and the token list is never held in memory.
+
+    Expressions are parsed by precedence climbing over
+    ``BINARY_PRECEDENCE``. Statements are parsed with an explicit stack of
+    unfinished compound statements (see ``statement``), so nesting blocks,
+    loops and conditionals does not recurse in Python.
+
+    The source position of every node goes into ``self.positions`` rather
+    than onto the node; ``parse`` returns a ``Module`` that carries it.
+    """
     def __init__(self, tokens):
-        self.tokens = tokens
-        self.pos = 0
-        self.cur = self.tokens[self.pos]
+        self._next = iter(tokens).__next__
+        self.cur = self._next()
+        self.positions = Positions()
+        self._at = self.positions.add
+        self._heads = {
+            'FUNC': self._func_def_head,
+            'RETURN': self._return,
+            'GIVE': self._give,
+            'TAKE': self._take,
+            'THIS': self._if_head,
+            'ITER': self._while_head,
+            'ITER2': self._for_head,
+            'LBRACE': self._block_head,
+            'ID': self._id_statement,
+        }
+        self._prefixes = {
+            'NUMBER': self._number,
+            'STRING': self._string,
+            'TRUE': self._true,
+            'FALSE': self._false,
+            'ID': self._name,
+            'LBRACK': self._array,
+            'LPAREN': self._group,
+        }
 
     def _advance(self):
-        self.pos += 1
-        self.cur = self.tokens[self.pos]
+        self.cur = self._next()
 
     def _eat(self, ttype):
         if self.cur.type == ttype:
@@ -17,10 +72,21 @@ class Parser:
             )
 
     def parse(self):
-        stmts = []
-        while self.cur.type != 'EOF':
-            stmts.append(self.statement())
-        return ('block', stmts, self.cur.line, self.cur.col)
+        # A tree has no reference cycles (the root, which carries the
+        # position table, is not recorded in it), so the cyclic garbage
+        # collector would only rescan the growing tree over and over; pause
+        # it. The pause is process-wide: other threads meanwhile just leave
+        # their cyclic garbage to the next collection.
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            stmts = []
+            while self.cur.type != 'EOF':
+                stmts.append(self.statement())
+            return Module(stmts, self.positions)
+        finally:
+            if enabled:
+                gc.enable()
 
 
     def assignment(self):
@@ -29,168 +95,204 @@ class Parser:
             self._advance()
             if self.cur.type == 'ASSIGN':
                 self._advance()
-                val = self.comparison()
-                return ('assign', name, val, line, col)
+                val = self.expression()
+                return self._at(Assign(name, val), line, col)
         raise RuntimeError(f"Invalid assignment at line {self.cur.line}, col {self.cur.col}")
 
-    def statement(self):
-        if self.cur.type == 'FUNC':
-            line, col = self.cur.line, self.cur.col
-            self._advance()
-            name = self.cur.value; self._eat('ID')
-            self._eat('LPAREN')
-            params = []
-            if self.cur.type != 'RPAREN':
-                params.append(self.cur.value); self._eat('ID')
-                while self.cur.type == 'COMMA':
-                    self._advance(); params.append(self.cur.value); self._eat('ID')
-            self._eat('RPAREN')
-            body = self.statement()
-            return ('func_def', name, params, body, line, col)
-
-        if self.cur.type == 'RETURN':
-            line, col = self.cur.line, self.cur.col
-            self._advance()
-            val = self.comparison()
-            self._eat('SEMI')
-            return ('return', val, line, col)
-
-        if self.cur.type == 'GIVE':
-            line, col = self.cur.line, self.cur.col
-            self._advance(); self._eat('LPAREN')
-            expr = self.comparison()
-            self._eat('RPAREN'); self._eat('SEMI')
-            return ('give', expr, line, col)
-
-        if self.cur.type == 'TAKE':
-            line, col = self.cur.line, self.cur.col
-            self._advance(); self._eat('LPAREN'); self._eat('RPAREN'); self._eat('SEMI')
-            return ('take', line, col)
-
-        if self.cur.type == 'THIS':
-            line, col = self.cur.line, self.cur.col
-            self._advance(); self._eat('LPAREN')
-            cond = self.comparison()
-            self._eat('RPAREN')
-            then_branch = self.statement()
-            else_branch = None
-            if self.cur.type == 'OTHERWISE':
-                self._advance(); else_branch = self.statement()
-            return ('if', cond, then_branch, else_branch, line, col)
-
-        if self.cur.type == 'ITER':
-            line, col = self.cur.line, self.cur.col
-            self._advance(); self._eat('LPAREN')
-            cond = self.comparison()
-            self._eat('RPAREN')
-            body = self.statement()
-            return ('while', cond, body, line, col)
-
-        if self.cur.type == 'ITER2':
-            line, col = self.cur.line, self.cur.col
-            self._advance(); self._eat('LPAREN')
-            init = self.assignment(); self._eat('SEMI')
-            cond = self.comparison(); self._eat('SEMI')
-            step = self.assignment(); self._eat('RPAREN')
-            body = self.statement()
-            return ('for', init, cond, step, body, line, col)
-
-        if self.cur.type == 'LBRACE':
-            line, col = self.cur.line, self.cur.col
-            self._advance()
-            stmts = []
-            while self.cur.type != 'RBRACE':
-                stmts.append(self.statement())
-            self._eat('RBRACE')
-            return ('block', stmts, line, col)
+    # Statements.
+    #
+    # A head parser either returns a finished statement or, for a compound
+    # statement, parses up to where its first nested statement starts,
+    # pushes an unfinished frame onto ``pending`` and returns None.
 
-        if self.cur.type == 'ID':
-            name, line, col = self.cur.value, self.cur.line, self.cur.col
-            self._advance()
-            if self.cur.type == 'ASSIGN':
-                self._advance(); val = self.comparison(); self._eat('SEMI')
-                return ('assign', name, val, line, col)
-            elif self.cur.type == 'LBRACK':  # arr[idx] = val
-                self._advance(); idx = self.comparison(); self._eat('RBRACK')
-                self._eat('ASSIGN'); val = self.comparison(); self._eat('SEMI')
-                return ('assign_index', name, idx, val, line, col)
-            elif self.cur.type == 'LPAREN':  # func call
-                self._advance(); args = []
-                if self.cur.type != 'RPAREN':
-                    args.append(self.comparison())
-                    while self.cur.type == 'COMMA':
-                        self._advance(); args.append(self.comparison())
-                self._eat('RPAREN'); self._eat('SEMI')
-                return ('func_call', name, args, line, col)
+    def statement(self):
+        pending = []
+        while True:
+            head = self._heads.get(self.cur.type, self._expr_statement)
+            node = head(pending)
+            if node is None:
+                continue
+            # Hand the finished statement to the innermost unfinished one.
+            while pending:
+                frame = pending[-1]
+                kind = frame[0]
+                if kind == 'block':
+                    block = frame[1]
+                    block.stmts.append(node)
+                    if self.cur.type != 'RBRACE':
+                        break
+                    self._advance()
+                    pending.pop()
+                    node = block
+                elif kind == 'if':
+                    _, cond, line, col = pending.pop()
+                    if self.cur.type == 'OTHERWISE':
+                        self._advance()
+                        pending.append(('else', cond, node, line, col))
+                        break
+                    node = self._at(If(cond, node, None), line, col)
+                elif kind == 'else':
+                    _, cond, then_branch, line, col = pending.pop()
+                    node = self._at(If(cond, then_branch, node), line, col)
+                elif kind == 'while':
+                    _, cond, line, col = pending.pop()
+                    node = self._at(While(cond, node), line, col)
+                elif kind == 'for':
+                    _, init, cond, step, line, col = pending.pop()
+                    node = self._at(For(init, cond, step, node), line, col)
+                else:
+                    _, name, params, line, col = pending.pop()
+                    node = self._at(FuncDef(name, params, node), line, col)
             else:
-                self._eat('SEMI')
-                return ('expr', ('var', name, line, col), line, col)
+                return node
+
+    def _func_def_head(self, pending):
+        line, col = self.cur.line, self.cur.col
+        self._advance()
+        name = self.cur.value; self._eat('ID')
+        self._eat('LPAREN')
+        params = []
+        if self.cur.type != 'RPAREN':
+            params.append(self.cur.value); self._eat('ID')
+            while self.cur.type == 'COMMA':
+                self._advance(); params.append(self.cur.value); self._eat('ID')
+        self._eat('RPAREN')
+        pending.append(('func_def', name, params, line, col))
 
+    def _return(self, pending):
         line, col = self.cur.line, self.cur.col
-        expr = self.comparison()
+        self._advance()
+        val = self.expression()
         self._eat('SEMI')
-        return ('expr', expr, line, col)
+        return self._at(Return(val), line, col)
 
+    def _give(self, pending):
+        line, col = self.cur.line, self.cur.col
+        self._advance(); self._eat('LPAREN')
+        expr = self.expression()
+        self._eat('RPAREN'); self._eat('SEMI')
+        return self._at(Give(expr), line, col)
 
-    def comparison(self):
-        node = self.expr()
-        while self.cur.type == 'OP' and self.cur.value in ('<', '>', '<=', '>=', '==', '!=', '&&', '||'):
-            op, line, col = self.cur.value, self.cur.line, self.cur.col
-            self._advance()
-            node = ('binop', op, node, self.expr(), line, col)
-        return node
+    def _take(self, pending):
+        line, col = self.cur.line, self.cur.col
+        self._advance(); self._eat('LPAREN'); self._eat('RPAREN'); self._eat('SEMI')
+        return self._at(Take(), line, col)
 
-    def expr(self):
-        node = self.term()
-        while self.cur.type == 'OP' and self.cur.value in ('+', '-'):
-            op, line, col = self.cur.value, self.cur.line, self.cur.col
-            self._advance()
-            node = ('binop', op, node, self.term(), line, col)
-        return node
+    def _if_head(self, pending):
+        line, col = self.cur.line, self.cur.col
+        self._advance(); self._eat('LPAREN')
+        cond = self.expression()
+        self._eat('RPAREN')
+        pending.append(('if', cond, line, col))
+
+    def _while_head(self, pending):
+        line, col = self.cur.line, self.cur.col
+        self._advance(); self._eat('LPAREN')
+        cond = self.expression()
+        self._eat('RPAREN')
+        pending.append(('while', cond, line, col))
+
+    def _for_head(self, pending):
+        line, col = self.cur.line, self.cur.col
+        self._advance(); self._eat('LPAREN')
+        init = self.assignment(); self._eat('SEMI')
+        cond = self.expression(); self._eat('SEMI')
+        step = self.assignment(); self._eat('RPAREN')
+        pending.append(('for', init, cond, step, line, col))
 
-    def term(self):
-        node = self.factor()
-        while self.cur.type == 'OP' and self.cur.value in ('*', '/'):
-            op, line, col = self.cur.value, self.cur.line, self.cur.col
+    def _block_head(self, pending):
+        line, col = self.cur.line, self.cur.col
+        self._advance()
+        if self.cur.type == 'RBRACE':
             self._advance()
-            node = ('binop', op, node, self.factor(), line, col)
-        return node
+            return self._at(Block([]), line, col)
+        pending.append(('block', self._at(Block([]), line, col)))
 
-    def factor(self):
+    def _id_statement(self, pending):
+        name, line, col = self.cur.value, self.cur.line, self.cur.col
+        self._advance()
+        if self.cur.type == 'ASSIGN':
+            self._advance(); val = self.expression(); self._eat('SEMI')
+            return self._at(Assign(name, val), line, col)
+        elif self.cur.type == 'LBRACK':  # arr[idx] = val
+            self._advance(); idx = self.expression(); self._eat('RBRACK')
+            self._eat('ASSIGN'); val = self.expression(); self._eat('SEMI')
+            return self._at(AssignIndex(name, idx, val), line, col)
+        elif self.cur.type == 'LPAREN':  # func call
+            args = self._arguments(); self._eat('SEMI')
+            return self._at(FuncCall(name, args), line, col)
+        else:
+            self._eat('SEMI')
+            return self._at(ExprStmt(self._at(Var(name), line, col)), line, col)
+
+    def _expr_statement(self, pending):
+        line, col = self.cur.line, self.cur.col
+        expr = self.expression()
+        self._eat('SEMI')
+        return self._at(ExprStmt(expr), line, col)
+
+    # Expressions.
+
+    def expression(self, min_prec=COMPARISON):
+        """Parse binary operators binding at least as tightly as ``min_prec``."""
         tok = self.cur
-        if tok.type == 'NUMBER':
-            self._advance(); return ('num', tok.value, tok.line, tok.col)
-        if tok.type == 'STRING':
-            self._advance(); return ('str', tok.value, tok.line, tok.col)
-        if tok.type == 'TRUE':
-            self._advance(); return ('bool', True, tok.line, tok.col)
-        if tok.type == 'FALSE':
-            self._advance(); return ('bool', False, tok.line, tok.col)
-        if tok.type == 'ID':
-            name, line, col = tok.value, tok.line, tok.col
+        prefix = self._prefixes.get(tok.type)
+        if prefix is None:
+            raise RuntimeError(f"[Line {tok.line}, Col {tok.col}] Unexpected token in factor: {tok}")
+        node = prefix(tok)
+        tok = self.cur
+        while tok.type == 'OP':
+            op = tok.value
+            prec = BINARY_PRECEDENCE.get(op)
+            if prec is None or prec < min_prec:
+                break
             self._advance()
-            if self.cur.type == 'LBRACK':
-                self._advance(); idx = self.comparison(); self._eat('RBRACK')
-                return ('index', name, idx, line, col)
-            if self.cur.type == 'LPAREN':
-                self._advance(); args = []
-                if self.cur.type != 'RPAREN':
-                    args.append(self.comparison())
-                    while self.cur.type == 'COMMA':
-                        self._advance(); args.append(self.comparison())
-                self._eat('RPAREN')
-                return ('func_call', name, args, line, col)
-            return ('var', name, line, col)
-        if tok.type == 'LBRACK':
-            line, col = tok.line, tok.col
-            self._advance(); elems = []
-            if self.cur.type != 'RBRACK':
-                elems.append(self.expr())
-                while self.cur.type == 'COMMA':
-                    self._eat('COMMA'); elems.append(self.expr())
-            self._eat('RBRACK')
-            return ('array', elems, line, col)
-        if tok.type == 'LPAREN':
-            self._advance(); node = self.comparison(); self._eat('RPAREN')
-            return node
-        raise RuntimeError(f"[Line {tok.line}, Col {tok.col}] Unexpected token in factor: {tok}")
+            node = self._at(BinOp(op, node, self.expression(prec + 1)), tok.line, tok.col)
+            tok = self.cur
+        return node
+
+    def _arguments(self):
+        """Parse ``( arg, ... )`` starting at the '('."""
+        self._advance(); args = []
+        if self.cur.type != 'RPAREN':
+            args.append(self.expression())
+            while self.cur.type == 'COMMA':
+                self._advance(); args.append(self.expression())
+        self._eat('RPAREN')
+        return args
+
+    def _number(self, tok):
+        self._advance(); return Num(tok.value)
+
+    def _string(self, tok):
+        self._advance(); return Str(tok.value)
+
+    def _true(self, tok):
+        self._advance(); return Bool(True)
+
+    def _false(self, tok):
+        self._advance(); return Bool(False)
+
+    def _name(self, tok):
+        name, line, col = tok.value, tok.line, tok.col
+        self._advance()
+        if self.cur.type == 'LBRACK':
+            self._advance(); idx = self.expression(); self._eat('RBRACK')
+            return self._at(Index(name, idx), line, col)
+        if self.cur.type == 'LPAREN':
+            return self._at(FuncCall(name, self._arguments()), line, col)
+        return self._at(Var(name), line, col)
+
+    def _array(self, tok):
+        line, col = tok.line, tok.col
+        self._advance(); elems = []
+        if self.cur.type != 'RBRACK':
+            elems.append(self.expression(ADDITIVE))
+            while self.cur.type == 'COMMA':
+                self._eat('COMMA'); elems.append(self.expression(ADDITIVE))
+        self._eat('RBRACK')
+        return self._at(Array(elems), line, col)
+
+    def _group(self, tok):
+        self._advance(); node = self.expression(); self._eat('RPAREN')
+        return node
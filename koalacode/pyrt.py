@@ -0,0 +1,82 @@
+# koalacode/pyrt.py
+"""Support code imported by Python generated with ``koalacode.transpiler``."""
+import atexit
+
+from .interpreter import RuntimeError_
+from .streams import BufferedOutput, StdinInput
+
+# Value of a variable that has not been assigned yet.
+UNSET = object()
+
+# Names under which ``transpiler.run`` puts the output sink and input
+# source in a program's namespace.
+OUTPUT = "__koala_output__"
+INPUT = "__koala_input__"
+
+
+class ProgramExit(Exception):
+    """Raised by a top-level 'return' to stop the program."""
+
+    def __init__(self, value):
+        super().__init__(value)
+        self.value = value
+
+
+def streams(namespace):
+    """Return the ``(write, read)`` functions behind give and take().
+
+    They use the sink and source in ``namespace`` (see ``transpiler.run``).
+    A generated script run on its own gets buffered stdout, flushed before
+    every read and when Python exits, and stdin.
+    """
+    output = namespace.get(OUTPUT)
+    if output is None:
+        output = namespace[OUTPUT] = BufferedOutput()
+        atexit.register(output.flush)
+    source = namespace.get(INPUT)
+    if source is None:
+        source = namespace[INPUT] = StdinInput()
+
+    def read():
+        output.flush()
+        return source.read()
+    return output.write, read
+
+
+def check(name, value, prev):
+    """Enforce the assignment type rule; return ``value``."""
+    if prev is not UNSET and type(value) is not type(prev):
+        raise RuntimeError_(
+            f"Type error: {name} was {type(prev).__name__}, got {type(value).__name__}"
+        )
+    return value
+
+
+def lookup(local_vars, global_vars, name, default=None):
+    """Read ``name`` from a function's locals, falling back to globals.
+
+    Used for function variables that may be read before the function
+    assigns them. Without ``default`` an unknown name raises NameError.
+    """
+    if name in local_vars:
+        return local_vars[name]
+    if name in global_vars:
+        return global_vars[name]
+    if default is None:
+        raise NameError(f"name '{name}' is not defined", name=name)
+    return default
+
+
+def fail(message):
+    """Raise a KoalaCode run-time error from an expression."""
+    raise RuntimeError_(message)
+
+
+# KoalaCode evaluates both operands of '&&' and '||'.
+
+def logical_and(a, b):
+    return a and b
+
+
+def logical_or(a, b):
+    return a or b
@@ -0,0 +1,433 @@
+# koalacode/regcompiler.py
+"""Compilation of a tree into three-address code for the ``RegisterVM``.
+
+Where the stack ``Compiler`` pushes every operand, this compiler names
+where values live: ``ADD dst, a, b`` sets register ``dst`` to
+``a + b``. Every instruction is an ``(opcode, a, b, c)`` tuple; unused
+operands are None.
+
+A frame's registers are laid out as
+
+* the function's locals, parameters first (no locals at module level);
+* one register per distinct constant in the code, preloaded when the
+  frame is created, so constants are operands like any other register;
+* temporaries for intermediate values, reused from one statement to the
+  next.
+
+An assignment to a local writes straight into the local's register, so
+``i = i + 1`` is the single instruction ``ADD i, i, k1``. Module-level
+variables are globals, as on the stack VM, and are moved in and out of
+registers with ``LOAD_GLOBAL`` and ``STORE_GLOBAL``.
+
+Locals are read without a check where the compiler can see that they were
+assigned on every path to the read; elsewhere a ``CHECK_BOUND`` comes
+first, so reading an unassigned local fails as it does on the stack VM.
+"""
+from .assembler import encode_linetable, linetable_position
+from .compiler import CompileError, Function, VALUE_STATEMENTS, assigned_names
+from .lexer import iter_tokens
+from .nodes import CONSTANTS, positions_of
+from .parser import Parser
+from .typecheck import check
+from .vm import UNBOUND
+
+MOVE = 0             # dst, src
+LOAD_GLOBAL = 1      # dst, name
+STORE_GLOBAL = 2     # name, src
+CHECK_BOUND = 3      # local: fails if it was never assigned
+BUILD_ARRAY = 4      # dst, first, count: dst = [first .. first + count - 1]
+SUBSCR = 5           # dst, array, index
+STORE_SUBSCR = 6     # array, index, value
+PRINT = 7            # src
+INPUT = 8            # dst
+JUMP = 9             # target
+JUMP_IF_FALSE = 10   # src, target
+CALL = 11            # dst, first argument, (name, argc)
+TAIL_CALL = 12       # first argument, (name, argc)
+LEN = 13             # dst, src
+RETURN = 14          # src
+
+# Binary operators: dst, a, b.
+ADD = 15
+SUB = 16
+MUL = 17
+FLOORDIV = 18
+LT = 19
+GT = 20
+LE = 21
+GE = 22
+EQ = 23
+NE = 24
+AND = 25
+OR = 26
+
+# Compare and branch: a, b, target; jumps when the comparison is false.
+JUMP_UNLESS_LT = 27
+JUMP_UNLESS_GT = 28
+JUMP_UNLESS_LE = 29
+JUMP_UNLESS_GE = 30
+JUMP_UNLESS_EQ = 31
+JUMP_UNLESS_NE = 32
+
+BINARY_OPS = {
+    "+": ADD, "-": SUB, "*": MUL, "/": FLOORDIV,
+    "<": LT, ">": GT, "<=": LE, ">=": GE, "==": EQ, "!=": NE,
+    "&&": AND, "||": OR,
+}
+
+COMPARE_JUMPS = {
+    "<": JUMP_UNLESS_LT, ">": JUMP_UNLESS_GT, "<=": JUMP_UNLESS_LE,
+    ">=": JUMP_UNLESS_GE, "==": JUMP_UNLESS_EQ, "!=": JUMP_UNLESS_NE,
+}
+
+# Opcodes whose operand ``c`` (``b`` for JUMP_IF_FALSE, ``a`` for JUMP) is a
+# jump target.
+_TARGET_OPERAND = {JUMP: 1, JUMP_IF_FALSE: 2, **{op: 3 for op in COMPARE_JUMPS.values()}}
+
+OPNAMES = {value: name for name, value in list(globals().items())
+           if name.isupper() and isinstance(value, int) and not isinstance(value, bool)}
+
+NUM_OPCODES = max(OPNAMES) + 1
+
+
+class RegisterCode:
+    """Three-address code of a module or function.
+
+    ``registers`` is the initial register file: unbound locals, then the
+    constants, then free temporaries. ``nparams`` leading registers are
+    replaced by the arguments of a call.
+    """
+    __slots__ = ("instructions", "registers", "nparams", "linetable")
+
+    def __init__(self, instructions, registers, nparams, linetable):
+        self.instructions = instructions
+        self.registers = registers
+        self.nparams = nparams
+        self.linetable = linetable
+
+    def __len__(self):
+        return len(self.instructions)
+
+    def position(self, index):
+        """Source ``(line, col)`` of the instruction at ``index``, or None."""
+        return linetable_position(self.linetable, index)
+
+
+def _constants(node, found):
+    """Collect the literal values in ``node``, outside nested functions."""
+    if node.kind in CONSTANTS:
+        found.setdefault((type(node.value), node.value), node.value)
+    elif node.kind != "func_def":
+        for child in node.children():
+            _constants(child, found)
+    return found
+
+
+class RegisterCompiler:
+    """Compiles a tree into ``RegisterCode`` for one module or function.
+
+    Functions are compiled by nested compilers into ``funcs``, as
+    ``compiler.Function`` objects whose ``code`` is ``RegisterCode``.
+    Positions follow the same rule as the stack ``Compiler``: each
+    instruction gets the position of the innermost node that has one.
+    """
+    def __init__(self, varnames=None, funcs=None, positions=None):
+        self.funcs = {} if funcs is None else funcs
+        self.positions = positions
+        self.position = None
+        self.code = []
+        self.lines = []
+        self.slots = None
+        self.bound = set()
+        if varnames is not None:
+            self.slots = {name: i for i, name in enumerate(varnames)}
+        self.nlocals = len(varnames or ())
+        self.consts = {}
+        self.const_values = []
+        self.top = self.ntemps = 0
+
+    def compile_program(self, tree):
+        """Compile module code; return its ``RegisterCode``."""
+        return self._compile_body(tree, tree, [])
+
+    def _compile_body(self, node, body, params):
+        if self.positions is None:
+            self.positions = positions_of(node)
+        for value in _constants(body, {(type(None), None): None}).values():
+            self.consts[(type(value), value)] = self.nlocals + len(self.const_values)
+            self.const_values.append(value)
+        self.bound = set(range(len(params)))
+        self.statement(body)
+        if self.slots is not None:
+            self.emit(RETURN, self.const_reg(None))
+        registers = [UNBOUND] * self.nlocals + self.const_values + [None] * self.ntemps
+        return RegisterCode(self.code, registers, len(params), encode_linetable(self.lines))
+
+    # Emission.
+
+    def emit(self, op, a=None, b=None, c=None):
+        self.code.append((op, a, b, c))
+        self.lines.append(self.position)
+
+    def patch(self, index):
+        """Point the jump at ``index`` to the next instruction emitted."""
+        ins = list(self.code[index])
+        ins[_TARGET_OPERAND[ins[0]]] = len(self.code)
+        self.code[index] = tuple(ins)
+
+    def at(self, node):
+        """Take the position of ``node``, if known; return the previous one."""
+        outer = self.position
+        self.position = self.positions.get(node) or outer
+        return outer
+
+    def const_reg(self, value):
+        return self.consts[(type(value), value)]
+
+    def temp(self):
+        reg = self.nlocals + len(self.const_values) + self.top
+        self.top += 1
+        self.ntemps = max(self.ntemps, self.top)
+        return reg
+
+    def local(self, name):
+        if self.slots is not None:
+            return self.slots.get(name)
+        return None
+
+    # Statements. Temporaries are freed after each one.
+
+    def statement(self, node):
+        outer = self.at(node)
+        top = self.top
+        self._statement(node)
+        self.top = top
+        self.position = outer
+
+    def _statement(self, node):
+        kind = node.kind
+
+        if kind == "block":
+            for stmt in node.stmts:
+                self.statement(stmt)
+
+        elif kind == "give":
+            self.emit(PRINT, self.expr(node.expr))
+
+        elif kind == "assign":
+            self.assign(node)
+
+        elif kind == "assign_index":
+            array = self.load(node.name)
+            index = self.expr(node.index)
+            self.emit(STORE_SUBSCR, array, index, self.expr(node.value))
+
+        elif kind == "if":
+            jump = self.branch_unless(node.cond)
+            before = set(self.bound)
+            self.statement(node.then)
+            if node.orelse:
+                then_bound = self.bound
+                self.bound = before
+                end = len(self.code)
+                self.emit(JUMP, None)
+                self.patch(jump)
+                self.statement(node.orelse)
+                self.bound = self.bound & then_bound
+                self.patch(end)
+            else:
+                self.bound = before
+                self.patch(jump)
+
+        elif kind == "while":
+            start = len(self.code)
+            jump = self.branch_unless(node.cond)
+            before = set(self.bound)
+            self.statement(node.body)
+            self.bound = before
+            self.emit(JUMP, start)
+            self.patch(jump)
+
+        elif kind == "for":
+            self.statement(node.init)
+            start = len(self.code)
+            jump = self.branch_unless(node.cond)
+            before = set(self.bound)
+            self.statement(node.body)
+            self.statement(node.step)
+            self.bound = before
+            self.emit(JUMP, start)
+            self.patch(jump)
+
+        elif kind == "func_def":
+            self.func_def(node)
+
+        elif kind == "return":
+            value = node.value
+            if self.slots is not None and value.kind == "func_call" and value.name != "len":
+                first = self.arguments(value.args)
+                outer = self.at(value)
+                self.emit(TAIL_CALL, first, (value.name, len(value.args)))
+                self.position = outer
+            else:
+                self.emit(RETURN, self.expr(value))
+
+        elif kind == "expr" or kind in VALUE_STATEMENTS:
+            self.expr(node.expr if kind == "expr" else node)
+
+        else:
+            raise CompileError(f"Unknown node {kind}")
+
+    def assign(self, node):
+        slot = self.local(node.name)
+        if slot is None:
+            self.emit(STORE_GLOBAL, node.name, self.expr(node.value))
+        else:
+            self.expr(node.value, slot)
+            self.bound.add(slot)
+
+    def func_def(self, node):
+        params = node.params
+        varnames = list(params)
+        varnames += [n for n in assigned_names(node.body) if n not in varnames]
+        inner = RegisterCompiler(varnames, self.funcs, self.positions)
+        code = inner._compile_body(node, node.body, params)
+        self.funcs[node.name] = Function(node.name, params, varnames, code)
+
+    def branch_unless(self, cond):
+        """Emit a jump taken when ``cond`` is false; return its index."""
+        outer = self.at(cond)
+        top = self.top
+        if cond.kind == "binop" and cond.op in COMPARE_JUMPS:
+            left = self.expr(cond.left)
+            right = self.expr(cond.right)
+            self.emit(COMPARE_JUMPS[cond.op], left, right, None)
+        else:
+            self.emit(JUMP_IF_FALSE, self.expr(cond), None)
+        self.top = top
+        self.position = outer
+        return len(self.code) - 1
+
+    # Expressions. ``expr`` returns the register holding the value; with
+    # ``dst`` the value is computed into that register. Without ``dst`` a
+    # value that needs a temporary gets the lowest free one and keeps it;
+    # with ``dst`` every temporary is freed again, so evaluating arguments
+    # into successive temporaries leaves them consecutive.
+
+    def expr(self, node, dst=None):
+        outer = self.at(node)
+        top = self.top
+        reg = self._expr(node, dst)
+        self.position = outer
+        if dst is None:
+            return reg
+        if reg != dst:
+            self.emit(MOVE, dst, reg)
+        self.top = top
+        return dst
+
+    def _expr(self, node, dst):
+        kind = node.kind
+
+        if kind in CONSTANTS:
+            return self.const_reg(node.value)
+
+        if kind == "var":
+            return self.load(node.name, dst)
+
+        if kind == "binop":
+            if node.op not in BINARY_OPS:
+                raise CompileError(f"Unknown binary operator {node.op}")
+            top = self.top
+            left = self.expr(node.left)
+            right = self.expr(node.right)
+            self.top = top
+            target = self.temp() if dst is None else dst
+            self.emit(BINARY_OPS[node.op], target, left, right)
+            return target
+
+        if kind == "array":
+            top = self.top
+            first = self.top_reg()
+            for elem in node.elems:
+                self.expr(elem, self.temp())
+            self.top = top
+            target = self.temp() if dst is None else dst
+            self.emit(BUILD_ARRAY, target, first, len(node.elems))
+            return target
+
+        if kind == "index":
+            top = self.top
+            array = self.load(node.name)
+            index = self.expr(node.index)
+            self.top = top
+            target = self.temp() if dst is None else dst
+            self.emit(SUBSCR, target, array, index)
+            return target
+
+        if kind == "func_call":
+            top = self.top
+            if node.name == "len" and len(node.args) == 1:
+                src = self.expr(node.args[0])
+                self.top = top
+                target = self.temp() if dst is None else dst
+                self.emit(LEN, target, src)
+                return target
+            first = self.arguments(node.args)
+            self.top = top
+            target = self.temp() if dst is None else dst
+            self.emit(CALL, target, first, (node.name, len(node.args)))
+            return target
+
+        if kind == "take":
+            target = self.temp() if dst is None else dst
+            self.emit(INPUT, target)
+            return target
+
+        raise CompileError(f"Unknown node {kind}")
+
+    def top_reg(self):
+        """The register the next ``temp`` call will return."""
+        return self.nlocals + len(self.const_values) + self.top
+
+    def arguments(self, args):
+        """Evaluate ``args`` into consecutive temporaries; return the first."""
+        first = self.top_reg()
+        for arg in args:
+            self.expr(arg, self.temp())
+        return first
+
+    def load(self, name, dst=None):
+        """Register holding variable ``name``; globals are loaded into ``dst``
+        or a new temporary."""
+        slot = self.local(name)
+        if slot is None:
+            reg = self.temp() if dst is None else dst
+            self.emit(LOAD_GLOBAL, reg, name)
+            return reg
+        if slot not in self.bound:
+            self.emit(CHECK_BOUND, slot)
+            # Reaching the next instruction means it is assigned.
+            self.bound.add(slot)
+        return slot
+
+
+def compile_source(code, warn=None):
+    """Tokenize, parse, type-check and compile ``code``; return ``(code, funcs)``.
+
+    Certain type errors are passed to ``warn``, as ``cache.compile_source``
+    does for the stack VM.
+    """
+    tree = Parser(iter_tokens(code)).parse()
+    check(tree, warn=warn)
+    comp = RegisterCompiler()
+    return comp.compile_program(tree), comp.funcs
+
+
+def disassemble(code):
+    """Return a readable listing of ``RegisterCode``."""
+    lines = []
+    for pos, (op, a, b, c) in enumerate(code.instructions):
+        shown = ", ".join(repr(x) for x in (a, b, c) if x is not None)
+        lines.append(f"{pos:4} {OPNAMES.get(op, f'<{op}>'):<16} {shown}".rstrip())
+    return "\n".join(lines)
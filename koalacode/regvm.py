@@ -0,0 +1,297 @@
+# koalacode/regvm.py
+"""Register-based bytecode engine, the alternative to the stack ``VM``.
+
+``RegisterVM`` runs the three-address code of ``koalacode.regcompiler``.
+Each frame owns a list of registers built from its code's ``registers``
+template, so calls copy the arguments into the callee's first registers
+and a ``RETURN`` writes the result straight into the register the caller
+named. Frames are kept on ``call_stack``, as on the stack VM, so recursion
+depth is not limited by the Python stack, and ``TAIL_CALL`` reuses the
+current frame.
+
+The register VM is a plain interpreter: it does not quicken, compile to
+Python or memoize. Errors are reported like the stack VM's, as
+RuntimeError_ with the position of the failing instruction, and output and
+input go through the same ``koalacode.streams`` sink and source.
+"""
+from .regcompiler import (
+    MOVE, LOAD_GLOBAL, STORE_GLOBAL, CHECK_BOUND, BUILD_ARRAY, SUBSCR, STORE_SUBSCR,
+    PRINT, INPUT, JUMP, JUMP_IF_FALSE, CALL, TAIL_CALL, LEN, RETURN,
+    ADD, SUB, MUL, FLOORDIV, LT, GT, LE, GE, EQ, NE, AND, OR,
+    JUMP_UNLESS_LT, JUMP_UNLESS_GT, JUMP_UNLESS_LE, JUMP_UNLESS_GE,
+    JUMP_UNLESS_EQ, JUMP_UNLESS_NE, NUM_OPCODES,
+)
+from .streams import BufferedOutput, StdinInput
+from .vm import UNBOUND, VM_ERRORS, runtime_error
+
+
+class Frame:
+    """Caller state saved on ``RegisterVM.call_stack`` while a function runs.
+
+    ``dst`` is the caller's register that receives the return value.
+    """
+    __slots__ = ("code", "pc", "regs", "func", "dst")
+
+    def __init__(self, code, pc, regs, func, dst):
+        self.code = code
+        self.pc = pc
+        self.regs = regs
+        self.func = func
+        self.dst = dst
+
+
+class RegisterVM:
+    """Register-based bytecode engine."""
+
+    def __init__(self, funcs=None, output=None, input=None):
+        self.globals = {}
+        self.funcs = funcs or {}
+        self.code = None
+        self.instructions = ()
+        self.regs = None
+        self.func = None
+        self.pc = 0
+        self.call_stack = []
+        self.output = BufferedOutput() if output is None else output
+        self.input = StdinInput() if input is None else input
+        self.handlers = self._build_handlers()
+
+    def _build_handlers(self):
+        """Map every opcode to the bound method that executes it."""
+        table = [self.op_bad] * NUM_OPCODES
+        table[MOVE] = self.op_move
+        table[LOAD_GLOBAL] = self.op_load_global
+        table[STORE_GLOBAL] = self.op_store_global
+        table[CHECK_BOUND] = self.op_check_bound
+        table[BUILD_ARRAY] = self.op_build_array
+        table[SUBSCR] = self.op_subscr
+        table[STORE_SUBSCR] = self.op_store_subscr
+        table[PRINT] = self.op_print
+        table[INPUT] = self.op_input
+        table[JUMP] = self.op_jump
+        table[JUMP_IF_FALSE] = self.op_jump_if_false
+        table[CALL] = self.op_call
+        table[TAIL_CALL] = self.op_tail_call
+        table[LEN] = self.op_len
+        table[RETURN] = self.op_return
+        table[ADD] = self.op_add
+        table[SUB] = self.op_sub
+        table[MUL] = self.op_mul
+        table[FLOORDIV] = self.op_floordiv
+        table[LT] = self.op_lt
+        table[GT] = self.op_gt
+        table[LE] = self.op_le
+        table[GE] = self.op_ge
+        table[EQ] = self.op_eq
+        table[NE] = self.op_ne
+        table[AND] = self.op_and
+        table[OR] = self.op_or
+        table[JUMP_UNLESS_LT] = self.op_jump_unless_lt
+        table[JUMP_UNLESS_GT] = self.op_jump_unless_gt
+        table[JUMP_UNLESS_LE] = self.op_jump_unless_le
+        table[JUMP_UNLESS_GE] = self.op_jump_unless_ge
+        table[JUMP_UNLESS_EQ] = self.op_jump_unless_eq
+        table[JUMP_UNLESS_NE] = self.op_jump_unless_ne
+        return table
+
+    def run(self, code):
+        self.code = code
+        self.instructions = code.instructions
+        self.regs = list(code.registers)
+        self.func = None
+        self.pc = 0
+        self.call_stack = []
+        handlers = self.handlers
+        try:
+            while self.pc < len(self.instructions):
+                pc = self.pc
+                self.pc = pc + 1
+                op, a, b, c = self.instructions[pc]
+                handlers[op](a, b, c)
+        except VM_ERRORS as exc:
+            raise runtime_error(exc, self.code.position(self.pc - 1)) from None
+        finally:
+            self.output.flush()
+
+    def op_bad(self, a, b, c):
+        op = self.instructions[self.pc - 1][0]
+        raise RuntimeError(f"Bad instruction {op}")
+
+    def op_move(self, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b]
+
+    def op_load_global(self, a, b, c):
+        self.regs[a] = self.globals[b]
+
+    def op_store_global(self, a, b, c):
+        self.globals[a] = self.regs[b]
+
+    def op_check_bound(self, a, b, c):
+        if self.regs[a] is UNBOUND:
+            raise RuntimeError(f"Undefined variable {self.func.varnames[a]}")
+
+    def op_build_array(self, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b:b + c]
+
+    def op_subscr(self, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b][regs[c]]
+
+    def op_store_subscr(self, a, b, c):
+        regs = self.regs
+        regs[a][regs[b]] = regs[c]
+
+    def op_print(self, a, b, c):
+        self.output.write(self.regs[a])
+
+    def op_input(self, a, b, c):
+        self.output.flush()
+        self.regs[a] = self.input.read()
+
+    def op_jump(self, a, b, c):
+        self.pc = a
+
+    def op_jump_if_false(self, a, b, c):
+        if not self.regs[a]:
+            self.pc = b
+
+    def op_len(self, a, b, c):
+        regs = self.regs
+        regs[a] = len(regs[b])
+
+    # Calls.
+
+    def op_call(self, a, b, c):
+        name, argc = c
+        args = self.regs[b:b + argc]
+        if name == "len":
+            self.regs[a] = len(args[0])
+            return
+        func = self._lookup_func(name, args)
+        self.call_stack.append(Frame(self.code, self.pc, self.regs, self.func, a))
+        self._enter(func, args)
+
+    def op_tail_call(self, a, b, c):
+        name, argc = b
+        args = self.regs[a:a + argc]
+        # The caller's saved state stays on call_stack and the callee
+        # returns straight to it.
+        self._enter(self._lookup_func(name, args), args)
+
+    def _lookup_func(self, name, args):
+        if name not in self.funcs:
+            raise RuntimeError(f"Undefined function {name}")
+
+        func = self.funcs[name]
+
+        if len(func.params) != len(args):
+            raise RuntimeError(f"Function {name} expects {len(func.params)} args, got {len(args)}")
+        return func
+
+    def _enter(self, func, args):
+        code = func.code
+        args.extend(code.registers[code.nparams:])
+        self.regs = args
+        self.func = func
+        self.code = code
+        self.instructions = code.instructions
+        self.pc = 0
+
+    def op_return(self, a, b, c):
+        value = self.regs[a]
+        try:
+            frame = self.call_stack.pop()
+        except IndexError:
+            # A 'return' at module level ends the program, as in the interpreter.
+            self.pc = len(self.instructions)
+            return
+        code = self.code = frame.code
+        self.instructions = code.instructions
+        self.pc = frame.pc
+        self.func = frame.func
+        self.regs = frame.regs
+        self.regs[frame.dst] = value
+
+    # Binary operators: a = b <op> c.
+
+    def op_add(self, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b] + regs[c]
+
+    def op_sub(self, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b] - regs[c]
+
+    def op_mul(self, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b] * regs[c]
+
+    def op_floordiv(self, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b] // regs[c]
+
+    def op_lt(self, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b] < regs[c]
+
+    def op_gt(self, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b] > regs[c]
+
+    def op_le(self, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b] <= regs[c]
+
+    def op_ge(self, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b] >= regs[c]
+
+    def op_eq(self, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b] == regs[c]
+
+    def op_ne(self, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b] != regs[c]
+
+    def op_and(self, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b] and regs[c]
+
+    def op_or(self, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b] or regs[c]
+
+    # Compare and branch: jump to c unless a <op> b.
+
+    def op_jump_unless_lt(self, a, b, c):
+        regs = self.regs
+        if not regs[a] < regs[b]:
+            self.pc = c
+
+    def op_jump_unless_gt(self, a, b, c):
+        regs = self.regs
+        if not regs[a] > regs[b]:
+            self.pc = c
+
+    def op_jump_unless_le(self, a, b, c):
+        regs = self.regs
+        if not regs[a] <= regs[b]:
+            self.pc = c
+
+    def op_jump_unless_ge(self, a, b, c):
+        regs = self.regs
+        if not regs[a] >= regs[b]:
+            self.pc = c
+
+    def op_jump_unless_eq(self, a, b, c):
+        regs = self.regs
+        if not regs[a] == regs[b]:
+            self.pc = c
+
+    def op_jump_unless_ne(self, a, b, c):
+        regs = self.regs
+        if not regs[a] != regs[b]:
+            self.pc = c
@@ -0,0 +1,445 @@
+# koalacode/stackless.py
+"""Tree interpreter that runs KoalaCode calls without Python recursion.
+
+``StacklessInterpreter`` compiles every node that calls a user function
+into a generator function (a *step*) instead of a plain closure. A step
+that needs the value of a sub-step yields the sub-step's generator;
+``drive`` runs it and sends the result back. Suspended steps wait on a
+list in ``drive`` rather than on the Python stack, so recursion depth in
+KoalaCode is limited by memory, not by ``sys.getrecursionlimit()``.
+
+Nodes without calls keep the ordinary closures of ``Interpreter``; their
+Python stack use is bounded by how deeply the source nests.
+
+A 'return f(...)' inside a function is a tail call: the steps of the
+current activation are dropped before the callee's body runs, so tail
+recursion runs in constant memory. Calls of memoized functions are not
+turned into tail calls, because their result has to be cached.
+
+With ``limits``, steps charge the meter at the same points as the
+closures of ``Interpreter``, and loops charge fuel in the same batches.
+"""
+from inspect import isgeneratorfunction
+
+from .interpreter import Interpreter, ReturnValue, BINARY_OPERATORS, contains_return
+from .limits import FUEL_BATCH
+from .memo import MISSING, make_key
+
+
+def contains_call(node):
+    """True if ``node`` calls a user function outside any nested function body."""
+    if node.kind == 'func_call' and node.name != 'len':
+        return True
+    if node.kind == 'func_def':
+        return False
+    for child in node.children():
+        if contains_call(child):
+            return True
+    return False
+
+
+class _Call:
+    """Yielded by a call site to run ``body``, a new function activation."""
+    __slots__ = ('body',)
+
+    def __init__(self, body):
+        self.body = body
+
+
+class _TailCall:
+    """Yielded by 'return f(...)' to replace the current activation."""
+    __slots__ = ('body',)
+
+    def __init__(self, body):
+        self.body = body
+
+
+def drive(gen):
+    """Run the step generator ``gen`` to completion and return its value.
+
+    ``stack`` holds the suspended steps and ``calls`` the stack heights at
+    which function activations start. An exception leaving a step is thrown
+    into the step waiting on it, as a Python call would propagate it.
+    """
+    stack = []
+    calls = []
+    value = error = None
+    while True:
+        try:
+            if error is None:
+                child = gen.send(value)
+            else:
+                exc, error = error, None
+                child = gen.throw(exc)
+        except StopIteration as stop:
+            value = stop.value
+        except Exception as exc:
+            error = exc
+        else:
+            value = None
+            cls = child.__class__
+            if cls is _TailCall:
+                del stack[calls[-1]:]
+                gen = child.body
+                continue
+            stack.append(gen)
+            if cls is _Call:
+                calls.append(len(stack))
+                gen = child.body
+            else:
+                gen = child
+            continue
+
+        # ``gen`` has finished with ``value`` or raised ``error``.
+        if not stack:
+            if error is not None:
+                raise error
+            return value
+        if calls and calls[-1] == len(stack):
+            calls.pop()
+        gen = stack.pop()
+
+
+class StacklessInterpreter(Interpreter):
+    """``Interpreter`` whose function calls do not use the Python stack."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._function_depth = 0
+        self._steps = {
+            'block': self._step_block,
+            'give': self._step_give,
+            'if': self._step_if,
+            'while': self._step_while,
+            'for': self._step_for,
+            'assign': self._step_assign,
+            'assign_index': self._step_assign_index,
+            'binop': self._step_binop,
+            'array': self._step_array,
+            'index': self._step_index,
+            'func_call': self._step_func_call,
+            'return': self._step_return,
+        }
+
+    def execute(self, run):
+        if isgeneratorfunction(run):
+            return drive(run(self.env))
+        return run(self.env)
+
+    def compile(self, node):
+        """Return a step for ``node`` if it makes calls, else a closure."""
+        step = self._steps.get(node.kind)
+        if step is not None and contains_call(node):
+            return step(node)
+        return super().compile(node)
+
+    def compile_body(self, node):
+        self._function_depth += 1
+        try:
+            body = self.compile(node)
+        finally:
+            self._function_depth -= 1
+        if isgeneratorfunction(body):
+            return body
+
+        def run(env):
+            return body(env)
+            yield
+        return run
+
+    def _sub(self, node):
+        """Compile ``node``; return it and whether it is a step."""
+        fn = self.compile(node)
+        return fn, isgeneratorfunction(fn)
+
+    def _step_block(self, node):
+        stmts = [self._sub(stmt) for stmt in node.stmts]
+
+        def run(env):
+            res = None
+            for stmt, step in stmts:
+                res = (yield stmt(env)) if step else stmt(env)
+                if res.__class__ is ReturnValue:
+                    return res
+            return res
+        return run
+
+    def _step_give(self, node):
+        expr = self.compile(node.expr)
+        write = self.output.write
+
+        def run(env):
+            val = yield expr(env)
+            write(val)
+            return val
+        return run
+
+    def _step_if(self, node):
+        else_branch = node.orelse
+        cond, cond_step = self._sub(node.cond)
+        then_branch, then_step = self._sub(node.then)
+        if else_branch:
+            else_branch, else_step = self._sub(else_branch)
+
+        def run(env):
+            if (yield cond(env)) if cond_step else cond(env):
+                return (yield then_branch(env)) if then_step else then_branch(env)
+            if not else_branch:
+                return None
+            return (yield else_branch(env)) if else_step else else_branch(env)
+        return run
+
+    def _step_while(self, node):
+        cond, cond_step = self._sub(node.cond)
+        body, body_step = self._sub(node.body)
+        meter = self._fuel
+        error = self._error
+        # A tail call drops the loop's generator with its count, so loops
+        # that can return charge every step.
+        batch = 1 if contains_return(node.body) else FUEL_BATCH
+
+        def run(env):
+            res = None
+            steps = 0
+            while (yield cond(env)) if cond_step else cond(env):
+                res = (yield body(env)) if body_step else body(env)
+                if res.__class__ is ReturnValue:
+                    break
+                if meter is not None:
+                    steps += 1
+                    if steps == batch:
+                        meter.spend(steps, error, node)
+                        steps = 0
+            if steps:
+                meter.spend(steps, error, node)
+            return res
+        return run
+
+    def _step_for(self, node):
+        init, init_step = self._sub(node.init)
+        cond, cond_step = self._sub(node.cond)
+        step, step_step = self._sub(node.step)
+        body, body_step = self._sub(node.body)
+        meter = self._fuel
+        error = self._error
+        batch = 1 if contains_return(node.body) else FUEL_BATCH
+
+        def run(env):
+            if init_step:
+                yield init(env)
+            else:
+                init(env)
+            res = None
+            steps = 0
+            while (yield cond(env)) if cond_step else cond(env):
+                res = (yield body(env)) if body_step else body(env)
+                if res.__class__ is ReturnValue:
+                    break
+                if step_step:
+                    yield step(env)
+                else:
+                    step(env)
+                if meter is not None:
+                    steps += 1
+                    if steps == batch:
+                        meter.spend(steps, error, node)
+                        steps = 0
+            if steps:
+                meter.spend(steps, error, node)
+            return res
+        return run
+
+    def _step_assign(self, node):
+        name = node.name
+        expr = self.compile(node.value)
+        proven = id(node) in self._proven
+        error = self._error
+        genv = self.env
+
+        def run(env):
+            val = yield expr(env)
+            if not proven:
+                if name in env:
+                    prev = env[name]
+                elif name in genv:
+                    prev = genv[name]
+                else:
+                    prev = val
+                if type(val) is not type(prev):
+                    error(
+                        f"Type error: {name} was {type(prev).__name__}, got {type(val).__name__}",
+                        node
+                    )
+            env[name] = val
+            return val
+        return run
+
+    def _step_assign_index(self, node):
+        name = node.name
+        idx, idx_step = self._sub(node.index)
+        val, val_step = self._sub(node.value)
+        error = self._error
+        genv = self.env
+
+        def run(env):
+            if name in env:
+                arr = env[name]
+            elif name in genv:
+                arr = genv[name]
+            else:
+                error(f"Undefined array {name}", node)
+            try:
+                i = (yield idx(env)) if idx_step else idx(env)
+                arr[i] = (yield val(env)) if val_step else val(env)
+            except Exception:
+                error(f"Index out of bounds in array {name}", node)
+            return arr
+        return run
+
+    def _step_binop(self, node):
+        op = node.op
+        left, left_step = self._sub(node.left)
+        right, right_step = self._sub(node.right)
+        fn = BINARY_OPERATORS.get(op)
+        error = self._error
+        meter = self._memory
+        charge = None
+        if meter is not None and op == '*' and meter.counts_ints:
+            charge = meter.charge_mul
+        elif meter is not None and op in ('+', '*') and id(node) not in self._proven:
+            charge = meter.charge_add if op == '+' else meter.charge_mul
+
+        def run(env):
+            lval = (yield left(env)) if left_step else left(env)
+            rval = (yield right(env)) if right_step else right(env)
+            if fn is None:
+                error(f"Unknown operator {op}", node)
+            if charge is not None:
+                charge(lval, rval, error, node)
+            try:
+                return fn(lval, rval)
+            except Exception:
+                error(f"Invalid operation {op} between {type(lval).__name__} and {type(rval).__name__}", node)
+        return run
+
+    def _step_array(self, node):
+        elems = [self._sub(e) for e in node.elems]
+        meter = self._memory
+        error = self._error
+
+        def run(env):
+            vals = []
+            for elem, step in elems:
+                vals.append((yield elem(env)) if step else elem(env))
+            if meter is not None:
+                meter.charge_array(len(vals), error, node)
+            return vals
+        return run
+
+    def _step_index(self, node):
+        name = node.name
+        idx = self.compile(node.index)
+        error = self._error
+        genv = self.env
+
+        def run(env):
+            if name in env:
+                arr = env[name]
+            elif name in genv:
+                arr = genv[name]
+            else:
+                error(f"Undefined array {name}", node)
+            index_val = yield idx(env)
+            try:
+                return arr[index_val]
+            except Exception:
+                error(f"Index {index_val} out of bounds in array {name}", node)
+        return run
+
+    def _step_func_call(self, node):
+        name = node.name
+        args = [self._sub(a) for a in node.args]
+        error = self._error
+        meter = self._fuel
+        if name == 'len':
+            arg = args[0][0]
+
+            def run(env):
+                val = yield arg(env)
+                if meter is not None:
+                    meter.step(error, node)
+                return len(val)
+            return run
+        funcs = self.funcs
+
+        def run(env):
+            if name not in funcs:
+                error(f"Undefined function {name}", node)
+            params, body, cache = funcs[name]
+            if len(params) != len(args):
+                error(f"Function {name} expects {len(params)} args, got {len(args)}", node)
+            vals = []
+            for arg, step in args:
+                vals.append((yield arg(env)) if step else arg(env))
+            if meter is not None:
+                meter.step(error, node)
+
+            key = None
+            if cache is not None:
+                key = make_key(vals)
+                if key is not None:
+                    res = cache.get(key)
+                    if res is not MISSING:
+                        return res
+            res = yield _Call(body(dict(zip(params, vals))))
+            if res.__class__ is ReturnValue:
+                res = res.value
+            if key is not None:
+                cache.put(key, res)
+            return res
+        return run
+
+    def _step_return(self, node):
+        val = node.value
+        if self._function_depth and val.kind == 'func_call' and val.name != 'len':
+            return self._step_tail_call(val)
+        val = self.compile(val)
+
+        def run(env):
+            return ReturnValue((yield val(env)))
+        return run
+
+    def _step_tail_call(self, node):
+        name = node.name
+        args = [self._sub(a) for a in node.args]
+        error = self._error
+        meter = self._fuel
+        funcs = self.funcs
+
+        def run(env):
+            if name not in funcs:
+                error(f"Undefined function {name}", node)
+            params, body, cache = funcs[name]
+            if len(params) != len(args):
+                error(f"Function {name} expects {len(params)} args, got {len(args)}", node)
+            vals = []
+            for arg, step in args:
+                vals.append((yield arg(env)) if step else arg(env))
+            if meter is not None:
+                meter.step(error, node)
+            if cache is None:
+                yield _TailCall(body(dict(zip(params, vals))))
+
+            # A memoized callee gets an ordinary call so its result is cached.
+            key = make_key(vals)
+            if key is not None:
+                res = cache.get(key)
+                if res is not MISSING:
+                    return ReturnValue(res)
+            res = yield _Call(body(dict(zip(params, vals))))
+            if res.__class__ is ReturnValue:
+                res = res.value
+            if key is not None:
+                cache.put(key, res)
+            return ReturnValue(res)
+        return run
@@ -0,0 +1,106 @@
+# koalacode/streams.py
+"""Where ``give`` writes and ``take()`` reads.
+
+Engines take an output sink and an input source. A sink has
+``write(value)``, called once per ``give`` with the value itself, and
+``flush()``, which the engine calls before every ``take()`` and when a run
+ends, error or not. A source has ``read()``, returning the next line
+without its newline.
+
+Sinks format values as ``print`` does, one per line. ``BufferedOutput``
+and ``CallbackOutput`` hand the text on in batches of ``size`` lines, so
+a loop that gives many values costs one write per batch rather than one
+per value.
+"""
+import sys
+
+# Lines a buffered sink collects before it passes them on.
+OUTPUT_BATCH = 512
+
+
+class BufferedOutput:
+    """Writes to a file, ``size`` lines at a time.
+
+    The file defaults to the ``sys.stdout`` of the moment each batch is
+    written, so ``contextlib.redirect_stdout`` still applies.
+    """
+
+    def __init__(self, file=None, size=OUTPUT_BATCH):
+        self.file = file
+        self.size = size
+        self.lines = []
+
+    def write(self, value):
+        lines = self.lines
+        lines.append(str(value))
+        if len(lines) >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            text = "\n".join(self.lines) + "\n"
+            self.lines.clear()
+            self.emit(text)
+
+    def emit(self, text):
+        file = self.file or sys.stdout
+        file.write(text)
+        file.flush()
+
+
+class CallbackOutput(BufferedOutput):
+    """Streams batches of output to ``callback(text)``."""
+
+    def __init__(self, callback, size=OUTPUT_BATCH):
+        super().__init__(size=size)
+        self.callback = callback
+
+    def emit(self, text):
+        self.callback(text)
+
+
+class ListOutput:
+    """Keeps the output in memory as a list of lines."""
+
+    def __init__(self):
+        self.lines = []
+
+    def write(self, value):
+        self.lines.append(str(value))
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        """The output as text, as ``print`` would have written it."""
+        return "".join(line + "\n" for line in self.lines)
+
+
+class StdinInput:
+    """Reads lines from stdin with ``input()``."""
+
+    def read(self):
+        return input()
+
+
+class ListInput:
+    """Hands out the given lines in order, then raises EOFError as input() does."""
+
+    def __init__(self, lines):
+        self.lines = iter(lines)
+
+    def read(self):
+        line = next(self.lines, None)
+        if line is None:
+            raise EOFError("EOF when reading a line")
+        return line
+
+
+class CallbackInput:
+    """Gets each line from ``callback()``."""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def read(self):
+        return self.callback()
@@ -0,0 +1,580 @@
+# koalacode/transpiler.py
+"""Ahead-of-time translation of KoalaCode to Python source.
+
+``transpile`` turns a parsed program into readable Python that CPython then
+compiles and runs on its own, which avoids both of KoalaCode's interpreting
+engines. The generated code keeps KoalaCode semantics:
+
+* ``/`` is floor division and ``&&``/``||`` evaluate both operands;
+* a variable can never change type (``check``), except where the static
+  type checker proves the assignment safe;
+* functions live in their own namespace (``fn_<name>``), their variables are
+  local and fall back to globals, and they return the value of their last
+  statement when they end without 'return';
+* KoalaCode names that would clash with Python are renamed with a trailing
+  underscore.
+
+``Program.line_map`` records the KoalaCode position of every generated line
+and ``Program.spans`` the columns of the expressions on it that can fail, so
+``run`` reports errors as ``[Line l, Col c]`` of the failing expression (of
+the statement before Python 3.11) with the interpreter's messages.
+
+``give`` and ``take()`` become calls of ``write`` and ``read``, which the
+prelude takes from ``pyrt.streams``: ``run`` supplies the output sink and
+input source (see ``koalacode.streams``).
+"""
+import builtins
+import itertools
+import keyword
+import re
+
+from .compiler import assigned_names
+from .interpreter import BINARY_OPERATORS, RuntimeError_
+from .lexer import iter_tokens
+from .nodes import CONSTANTS, Positions, positions_of
+from .parser import Parser
+from .pyrt import INPUT, OUTPUT, ProgramExit
+from .streams import BufferedOutput, StdinInput
+from .typecheck import check as typecheck
+
+INDENT = "    "
+
+PRELUDE = (
+    "from koalacode.pyrt import UNSET, ProgramExit, check, fail, logical_and, logical_or, "
+    "lookup, streams",
+    "write, read = streams(globals())",
+)
+
+# Names the generated code itself uses.
+_RUNTIME_NAMES = {"UNSET", "ProgramExit", "check", "fail", "logical_and", "logical_or", "lookup",
+                  "streams", "write", "read"}
+
+# Python spelling of KoalaCode operators; the logical ones are special-cased.
+PY_OPERATORS = {
+    '+': '+', '-': '-', '*': '*', '/': '//',
+    '<': '<', '>': '>', '<=': '<=', '>=': '>=', '==': '==', '!=': '!=',
+}
+
+# Holds the value of the statement being executed, for implicit returns.
+_RESULT = "_r"
+
+# Expression source that can fail is wrapped in "\x01<n>\x02...\x03", n
+# indexing ``Transpiler.marked``; ``emit`` strips the marks and records
+# the columns between them.
+_MARK = re.compile("\x01(\\d+)\x02|\x03")
+
+
+class Program:
+    """Python source generated for one KoalaCode program."""
+
+    def __init__(self, source, line_map, names, filename, spans=None):
+        self.source = source
+        # line_map[n] is the KoalaCode (line, col) behind Python line n.
+        self.line_map = line_map
+        # spans[n] lists (start, end, node, position) for the expressions on
+        # Python line n that can fail, start and end in UTF-8 bytes as
+        # CPython counts columns.
+        self.spans = spans if spans is not None else {}
+        # Python identifier -> KoalaCode name, for error messages.
+        self.names = names
+        self.filename = filename
+
+    def compile(self):
+        return compile(self.source, self.filename, "exec")
+
+
+def py_name(name):
+    """Python identifier for the KoalaCode variable ``name``."""
+    if (keyword.iskeyword(name) or hasattr(builtins, name) or name in _RUNTIME_NAMES
+            or name.startswith(("_", "fn_")) or name.endswith("_")):
+        return name + "_"
+    return name
+
+
+def func_name(name):
+    return "fn_" + name
+
+
+class Transpiler:
+    def __init__(self, proven=()):
+        # 'assign' nodes (by id) whose type check cannot fail.
+        self.proven = proven
+        self.lines = list(PRELUDE)
+        # The KoalaCode (line, col) behind each entry of ``lines``.
+        self.line_positions = [None] * len(PRELUDE)
+        self.source_positions = Positions()
+        self.marked = []
+        self.spans = {}
+        self.names = {}
+        self.depth = 0
+        self.arity = {}
+        # Inside a function: its local names, and the subset that is
+        # certainly assigned at the current point.
+        self.local_names = None
+        self.assigned = None
+        # Locals of the functions enclosing a nested one. Python would
+        # close over them, but KoalaCode functions only see globals.
+        self.outer_names = set()
+
+    def transpile(self, tree, filename="<koalacode>"):
+        self.source_positions = positions_of(tree)
+        self._collect_arity(tree)
+        self.stmt(tree, None)
+        source = "\n".join(self.lines) + "\n"
+        line_map = [None] + self.line_positions
+        return Program(source, line_map, self.names, filename, self.spans)
+
+    def _collect_arity(self, node):
+        if node.kind == 'func_def':
+            self.arity.setdefault(node.name, set()).add(len(node.params))
+        for child in node.children():
+            self._collect_arity(child)
+
+    def emit(self, text, node):
+        prefix = INDENT * self.depth
+        parts, spans, open_marks = [prefix], [], []
+        col, last = len(prefix), 0
+        for match in _MARK.finditer(text):
+            chunk = text[last:match.start()]
+            parts.append(chunk)
+            col += len(chunk.encode())
+            last = match.end()
+            if match.group(1) is not None:
+                open_marks.append((int(match.group(1)), col))
+            else:
+                index, start = open_marks.pop()
+                marked = self.marked[index]
+                spans.append((start, col, marked, self.source_positions.get(marked)))
+        parts.append(text[last:])
+        self.lines.append("".join(parts))
+        self.line_positions.append(self.source_positions.get(node))
+        if spans:
+            self.spans[len(self.lines)] = spans
+
+    def mark(self, node, text):
+        """Wrap ``text``, the source of ``node``, so ``emit`` records its columns."""
+        self.marked.append(node)
+        return f"\x01{len(self.marked) - 1}\x02{text}\x03"
+
+    def var(self, name):
+        py = py_name(name)
+        self.names[py] = name
+        return py
+
+    # Statements. ``mode`` says what to do with the statement's value:
+    # None drops it, "store" saves it in _r and "return" returns it.
+
+    def stmt(self, node, mode):
+        getattr(self, "stmt_" + node.kind, self.stmt_expr_node)(node, mode)
+
+    def finish(self, value, node, mode):
+        if mode == "store":
+            self.emit(f"{_RESULT} = {value}", node)
+        elif mode == "return":
+            self.emit(f"return {value}", node)
+
+    def stmt_block(self, node, mode):
+        stmts = node.stmts
+        if not stmts:
+            self.emit("pass", node)
+            self.finish("None", node, mode)
+            return
+        for stmt in stmts[:-1]:
+            self.stmt(stmt, None)
+        self.stmt(stmts[-1], mode)
+
+    def stmt_give(self, node, mode):
+        value = self.expr(node.expr)
+        if mode is None:
+            self.emit(f"write({value})", node)
+            return
+        self.emit(f"{_RESULT} = {value}", node)
+        self.emit(f"write({_RESULT})", node)
+        if mode == "return":
+            self.emit(f"return {_RESULT}", node)
+
+    def stmt_take(self, node, mode):
+        if mode is None:
+            self.emit("read()", node)
+        else:
+            self.finish("read()", node, mode)
+
+    def stmt_if(self, node, mode):
+        then_branch, else_branch = node.then, node.orelse
+        self.emit(f"if {self.expr(node.cond)}:", node)
+        before = self._save_assigned()
+        self.block(then_branch, mode)
+        after_then = self._save_assigned()
+        self._restore_assigned(before)
+        if else_branch or mode == "store":
+            self.emit("else:", node)
+            if else_branch:
+                self.block(else_branch, mode)
+            else:
+                self.depth += 1
+                self.finish("None", node, mode)
+                self.depth -= 1
+        if self.assigned is not None and else_branch:
+            self.assigned &= after_then
+        else:
+            self._restore_assigned(before)
+
+    def stmt_while(self, node, mode):
+        self.loop(node, node.cond, node.body, None, mode)
+
+    def stmt_for(self, node, mode):
+        self.stmt(node.init, None)
+        self.loop(node, node.cond, node.body, node.step, mode)
+
+    def loop(self, node, cond, body, step, mode):
+        if mode is not None:
+            self.emit(f"{_RESULT} = None", node)
+        self.emit(f"while {self.expr(cond)}:", node)
+        before = self._save_assigned()
+        self.depth += 1
+        self.stmt(body, "store" if mode is not None else None)
+        if step is not None:
+            self.stmt(step, None)
+        self.depth -= 1
+        self._restore_assigned(before)
+        if mode == "return":
+            self.emit(f"return {_RESULT}", node)
+
+    def block(self, node, mode):
+        self.depth += 1
+        self.stmt(node, mode)
+        self.depth -= 1
+
+    def stmt_assign(self, node, mode):
+        name = node.name
+        target = self.var(name)
+        value = self.expr(node.value)
+        if id(node) not in self.proven:
+            value = f"check({name!r}, {value}, {self.previous(name)})"
+        self.emit(f"{target} = {value}", node)
+        if self.assigned is not None:
+            self.assigned.add(name)
+        self.finish(target, node, mode)
+
+    def previous(self, name):
+        """Expression for the current value of ``name``, or UNSET."""
+        py = self.var(name)
+        if self.local_names is None:
+            return f"globals().get({py!r}, UNSET)"
+        if name in self.assigned:
+            return py
+        return f"lookup(locals(), globals(), {py!r}, UNSET)"
+
+    def stmt_assign_index(self, node, mode):
+        arr = self.load(node.name)
+        self.emit(self.mark(node, f"{arr}[{self.expr(node.index)}] = {self.expr(node.value)}"),
+                  node)
+        self.finish(arr, node, mode)
+
+    def stmt_func_def(self, node, mode):
+        name, params, body = node.name, node.params, node.body
+        saved = self.local_names, self.assigned, self.outer_names
+        if self.local_names is not None:
+            self.outer_names = self.outer_names | self.local_names
+        self.local_names = set(params) | set(assigned_names(body))
+        self.assigned = set(params)
+        args = ", ".join(self.var(p) for p in params)
+        self.emit(f"def {func_name(name)}({args}):", node)
+        self.depth += 1
+        nested = []
+        self._collect_nested(body, nested)
+        if nested:
+            self.emit("global " + ", ".join(func_name(n) for n in nested), node)
+        self.stmt(body, "return")
+        self.depth -= 1
+        self.local_names, self.assigned, self.outer_names = saved
+        self.finish("None", node, mode)
+
+    def _collect_nested(self, node, out):
+        for child in node.children():
+            if child.kind == 'func_def':
+                if func_name(child.name) not in out:
+                    out.append(child.name)
+            else:
+                self._collect_nested(child, out)
+
+    def stmt_return(self, node, mode):
+        value = self.expr(node.value)
+        if self.local_names is None:
+            self.emit(f"raise ProgramExit({value})", node)
+        else:
+            self.emit(f"return {value}", node)
+
+    def stmt_expr_node(self, node, mode):
+        value = self.expr(node)
+        if mode is None:
+            self.emit(value, node)
+        else:
+            self.finish(value, node, mode)
+
+    def _save_assigned(self):
+        return set(self.assigned) if self.assigned is not None else None
+
+    def _restore_assigned(self, saved):
+        if saved is not None:
+            self.assigned = saved
+
+    # Expressions, returned as Python source text.
+
+    def expr(self, node):
+        return getattr(self, "expr_" + node.kind)(node)
+
+    def expr_expr(self, node):
+        return self.expr(node.expr)
+
+    def expr_num(self, node):
+        return repr(node.value)
+
+    expr_str = expr_bool = expr_num
+
+    def expr_var(self, node):
+        return self.mark(node, self.load(node.name))
+
+    def load(self, name):
+        py = self.var(name)
+        if self.local_names is not None and name in self.local_names \
+                and name not in self.assigned:
+            return f"lookup(locals(), globals(), {py!r})"
+        if self.local_names is not None and name not in self.local_names \
+                and name in self.outer_names:
+            return f"lookup({{}}, globals(), {py!r})"
+        return py
+
+    def operand(self, node):
+        """Source for an operator's operand, parenthesized if it is a binop."""
+        src = self.expr(node)
+        if node.kind == 'binop' and not _MARK.sub("", src).startswith(("logical_", "fail(")):
+            return f"({src})"
+        return src
+
+    def expr_binop(self, node):
+        op, left, right = node.op, node.left, node.right
+        if op in ('&&', '||'):
+            if right.kind in CONSTANTS:
+                word = "and" if op == '&&' else "or"
+                return f"{self.operand(left)} {word} {self.operand(right)}"
+            fn = "logical_and" if op == '&&' else "logical_or"
+            return f"{fn}({self.expr(left)}, {self.expr(right)})"
+        if op not in PY_OPERATORS:
+            return self.mark(node, f"fail({f'Unknown operator {op}'!r})")
+        return self.mark(node, f"{self.operand(left)} {PY_OPERATORS[op]} {self.operand(right)}")
+
+    def expr_array(self, node):
+        return "[" + ", ".join(self.expr(e) for e in node.elems) + "]"
+
+    def expr_index(self, node):
+        return self.mark(node, f"{self.load(node.name)}[{self.expr(node.index)}]")
+
+    def expr_func_call(self, node):
+        name = node.name
+        args = [self.expr(a) for a in node.args]
+        if name == 'len':
+            if not args:
+                return self.mark(node, "fail('Function len expects 1 args, got 0')")
+            return f"len({args[0]})"
+        arities = self.arity.get(name)
+        if arities is not None and len(arities) == 1 and len(args) not in arities:
+            expected = next(iter(arities))
+            return self.mark(
+                node, f"fail({f'Function {name} expects {expected} args, got {len(args)}'!r})")
+        return self.mark(node, f"{func_name(name)}({', '.join(args)})")
+
+
+def transpile(tree, filename="<koalacode>", typecheck_tree=True, warn=None):
+    """Translate a parsed program into a ``Program``.
+
+    The static type checker runs first (passing certain type errors to
+    ``warn``) and its proofs remove run-time type checks from the output.
+    """
+    proven = typecheck(tree, warn=warn) if typecheck_tree else set()
+    return Transpiler(proven).transpile(tree, filename)
+
+
+def transpile_source(code, filename="<koalacode>"):
+    """Tokenize, parse and transpile KoalaCode source text."""
+    return transpile(Parser(iter_tokens(code)).parse(), filename)
+
+
+def to_python(code):
+    """Return the Python source for KoalaCode source text ``code``."""
+    return transpile_source(code).source
+
+
+def translate_error(program, exc):
+    """Turn an exception raised by generated code into a RuntimeError_.
+
+    The position is that of the failing expression in the innermost frame
+    of the generated code, found from the columns CPython records for each
+    instruction, or of its statement (``program.line_map``) when there are
+    none. The message is the interpreter's where the failing expression or
+    the Python exception says enough.
+    """
+    frame = None
+    tb = exc.__traceback__
+    while tb is not None:
+        if tb.tb_frame.f_code.co_filename == program.filename:
+            frame, line, lasti = tb.tb_frame, tb.tb_lineno, tb.tb_lasti
+        tb = tb.tb_next
+
+    position = node = None
+    if frame is not None:
+        position = program.line_map[line]
+        span = _failing_span(program.spans.get(line), frame.f_code, lasti)
+        if span is not None:
+            node, position = span[2], span[3] or position
+
+    message = _error_message(program, exc, node, frame)
+    if position is None:
+        return RuntimeError_(message)
+    return RuntimeError_(f"[Line {position[0]}, Col {position[1]}] {message}")
+
+
+def _failing_span(spans, code, lasti):
+    """The innermost of ``spans`` around the instruction at ``lasti``."""
+    if not spans or not hasattr(code, "co_positions"):
+        return None
+    positions = next(itertools.islice(code.co_positions(), lasti // 2, None), None)
+    if positions is None or None in positions or positions[0] != positions[1]:
+        return None
+    _, _, start, end = positions
+    found = None
+    for span in spans:
+        if span[0] <= start and end <= span[1]:
+            if found is None or span[1] - span[0] < found[1] - found[0]:
+                found = span
+    return found
+
+
+def _error_message(program, exc, node, frame):
+    kind = node.kind if node is not None else None
+    if isinstance(exc, RuntimeError_):
+        return str(exc)
+    if isinstance(exc, NameError) and getattr(exc, "name", None):
+        if kind == 'func_call':
+            return f"Undefined function {node.name}"
+        if kind in ('index', 'assign_index'):
+            return f"Undefined array {node.name}"
+        name = exc.name
+        if name.startswith("fn_"):
+            return f"Undefined function {name[3:]}"
+        return f"Undefined variable {program.names.get(name, name)}"
+    if kind == 'binop' and isinstance(exc, (TypeError, ZeroDivisionError)):
+        types = _operand_types(node, frame, exc)
+        if types is not None:
+            return f"Invalid operation {node.op} between {types[0]} and {types[1]}"
+    if kind == 'index':
+        try:
+            return f"Index {_peek(node.index, frame)} out of bounds in array {node.name}"
+        except _Unknown:
+            return f"Index out of bounds in array {node.name}"
+    if kind == 'assign_index':
+        return f"Index out of bounds in array {node.name}"
+    if kind == 'func_call' and node.name != 'len' and isinstance(exc, TypeError):
+        func = frame.f_globals.get(func_name(node.name))
+        if func is not None:
+            return (f"Function {node.name} expects {func.__code__.co_argcount} args, "
+                    f"got {len(node.args)}")
+    if isinstance(exc, IndexError):
+        return "Index out of bounds"
+    if isinstance(exc, ZeroDivisionError):
+        return "Invalid operation /: division by zero"
+    if isinstance(exc, TypeError):
+        return f"Invalid operation: {exc}"
+    if isinstance(exc, RecursionError):
+        return "Maximum recursion depth exceeded"
+    raise exc
+
+
+# Operand types in CPython's messages for unsupported operations.
+_OPERAND_TYPES = (
+    re.compile(r"'(\w+)' and '(\w+)'$"),
+    re.compile(r'^can only concatenate (\w+) \(not "(\w+)"\)'),
+)
+
+
+def _operand_types(node, frame, exc):
+    """Type names of the operands of the binop ``node`` that failed, if known."""
+    try:
+        return (type(_peek(node.left, frame)).__name__,
+                type(_peek(node.right, frame)).__name__)
+    except _Unknown:
+        pass
+    for pattern in _OPERAND_TYPES:
+        match = pattern.search(str(exc))
+        if match:
+            return match.groups()
+    return None
+
+
+class _Unknown(Exception):
+    """``_peek`` cannot tell the value of an expression."""
+
+
+def _peek(node, frame):
+    """Value of ``node`` in ``frame``, for expressions that call nothing.
+
+    Such an expression has the same value as when it was evaluated before
+    the error, so it can be evaluated again for the message.
+    """
+    kind = node.kind
+    try:
+        if kind in CONSTANTS:
+            return node.value
+        if kind == 'expr':
+            return _peek(node.expr, frame)
+        if kind == 'var':
+            return _peek_name(node.name, frame)
+        if kind == 'index':
+            return _peek_name(node.name, frame)[_peek(node.index, frame)]
+        if kind == 'array':
+            return [_peek(elem, frame) for elem in node.elems]
+        if kind == 'binop' and node.op in BINARY_OPERATORS:
+            return BINARY_OPERATORS[node.op](_peek(node.left, frame), _peek(node.right, frame))
+    except _Unknown:
+        raise
+    except Exception:
+        pass
+    raise _Unknown(kind)
+
+
+def _peek_name(name, frame):
+    py = py_name(name)
+    for scope in (frame.f_locals, frame.f_globals):
+        if py in scope:
+            return scope[py]
+    raise _Unknown(name)
+
+
+def run(program, namespace=None, output=None, input=None):
+    """Execute a ``Program``; return its global namespace.
+
+    ``give`` writes to ``output`` and ``take()`` reads from ``input``, as
+    in the other engines. Without them a namespace keeps the ones it was
+    first run with, by default buffered stdout and stdin; the output is
+    flushed when the run ends.
+
+    Errors in KoalaCode are raised as RuntimeError_ with KoalaCode positions.
+    """
+    if namespace is None:
+        namespace = {"__name__": "__koalacode__"}
+    if output is not None:
+        namespace[OUTPUT] = output
+    if input is not None:
+        namespace[INPUT] = input
+    namespace.setdefault(OUTPUT, BufferedOutput())
+    namespace.setdefault(INPUT, StdinInput())
+    code = program.compile()
+    try:
+        exec(code, namespace)
+    except ProgramExit:
+        pass
+    except Exception as e:
+        raise translate_error(program, e) from None
+    finally:
+        namespace[OUTPUT].flush()
+    return namespace
@@ -0,0 +1,326 @@
+# koalacode/typecheck.py
+"""Static type inference for KoalaCode programs.
+
+A variable may never change type once assigned. ``check`` infers the type of
+every expression from literals, operators and function returns, warns
+about assignments and operators that are certain to fail if they run, and
+tells the interpreter which assignments cannot fail so it can skip their
+run-time type check, and which '+' and '*' never build a string or array so
+it need not charge them against a memory limit.
+
+Types are sets of Python type names (``int``, ``str``, ``bool``, ``list``,
+``NoneType``). A variable's set can also hold ``UNBOUND`` when it may not
+have been assigned yet, and ``ANY`` stands for a type the analysis cannot
+decide, such as a function parameter or an array element.
+"""
+from .nodes import CONSTANTS, positions_of
+from .opcodes import BINARY_OPS, BINARY_FUNCS
+
+ANY = "any"
+UNBOUND = "unbound"
+
+_ANY = frozenset((ANY,))
+_EMPTY = frozenset()
+_UNBOUND = frozenset((UNBOUND,))
+_NUMBERS = frozenset(("int", "bool"))
+
+# A value of each type, used to work out what an operator returns.
+_SAMPLES = {"int": 1, "bool": True, "str": "s", "list": [], "NoneType": None}
+
+# The analysis is repeated until function return types and global types stop
+# changing. Each round can only add types, so this bound is never reached by
+# real programs; it is there to stop a bug from looping forever.
+MAX_ROUNDS = 20
+
+
+def _norm(types):
+    if ANY in types:
+        return _ANY | (types & _UNBOUND)
+    return frozenset(types)
+
+
+def _name(value):
+    return type(value).__name__
+
+
+def _describe(types):
+    return " or ".join(sorted(types))
+
+
+def binop_types(op, left, right):
+    """Return ``(result types, failed)`` for ``left op right``.
+
+    ``failed`` is True when every combination of operand types raises, so
+    the operation is certain to fail whenever it runs.
+    """
+    if not left or not right:
+        return _EMPTY, False
+    if ANY in left or ANY in right:
+        return _ANY, False
+    if op in ('&&', '||'):
+        # 'a and b' returns one of its operands depending on truthiness.
+        return left | right, False
+    if op not in BINARY_OPS:
+        return _EMPTY, False
+    fn = BINARY_FUNCS[BINARY_OPS[op]]
+    result = set()
+    for a in left:
+        for b in right:
+            try:
+                result.add(_name(fn(_SAMPLES[a], _SAMPLES[b])))
+            except TypeError:
+                pass
+    return frozenset(result), not result
+
+
+class _Scope:
+    """Variable types along one control-flow path."""
+
+    def __init__(self, types, default):
+        self.types = types
+        self.default = default
+
+    def get(self, name):
+        return self.types.get(name, self.default)
+
+    def copy(self):
+        return _Scope(dict(self.types), self.default)
+
+    def join(self, other):
+        changed = False
+        for name in set(self.types) | set(other.types):
+            joined = _norm(self.get(name) | other.get(name))
+            if joined != self.get(name):
+                self.types[name] = joined
+                changed = True
+        return changed
+
+
+class TypeChecker:
+    """Infers types for one program.
+
+    ``globals`` holds the values of variables that already exist (a REPL
+    session), and ``known_funcs`` names functions defined by earlier runs,
+    whose return types are unknown. With ``open_world`` more code may run
+    later and create globals of any type, so function bodies cannot assume
+    that a global this program never assigns stays unassigned.
+    """
+
+    def __init__(self, globals=None, known_funcs=(), open_world=False):
+        self.initial = {name: frozenset((_name(v),)) for name, v in (globals or {}).items()}
+        self.known_funcs = set(known_funcs)
+        self.unknown_global = _ANY if open_world else _EMPTY
+        self.returns = {}
+        self.global_types = dict(self.initial)
+        self.errors = {}
+        self.proven = set()
+        # Errors and proofs are only recorded in the last round, and not
+        # while a loop is still being iterated towards its fixpoint, since
+        # types seen before then are incomplete.
+        self.final = False
+        self.quiet = 0
+        self.in_function = False
+        self.func_returns = set()
+
+    def check(self, tree, warn=None):
+        """Analyze ``tree``.
+
+        Returns the set of ``id``s of 'assign' nodes whose type check can
+        never fail and of '+' and '*' nodes that only produce numbers.
+
+        Certain errors do not stop the program: the code may never run (a
+        dead branch, a function nobody calls), and when it does the engine
+        reports the error then. Each one is passed to ``warn`` as a message
+        with its position, in source order.
+        """
+        func_defs = []
+        self._collect_funcs(tree, func_defs)
+        for node in func_defs:
+            self.returns.setdefault(node.name, _EMPTY)
+
+        for _ in range(MAX_ROUNDS):
+            before = (dict(self.returns), dict(self.global_types))
+            self._program(tree, func_defs)
+            if (self.returns, self.global_types) == before:
+                break
+        else:
+            self.returns = dict.fromkeys(self.returns, _ANY)
+
+        self.final = True
+        self._program(tree, func_defs)
+        if warn is not None and self.errors:
+            positions = positions_of(tree)
+            for node, message in sorted(self.errors.values(),
+                                        key=lambda e: positions.get(e[0]) or (0, 0)):
+                warn(positions.where(node) + message)
+        return self.proven
+
+    def _collect_funcs(self, node, out):
+        if node.kind == 'func_def':
+            out.append(node)
+        for child in node.children():
+            self._collect_funcs(child, out)
+
+    def _program(self, tree, func_defs):
+        self.in_function = False
+        self._stmt(tree, _Scope(dict(self.initial), _UNBOUND))
+        for node in func_defs:
+            name = node.name
+            self.in_function = True
+            scope = _Scope({p: _ANY for p in node.params}, _UNBOUND)
+            self.func_returns = set()
+            if self._stmt(node.body, scope):
+                # Falling off the end returns the last statement's value.
+                self.func_returns.add(ANY)
+            self.returns[name] = _norm(self.returns[name] | self.func_returns)
+
+    def _recording(self):
+        return self.final and not self.quiet
+
+    def _error(self, node, message):
+        if self._recording():
+            self.errors.setdefault(id(node), (node, message))
+
+    # Statements. Each returns True if control can reach its end.
+
+    def _stmt(self, node, scope):
+        kind = node.kind
+        if kind == 'block':
+            falls_through = True
+            for stmt in node.stmts:
+                falls_through = self._stmt(stmt, scope) and falls_through
+            return falls_through
+        if kind == 'return':
+            if self.in_function:
+                self.func_returns |= self._expr(node.value, scope)
+            else:
+                self._expr(node.value, scope)
+            return False
+        if kind == 'if':
+            self._expr(node.cond, scope)
+            other = scope.copy()
+            falls_through = self._stmt(node.then, scope)
+            if node.orelse:
+                falls_through = self._stmt(node.orelse, other) or falls_through
+            else:
+                falls_through = True
+            scope.join(other)
+            return falls_through
+        if kind == 'while':
+            self._loop(scope, node.cond, node.body, None)
+            return True
+        if kind == 'for':
+            self._stmt(node.init, scope)
+            self._loop(scope, node.cond, node.body, node.step)
+            return True
+        if kind == 'assign':
+            self._assign(node, scope)
+            return True
+        if kind == 'assign_index':
+            self._var(node.name, scope)
+            self._expr(node.index, scope)
+            self._expr(node.value, scope)
+            return True
+        if kind == 'give':
+            self._expr(node.expr, scope)
+            return True
+        if kind in ('take', 'func_def'):
+            return True
+        self._expr(node, scope)
+        return True
+
+    def _loop(self, scope, cond, body, step):
+        # The body may run zero or more times, so iterate to a fixpoint
+        # and then go over the loop once more to record what was found.
+        self.quiet += 1
+        try:
+            for _ in range(MAX_ROUNDS):
+                if not self._loop_once(scope, cond, body, step):
+                    break
+        finally:
+            self.quiet -= 1
+        self._loop_once(scope, cond, body, step)
+
+    def _loop_once(self, scope, cond, body, step):
+        self._expr(cond, scope)
+        state = scope.copy()
+        self._stmt(body, state)
+        if step is not None:
+            self._stmt(step, state)
+        return scope.join(state)
+
+    def _assign(self, node, scope):
+        name = node.name
+        value = self._expr(node.value, scope)
+        prev = scope.get(name)
+        if self.in_function and UNBOUND in prev:
+            # Not yet local: the interpreter checks against the global.
+            prev = _norm(prev | self.global_types.get(name, self.unknown_global))
+        bound = prev - _UNBOUND
+        if not self._recording():
+            pass
+        elif not bound or (len(value) == 1 and bound <= value and ANY not in value):
+            self.proven.add(id(node))
+        elif value and ANY not in value and ANY not in bound and UNBOUND not in prev \
+                and not bound & value:
+            self._error(node, f"{name} was {_describe(bound)}, got {_describe(value)}")
+
+        # After a successful check the variable has a type both sets allow.
+        if UNBOUND in prev or ANY in bound:
+            scope.types[name] = value
+        elif ANY in value:
+            scope.types[name] = bound
+        else:
+            scope.types[name] = value & bound or value
+        if not self.in_function:
+            self.global_types[name] = _norm(self.global_types.get(name, _EMPTY) | value)
+
+    # Expressions. Each returns the set of types it can evaluate to.
+
+    def _var(self, name, scope):
+        types = scope.get(name)
+        if self.in_function and UNBOUND in types:
+            types = types | self.global_types.get(name, self.unknown_global)
+        return _norm(types - _UNBOUND)
+
+    def _expr(self, node, scope):
+        kind = node.kind
+        if kind in CONSTANTS:
+            return frozenset((_name(node.value),))
+        if kind == 'var':
+            return self._var(node.name, scope)
+        if kind == 'expr':
+            return self._expr(node.expr, scope)
+        if kind == 'binop':
+            op = node.op
+            left, right = self._expr(node.left, scope), self._expr(node.right, scope)
+            result, failed = binop_types(op, left, right)
+            if failed:
+                self._error(node, f"Invalid operation {op} between "
+                                  f"{_describe(left)} and {_describe(right)}")
+            elif op in ('+', '*') and result and result <= _NUMBERS and self._recording():
+                self.proven.add(id(node))
+            return result
+        if kind == 'array':
+            for elem in node.elems:
+                self._expr(elem, scope)
+            return frozenset(("list",))
+        if kind == 'index':
+            self._var(node.name, scope)
+            self._expr(node.index, scope)
+            return _ANY
+        if kind == 'func_call':
+            name = node.name
+            for arg in node.args:
+                self._expr(arg, scope)
+            if name == 'len':
+                return frozenset(("int",))
+            if name in self.known_funcs:
+                return _ANY
+            return self.returns.get(name, _ANY)
+        return _ANY
+
+
+def check(tree, globals=None, known_funcs=(), open_world=False, warn=None):
+    """Type-check ``tree``; see ``TypeChecker.check``."""
+    return TypeChecker(globals, known_funcs, open_world).check(tree, warn)
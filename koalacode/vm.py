@@ -1,109 +1,1262 @@
+import asyncio
+
+from .opcodes import (
+    PUSH_CONST, POP, LOAD_GLOBAL, STORE_GLOBAL, LOAD_FAST, STORE_FAST,
+    BUILD_ARRAY, BINARY_SUBSCR, STORE_SUBSCR, PRINT, INPUT,
+    JUMP, JUMP_IF_FALSE, MAKE_FUNC, CALL_FUNC, RETURN, TAIL_CALL, DUP_TOP,
+    BINARY_ADD, BINARY_SUB, BINARY_MUL, BINARY_FLOORDIV,
+    COMPARE_LT, COMPARE_GT, COMPARE_LE, COMPARE_GE, COMPARE_EQ, COMPARE_NE,
+    BINARY_AND, BINARY_OR, INC_FAST, INC_GLOBAL, COMPARE_JUMP,
+    COMPARE_FAST_CONST_JUMP, COMPARE_GLOBAL_CONST_JUMP, BINARY_OP_FAST_CONST,
+    LOAD_FAST_FAST, LOAD_INDEX_FAST, LOAD_INDEX_GLOBAL,
+    COMPARE_JUMP_GENERIC, COMPARE_FAST_CONST_JUMP_GENERIC,
+    COMPARE_GLOBAL_CONST_JUMP_GENERIC, BINARY_OP_FAST_CONST_GENERIC,
+    COMPARE_LT_JUMP_INT, COMPARE_LE_JUMP_INT, COMPARE_GT_JUMP_INT, COMPARE_GE_JUMP_INT,
+    COMPARE_FAST_CONST_LT_JUMP_INT, COMPARE_FAST_CONST_LE_JUMP_INT,
+    COMPARE_FAST_CONST_GT_JUMP_INT, COMPARE_FAST_CONST_GE_JUMP_INT,
+    COMPARE_GLOBAL_CONST_LT_JUMP_INT, COMPARE_GLOBAL_CONST_LE_JUMP_INT,
+    COMPARE_GLOBAL_CONST_GT_JUMP_INT, COMPARE_GLOBAL_CONST_GE_JUMP_INT,
+    BINARY_ADD_FAST_CONST_INT, BINARY_SUB_FAST_CONST_INT, BINARY_ADD_FAST_CONST_STR,
+    BINARY_FUNCS, OPNAMES, NUM_OPCODES,
+)
+from .interpreter import RuntimeError_
+from .jit import compile_function, error_position
+from .limits import FUEL_BATCH, Meter
+from .memo import LRUCache, MISSING, make_key, pure_functions
+from .streams import BufferedOutput, StdinInput
+
+# Marks a local slot that has not been assigned yet.
+UNBOUND = object()
+
+# Operand stack slots allocated when a run starts. A call whose code needs
+# more room than is left grows the stack (see VM._reserve).
+STACK_SIZE = 256
+
+# Executions of an adaptive instruction before the VM specializes it.
+QUICKEN_AFTER = 4
+
+# Calls of a function plus backward jumps inside it before the VM compiles
+# it to Python.
+JIT_THRESHOLD = 1000
+
+# Compiled functions run on the Python stack. Past this many nested
+# compiled calls the VM goes back to interpreting, which keeps its frames
+# on ``call_stack`` and so has no recursion limit.
+JIT_MAX_DEPTH = 100
+
+# Instructions a task runs before it lets the other tasks run (see VM.task).
+TIME_SLICE = 1000
+
+# What a task yields: its time slice is over, or it waits for a line of
+# input for take().
+SLICE_OVER = "slice over"
+WAIT_INPUT = "wait input"
+
+# Compare opcode -> int-specialized form, per superinstruction family.
+_COMPARE_JUMP_INT = {
+    COMPARE_LT: COMPARE_LT_JUMP_INT,
+    COMPARE_LE: COMPARE_LE_JUMP_INT,
+    COMPARE_GT: COMPARE_GT_JUMP_INT,
+    COMPARE_GE: COMPARE_GE_JUMP_INT,
+}
+_COMPARE_FAST_CONST_JUMP_INT = {
+    COMPARE_LT: COMPARE_FAST_CONST_LT_JUMP_INT,
+    COMPARE_LE: COMPARE_FAST_CONST_LE_JUMP_INT,
+    COMPARE_GT: COMPARE_FAST_CONST_GT_JUMP_INT,
+    COMPARE_GE: COMPARE_FAST_CONST_GE_JUMP_INT,
+}
+_COMPARE_GLOBAL_CONST_JUMP_INT = {
+    COMPARE_LT: COMPARE_GLOBAL_CONST_LT_JUMP_INT,
+    COMPARE_LE: COMPARE_GLOBAL_CONST_LE_JUMP_INT,
+    COMPARE_GT: COMPARE_GLOBAL_CONST_GT_JUMP_INT,
+    COMPARE_GE: COMPARE_GLOBAL_CONST_GE_JUMP_INT,
+}
+_BINARY_FAST_CONST_INT = {
+    BINARY_ADD: BINARY_ADD_FAST_CONST_INT,
+    BINARY_SUB: BINARY_SUB_FAST_CONST_INT,
+}
+
+# Specialized opcode -> generic form it falls back to when its guard fails.
+_SPECIALIZED = {}
+for _table, _generic in (
+        (_COMPARE_JUMP_INT, COMPARE_JUMP_GENERIC),
+        (_COMPARE_FAST_CONST_JUMP_INT, COMPARE_FAST_CONST_JUMP_GENERIC),
+        (_COMPARE_GLOBAL_CONST_JUMP_INT, COMPARE_GLOBAL_CONST_JUMP_GENERIC),
+        (_BINARY_FAST_CONST_INT, BINARY_OP_FAST_CONST_GENERIC)):
+    for _op in _table.values():
+        _SPECIALIZED[_op] = _generic
+_SPECIALIZED[BINARY_ADD_FAST_CONST_STR] = BINARY_OP_FAST_CONST_GENERIC
+del _table, _generic, _op
+
+
+class Frame:
+    """Caller state saved on ``VM.call_stack`` while a function runs.
+
+    ``ops`` and ``args`` are the opcodes and operands of the caller's code.
+    ``memo`` is ``(cache, key)`` when the callee's result is to be cached.
+    """
+    __slots__ = ("ops", "args", "ip", "locals", "func", "memo")
+
+    def __init__(self, ops, args, ip, locals_, func, memo=None):
+        self.ops = ops
+        self.args = args
+        self.ip = ip
+        self.locals = locals_
+        self.func = func
+        self.memo = memo
+
+
+class Compiled:
+    """A function promoted by the JIT, with its call counters."""
+    __slots__ = ("func", "fn", "calls", "fallbacks")
+
+    def __init__(self, func, fn):
+        self.func = func
+        # None when the function's bytecode could not be compiled.
+        self.fn = fn
+        self.calls = 0
+        self.fallbacks = 0
+
+
+# Python exceptions an instruction may raise; run() reports them with
+# runtime_error.
+VM_ERRORS = (RuntimeError, KeyError, IndexError, TypeError, ZeroDivisionError)
+
+
+def runtime_error(exc, position):
+    """The RuntimeError_ reporting ``exc``, raised by an instruction at ``position``."""
+    if isinstance(exc, RecursionError):
+        message = "Maximum recursion depth exceeded"
+    elif isinstance(exc, RuntimeError):
+        message = str(exc)
+    elif isinstance(exc, KeyError):
+        message = f"Undefined variable {exc.args[0]}"
+    elif isinstance(exc, IndexError):
+        message = "Index out of bounds"
+    elif isinstance(exc, ZeroDivisionError):
+        message = "Invalid operation /: division by zero"
+    else:
+        message = f"Invalid operation: {exc}"
+    if position is None:
+        return RuntimeError_(message)
+    return RuntimeError_(f"[Line {position[0]}, Col {position[1]}] {message}")
+
+
+def _undefined(name):
+    raise RuntimeError(f"Undefined variable {name}")
+
+
+class _Suspend(Exception):
+    """Raised by INPUT in a task to pause it until a line is sent in."""
+
+
 class VM:
-    def __init__(self, funcs=None):
+    """Stack-based bytecode engine.
+
+    With ``quicken`` (the default) the compare-and-branch and
+    binary-op-with-constant superinstructions are adaptive: after
+    ``QUICKEN_AFTER`` executions an instruction rewrites itself in the code
+    list into a form specialized for the operator and operand types it saw
+    (int, or str for concatenation). The specialized form checks the
+    operand type with a cheap guard and, on a miss, rewrites itself to the
+    generic form for good. ``stats=True`` also counts executions of
+    specialized instructions so ``specialization_stats`` can report hits.
+
+    With ``jit`` (the default) the VM counts calls and backward jumps per
+    function; once a function reaches ``jit_threshold`` its bytecode is
+    compiled to a Python function (see ``koalacode.jit``) that later calls
+    run instead. A compiled function is only used while it is still the one
+    registered under its name and the nesting of compiled calls is below
+    ``JIT_MAX_DEPTH``; otherwise the call is interpreted. ``jit_stats``
+    reports what was promoted.
+
+    A call in tail position (``TAIL_CALL``) reuses the caller's frame, so
+    tail recursion runs in constant space on ``call_stack``; compiled code
+    turns self tail calls into a loop.
+
+    With ``memoize`` (the default) ``run`` finds the pure functions (see
+    ``koalacode.memo``) and their calls are answered from a per-function
+    LRU cache; ``memo_stats`` reports the hit rates.
+
+    ``run`` takes packed ``assembler.Code``: opcodes are read from its
+    ``ops`` array and arguments from its decoded ``operands``. Calls and
+    returns switch only those two; the ``Code`` itself, with its line
+    table, is found from ``func`` when an error ends the run with a
+    RuntimeError_ carrying the source position of the failing instruction.
+
+    The operand stack is a list allocated once per run and indexed by
+    ``sp``. Each Code records the most slots it needs (``stacksize``), and
+    entering a function only checks that they are free, so pushes and pops
+    never resize the list. Slots above ``sp`` are not cleared.
+
+    With ``limits`` (a ``koalacode.limits.Limits``) each run gets that
+    budget. Metered handlers replace the plain ones for the instructions
+    that can spend a budget that is set: backward ``JUMP``s and calls take
+    a step of the fuel the VM holds in ``fuel``, taken from the meter in
+    batches, and the instructions that can build an array or a string
+    charge its size first. The optimizer keeps every loop's back edge on a
+    plain ``JUMP``.
+    Compiled functions would run outside the meter, so a VM with limits
+    does not JIT.
+
+    ``task`` runs a program as a generator that pauses after every time
+    slice of instructions and when ``take()`` needs a line, and
+    ``run_async`` drives one on the asyncio event loop, so many programs
+    share one thread, each on its own VM, taking turns a slice at a time.
+    Compiled functions could not be paused, so tasks do not JIT.
+
+    ``PRINT`` writes to ``output`` and ``INPUT`` reads from ``input`` (see
+    ``koalacode.streams``); by default output goes to stdout in batches and
+    input comes from stdin. The output is flushed before every read and
+    when a run ends.
+    """
+
+    def __init__(self, funcs=None, quicken=True, stats=False, jit=True,
+                 jit_threshold=JIT_THRESHOLD, memoize=True, limits=None,
+                 output=None, input=None):
         self.stack = []
-        self.vars = {}
+        self.sp = 0
+        self.globals = {}
+        # Slots of the running function (None at module level).
+        self.locals = None
+        self.func = None
         self.ip = 0
-        self.code = []
+        # The program being run; functions' code is found through ``func``.
+        self.code = None
+        self.ops = self.args = ()
         self.funcs = funcs or {}
         self.call_stack = []
+        self.quicken = quicken
+        self._warmup = {}
+        self.specializations = 0
+        self.misses = {}
+        self.executions = {} if stats else None
+        self.memoize = memoize
+        self.memo = {}
+        self.meter = Meter(limits) if limits is not None else None
+        # Steps taken from the meter and not spent yet.
+        self.fuel = 0
+        self.output = BufferedOutput() if output is None else output
+        self.input = StdinInput() if input is None else input
+        self.jit = jit and limits is None
+        self.jit_threshold = jit_threshold
+        self.hotness = {}
+        self.compiled = {}
+        self.jit_depth = 0
+        self._jit_namespace = {
+            "G": self.globals, "call": self._jit_call,
+            "undefined": _undefined, "UNBOUND": UNBOUND,
+            "write": self.output.write, "read": self._read,
+        }
+        self.handlers = self._build_handlers()
+
+    def _build_handlers(self):
+        """Map every opcode to the bound method that executes it."""
+        table = [self.op_bad] * NUM_OPCODES
+        table[PUSH_CONST] = self.op_push_const
+        table[POP] = self.op_pop
+        table[DUP_TOP] = self.op_dup_top
+        table[LOAD_GLOBAL] = self.op_load_global
+        table[STORE_GLOBAL] = self.op_store_global
+        table[LOAD_FAST] = self.op_load_fast
+        table[STORE_FAST] = self.op_store_fast
+        table[BUILD_ARRAY] = self.op_build_array
+        table[BINARY_SUBSCR] = self.op_binary_subscr
+        table[STORE_SUBSCR] = self.op_store_subscr
+        table[PRINT] = self.op_print
+        table[INPUT] = self.op_input
+        table[JUMP] = self.op_jump
+        table[JUMP_IF_FALSE] = self.op_jump_if_false
+        table[MAKE_FUNC] = self.op_make_func
+        table[CALL_FUNC] = self.op_call_func
+        table[RETURN] = self.op_return
+        table[TAIL_CALL] = self.op_tail_call
+        table[BINARY_ADD] = self.op_add
+        table[BINARY_SUB] = self.op_sub
+        table[BINARY_MUL] = self.op_mul
+        table[BINARY_FLOORDIV] = self.op_floordiv
+        table[COMPARE_LT] = self.op_lt
+        table[COMPARE_GT] = self.op_gt
+        table[COMPARE_LE] = self.op_le
+        table[COMPARE_GE] = self.op_ge
+        table[COMPARE_EQ] = self.op_eq
+        table[COMPARE_NE] = self.op_ne
+        table[BINARY_AND] = self.op_and
+        table[BINARY_OR] = self.op_or
+        table[INC_FAST] = self.op_inc_fast
+        table[INC_GLOBAL] = self.op_inc_global
+        table[COMPARE_JUMP] = self.op_compare_jump
+        table[COMPARE_FAST_CONST_JUMP] = self.op_compare_fast_const_jump
+        table[COMPARE_GLOBAL_CONST_JUMP] = self.op_compare_global_const_jump
+        table[BINARY_OP_FAST_CONST] = self.op_binary_op_fast_const
+        table[LOAD_FAST_FAST] = self.op_load_fast_fast
+        table[LOAD_INDEX_FAST] = self.op_load_index_fast
+        table[LOAD_INDEX_GLOBAL] = self.op_load_index_global
+
+        table[COMPARE_JUMP_GENERIC] = self.op_compare_jump_generic
+        table[COMPARE_FAST_CONST_JUMP_GENERIC] = self.op_compare_fast_const_jump_generic
+        table[COMPARE_GLOBAL_CONST_JUMP_GENERIC] = self.op_compare_global_const_jump_generic
+        table[BINARY_OP_FAST_CONST_GENERIC] = self.op_binary_op_fast_const_generic
+        if not self.quicken:
+            table[COMPARE_JUMP] = self.op_compare_jump_generic
+            table[COMPARE_FAST_CONST_JUMP] = self.op_compare_fast_const_jump_generic
+            table[COMPARE_GLOBAL_CONST_JUMP] = self.op_compare_global_const_jump_generic
+            table[BINARY_OP_FAST_CONST] = self.op_binary_op_fast_const_generic
+        table[COMPARE_LT_JUMP_INT] = self.op_compare_lt_jump_int
+        table[COMPARE_LE_JUMP_INT] = self.op_compare_le_jump_int
+        table[COMPARE_GT_JUMP_INT] = self.op_compare_gt_jump_int
+        table[COMPARE_GE_JUMP_INT] = self.op_compare_ge_jump_int
+        table[COMPARE_FAST_CONST_LT_JUMP_INT] = self.op_compare_fast_const_lt_jump_int
+        table[COMPARE_FAST_CONST_LE_JUMP_INT] = self.op_compare_fast_const_le_jump_int
+        table[COMPARE_FAST_CONST_GT_JUMP_INT] = self.op_compare_fast_const_gt_jump_int
+        table[COMPARE_FAST_CONST_GE_JUMP_INT] = self.op_compare_fast_const_ge_jump_int
+        table[COMPARE_GLOBAL_CONST_LT_JUMP_INT] = self.op_compare_global_const_lt_jump_int
+        table[COMPARE_GLOBAL_CONST_LE_JUMP_INT] = self.op_compare_global_const_le_jump_int
+        table[COMPARE_GLOBAL_CONST_GT_JUMP_INT] = self.op_compare_global_const_gt_jump_int
+        table[COMPARE_GLOBAL_CONST_GE_JUMP_INT] = self.op_compare_global_const_ge_jump_int
+        table[BINARY_ADD_FAST_CONST_INT] = self.op_binary_add_fast_const_int
+        table[BINARY_SUB_FAST_CONST_INT] = self.op_binary_sub_fast_const_int
+        table[BINARY_ADD_FAST_CONST_STR] = self.op_binary_add_fast_const_str
+
+        if self.jit:
+            table[CALL_FUNC] = self.op_call_func_jit
+            table[JUMP] = self.op_jump_jit
+        if self.meter is not None and self.meter.counts_fuel:
+            table[JUMP] = self.op_jump_metered
+            table[CALL_FUNC] = self.op_call_func_metered
+            table[TAIL_CALL] = self.op_tail_call_metered
+        if self.meter is not None and self.meter.counts_memory:
+            table[BINARY_ADD] = self.op_add_metered
+            table[BINARY_MUL] = self.op_mul_metered
+            table[INPUT] = self.op_input_metered
+            table[BUILD_ARRAY] = self.op_build_array_metered
+            table[INC_FAST] = self.op_inc_fast_metered
+            table[INC_GLOBAL] = self.op_inc_global_metered
+            for op in (BINARY_OP_FAST_CONST, BINARY_OP_FAST_CONST_GENERIC,
+                       BINARY_ADD_FAST_CONST_STR):
+                table[op] = self._metered(self._charge_op_fast_const, table[op])
+        if self.executions is not None:
+            for op in _SPECIALIZED:
+                table[op] = self._counting(op, table[op])
+        return table
+
+    def _counting(self, op, handler):
+        executions = self.executions
+        executions[op] = 0
+
+        def run(arg):
+            executions[op] += 1
+            handler(arg)
+        return run
+
+    def specialization_stats(self):
+        """Report quickening activity.
+
+        ``misses`` counts guard failures per specialized opcode name; ``hits``
+        is only available when the VM was created with ``stats=True``.
+        """
+        report = {
+            "specializations": self.specializations,
+            "misses": {OPNAMES[op]: n for op, n in self.misses.items()},
+        }
+        if self.executions is not None:
+            report["hits"] = {
+                OPNAMES[op]: n - self.misses.get(op, 0)
+                for op, n in self.executions.items() if n
+            }
+        return report
 
     def run(self, code):
+        self._start(code)
+        handlers = self.handlers
+        try:
+            while self.ip < len(self.ops):
+                ip = self.ip
+                self.ip = ip + 1
+                handlers[self.ops[ip]](self.args[ip])
+        except VM_ERRORS as exc:
+            raise self._runtime_error(exc) from None
+        finally:
+            self._return_fuel()
+            self.output.flush()
+
+    def _start(self, code):
+        """Reset the run state to execute ``code`` from the start."""
         self.code = code
+        self.ops = code.ops
+        self.args = code.operands or code.decode()
         self.ip = 0
-        while self.ip < len(self.code):
-            instr, arg = self.code[self.ip]
-            self.ip += 1
-
-            if instr == "PUSH_CONST":
-                self.stack.append(arg)
-
-            elif instr == "POP":
-                self.stack.pop()
-
-            elif instr == "LOAD_VAR":
-                self.stack.append(self.vars[arg])
-
-            elif instr == "STORE_VAR":
-                self.vars[arg] = self.stack.pop()
-
-            elif instr == "BUILD_ARRAY":
-                n = arg
-                arr = self.stack[-n:]
-                self.stack = self.stack[:-n]
-                self.stack.append(arr)
-
-            elif instr == "LOAD_INDEX":
-                idx = self.stack.pop()
-                arr = self.vars[arg]
-                self.stack.append(arr[idx])
-
-            elif instr == "STORE_INDEX":
-                val = self.stack.pop()
-                idx = self.stack.pop()
-                self.vars[arg][idx] = val
-
-            elif instr == "PRINT":
-                print(self.stack.pop())
-
-            elif instr == "INPUT":
-                self.stack.append(input())
-
-            elif instr == "BINARY_OP":
-                b = self.stack.pop()
-                a = self.stack.pop()
-                op = arg
-                if op == "+": self.stack.append(a + b)
-                elif op == "-": self.stack.append(a - b)
-                elif op == "*": self.stack.append(a * b)
-                elif op == "/": self.stack.append(a // b)
-                elif op == "<": self.stack.append(a < b)
-                elif op == ">": self.stack.append(a > b)
-                elif op == "<=": self.stack.append(a <= b)
-                elif op == ">=": self.stack.append(a >= b)
-                elif op == "==": self.stack.append(a == b)
-                elif op == "!=": self.stack.append(a != b)
-                elif op == "&&": self.stack.append(a and b)
-                elif op == "||": self.stack.append(a or b)
+        self.locals = None
+        self.func = None
+        self.stack = [None] * max(STACK_SIZE, code.stacksize)
+        self.sp = 0
+        self.call_stack = []
+        self.jit_depth = 0
+        if self.memoize:
+            self.memo = {name: LRUCache() for name in pure_functions(self.funcs)}
+        if self.meter is not None:
+            self.meter.reset()
+            self.fuel = 0
+
+    # Cooperative tasks.
+
+    def task(self, code, time_slice=TIME_SLICE):
+        """Run ``code`` as a generator that can be paused and resumed.
+
+        Each resumption executes up to ``time_slice`` instructions and
+        yields SLICE_OVER, or yields WAIT_INPUT when the program executes
+        ``take()``; the line is then passed in with ``send``. The generator
+        returns when the program ends. A VM runs one program at a time.
+        """
+        handlers, jit = self.handlers, self.jit
+        self.handlers = self._task_handlers()
+        self.jit = False
+        try:
+            self._start(code)
+            while True:
+                try:
+                    if self._run_slice(time_slice):
+                        return
+                except _Suspend:
+                    self.output.flush()
+                    line = yield WAIT_INPUT
+                    try:
+                        self._push_input(line)
+                    except VM_ERRORS as exc:
+                        raise self._runtime_error(exc) from None
+                    continue
+                except VM_ERRORS as exc:
+                    raise self._runtime_error(exc) from None
+                yield SLICE_OVER
+        finally:
+            self.handlers, self.jit = handlers, jit
+            self._return_fuel()
+            self.output.flush()
+
+    async def run_async(self, code, read=None, time_slice=TIME_SLICE):
+        """Run ``code`` on the event loop, letting other tasks run between slices.
+
+        ``read`` is an async function returning the next line of input,
+        awaited while the program waits in ``take()``; by default the VM's
+        input source is read in a thread, so the event loop keeps running.
+        """
+        if read is None:
+            read = self._read_async
+        task = self.task(code, time_slice)
+        try:
+            line = None
+            while True:
+                try:
+                    reason = task.send(line)
+                except StopIteration:
+                    return
+                line = None
+                if reason is WAIT_INPUT:
+                    line = await read()
                 else:
-                    raise RuntimeError(f"Unknown binary operator {op}")
+                    await asyncio.sleep(0)
+        finally:
+            task.close()
 
-            elif instr == "JUMP":
-                self.ip = arg
+    async def _read_async(self):
+        return await asyncio.get_running_loop().run_in_executor(None, self.input.read)
 
-            elif instr == "JUMP_IF_FALSE":
-                cond = self.stack.pop()
-                if not cond:
-                    self.ip = arg
+    def _task_handlers(self):
+        table = list(self.handlers)
+        if self.jit:
+            table[CALL_FUNC] = self.op_call_func
+            table[JUMP] = self.op_jump
+        table[INPUT] = self.op_input_suspend
+        return table
 
-            elif instr == "MAKE_FUNC":
-                pass
+    def _run_slice(self, count):
+        """Execute up to ``count`` instructions; True once the program has ended."""
+        handlers = self.handlers
+        for _ in range(count):
+            ip = self.ip
+            if ip >= len(self.ops):
+                return True
+            self.ip = ip + 1
+            handlers[self.ops[ip]](self.args[ip])
+        return self.ip >= len(self.ops)
 
-            elif instr == "CALL_FUNC":
-                name, argc = arg
-                args = [self.stack.pop() for _ in range(argc)][::-1]
+    def op_input_suspend(self, arg):
+        raise _Suspend
 
-                if name == "len":
-                    self.stack.append(len(args[0]))
-                    continue
+    def _push_input(self, value):
+        if self.meter is not None and self.meter.counts_memory:
+            self.meter.charge_string(len(value))
+        self._push(value)
+
+    def _runtime_error(self, exc):
+        """A RuntimeError_ for ``exc``, at the instruction that raised it.
+
+        An exception from compiled code is placed by the generated line it
+        came from, unless an interpreted call made from that code raised it.
+        """
+        found, position = error_position(exc.__traceback__, _INVOKE_CODE)
+        if not found:
+            code = self.code if self.func is None else self.func.code
+            position = code.position(self.ip - 1)
+        return runtime_error(exc, position)
+
+    def op_bad(self, arg):
+        op = self.ops[self.ip - 1]
+        raise RuntimeError(f"Bad instruction {op}")
+
+    def op_push_const(self, arg):
+        sp = self.sp
+        self.stack[sp] = arg
+        self.sp = sp + 1
+    def op_pop(self, arg):
+        self.sp -= 1
+    def op_dup_top(self, arg):
+        sp = self.sp
+        self.stack[sp] = self.stack[sp - 1]
+        self.sp = sp + 1
+    def op_load_global(self, arg):
+        sp = self.sp
+        self.stack[sp] = self.globals[arg]
+        self.sp = sp + 1
+    def op_store_global(self, arg):
+        self.sp = sp = self.sp - 1
+        self.globals[arg] = self.stack[sp]
+    def op_load_fast(self, arg):
+        val = self.locals[arg]
+        if val is UNBOUND:
+            raise RuntimeError(f"Undefined variable {self.func.varnames[arg]}")
+        sp = self.sp
+        self.stack[sp] = val
+        self.sp = sp + 1
+    def op_store_fast(self, arg):
+        self.sp = sp = self.sp - 1
+        self.locals[arg] = self.stack[sp]
+    def op_build_array(self, arg):
+        # The elements are the top ``arg`` slots; only they are copied.
+        stack = self.stack
+        sp = self.sp - arg
+        stack[sp] = stack[sp:sp + arg]
+        self.sp = sp + 1
+    def op_binary_subscr(self, arg):
+        stack = self.stack
+        self.sp = sp = self.sp - 1
+        stack[sp - 1] = stack[sp - 1][stack[sp]]
+    def op_store_subscr(self, arg):
+        stack = self.stack
+        self.sp = sp = self.sp - 3
+        stack[sp][stack[sp + 1]] = stack[sp + 2]
+    def op_print(self, arg):
+        self.sp = sp = self.sp - 1
+        self.output.write(self.stack[sp])
+    def op_input(self, arg):
+        value = self._read()
+        sp = self.sp
+        self.stack[sp] = value
+        self.sp = sp + 1
+
+    def _read(self):
+        """The next line for ``take()``, once the output so far is written."""
+        self.output.flush()
+        return self.input.read()
+
+    def op_jump(self, arg):
+        self.ip = arg
+
+    def op_jump_if_false(self, arg):
+        self.sp = sp = self.sp - 1
+        if not self.stack[sp]:
+            self.ip = arg
+    def op_make_func(self, arg):
+        pass
+
+    def op_call_func(self, arg):
+        # _callee and _lookup_func inlined: this runs for every call.
+        name, argc = arg
+        sp = self.sp - argc
+        args = self.stack[sp:self.sp]
+        self.sp = sp
+        if name == "len":
+            self._push(len(args[0]))
+            return
+        func = self.funcs.get(name)
+        if func is None or len(func.params) != argc:
+            func = self._lookup_func(name, args)
+        cache = self.memo.get(name)
+        if cache is None:
+            self._enter(func, args)
+            return
+        key = make_key(args)
+        if key is None:
+            self._enter(func, args)
+            return
+        value = cache.get(key)
+        if value is MISSING:
+            self._enter(func, args, (cache, key))
+        else:
+            self._push(value)
+
+    def _push(self, value):
+        sp = self.sp
+        self.stack[sp] = value
+        self.sp = sp + 1
+
+    def _callee(self, arg):
+        """Pop a call's arguments and return ``(func, args)``.
+
+        ``len`` is handled here, pushing its result and returning None.
+        """
+        name, argc = arg
+        sp = self.sp - argc
+        args = self.stack[sp:self.sp]
+        self.sp = sp
+
+        if name == "len":
+            self._push(len(args[0]))
+            return None, None
+        return self._lookup_func(name, args), args
+
+    def _lookup_func(self, name, args):
+        if name not in self.funcs:
+            raise RuntimeError(f"Undefined function {name}")
+
+        func = self.funcs[name]
+
+        if len(func.params) != len(args):
+            raise RuntimeError(f"Function {name} expects {len(func.params)} args, got {len(args)}")
+        return func
+
+    def _enter(self, func, args, memo=None):
+        self.call_stack.append(Frame(self.ops, self.args, self.ip, self.locals, self.func, memo))
+
+        if func.nlocals > len(args):
+            args.extend([UNBOUND] * (func.nlocals - len(args)))
+        self.locals = args
+        self.func = func
+        code = func.code
+        if self.sp + code.stacksize > len(self.stack):
+            self._reserve(code.stacksize)
+        self.ops = code.ops
+        self.args = code.operands or code.decode()
+        self.ip = 0
+
+    def _reserve(self, slots):
+        """Grow the operand stack so ``slots`` more fit above ``sp``."""
+        self.stack.extend([None] * max(slots, len(self.stack)))
+
+    def op_return(self, arg):
+        # Statements leave the operand stack balanced, so the return value is
+        # already on top of the caller's operands.
+        try:
+            frame = self.call_stack.pop()
+        except IndexError:
+            # A 'return' at module level ends the program, as in the interpreter.
+            self.ip = len(self.ops)
+            return
+        if frame.memo is not None:
+            cache, key = frame.memo
+            cache.put(key, self.stack[self.sp - 1])
+        self.ops = frame.ops
+        self.args = frame.args
+        self.ip = frame.ip
+        self.locals = frame.locals
+        self.func = frame.func
+
+    def op_tail_call(self, arg):
+        if arg[0] in self.memo:
+            # The callee's result has to be cached when it returns: make an
+            # ordinary call, and the RETURN that follows passes it on.
+            self.handlers[CALL_FUNC](arg)
+            return
+        func, args = self._callee(arg)
+        if func is None:
+            return
+        if self.jit:
+            fn = self._compiled_for(func)
+            if fn is not None:
+                self._push(self._call_compiled(fn, args))
+                return
+        # Reuse the current frame: the caller's saved state stays on
+        # call_stack and the callee returns straight to it.
+        if func.nlocals > len(args):
+            args.extend([UNBOUND] * (func.nlocals - len(args)))
+        self.locals = args
+        self.func = func
+        code = func.code
+        if self.sp + code.stacksize > len(self.stack):
+            self._reserve(code.stacksize)
+        self.ops = code.ops
+        self.args = code.operands or code.decode()
+        self.ip = 0
+
+    # Tiered compilation.
+
+    def op_jump_jit(self, arg):
+        if arg < self.ip and self.func is not None:
+            self._heat(self.func)
+        self.ip = arg
+
+    def op_call_func_jit(self, arg):
+        func, args = self._callee(arg)
+        if func is None:
+            return
+        memo = None
+        cache = self.memo.get(func.name)
+        if cache is not None:
+            key = make_key(args)
+            if key is not None:
+                value = cache.get(key)
+                if value is not MISSING:
+                    self._push(value)
+                    return
+                memo = cache, key
+        fn = self._compiled_for(func)
+        if fn is None:
+            self._enter(func, args, memo)
+            return
+        value = self._call_compiled(fn, args)
+        if memo is not None:
+            cache.put(key, value)
+        self._push(value)
+
+    def _heat(self, func):
+        name = func.name
+        count = self.hotness.get(name, 0) + 1
+        self.hotness[name] = count
+        if count >= self.jit_threshold and name not in self.compiled:
+            self.compiled[name] = Compiled(func, compile_function(func, self._jit_namespace))
+
+    def _compiled_for(self, func):
+        """Return the compiled version of ``func`` to call now, or None."""
+        entry = self.compiled.get(func.name)
+        if entry is None:
+            self._heat(func)
+            entry = self.compiled.get(func.name)
+            if entry is None:
+                return None
+        if entry.func is not func:
+            # Redefined since it was compiled: start counting again.
+            del self.compiled[func.name]
+            self.hotness[func.name] = 0
+            return None
+        if entry.fn is None:
+            return None
+        if self.jit_depth >= JIT_MAX_DEPTH:
+            entry.fallbacks += 1
+            return None
+        entry.calls += 1
+        return entry.fn
+
+    # An exception ends the whole run, and run() resets jit_depth, so the
+    # depth counters below are not restored in finally blocks.
+
+    def _call_compiled(self, fn, args):
+        self.jit_depth += 1
+        result = fn(*args)
+        self.jit_depth -= 1
+        return result
+
+    def _jit_call(self, name, args):
+        """CALL_FUNC as seen from compiled code."""
+        cache = self.memo.get(name)
+        if cache is not None:
+            key = make_key(args)
+            if key is not None:
+                value = cache.get(key)
+                if value is MISSING:
+                    value = self._jit_call_uncached(name, args)
+                    cache.put(key, value)
+                return value
+        return self._jit_call_uncached(name, args)
+
+    def _jit_call_uncached(self, name, args):
+        entry = self.compiled.get(name)
+        if (entry is not None and entry.fn is not None and self.jit_depth < JIT_MAX_DEPTH
+                and self.funcs.get(name) is entry.func and len(args) == len(entry.func.params)):
+            # Fast path: the guards of _compiled_for, inlined.
+            entry.calls += 1
+            self.jit_depth += 1
+            result = entry.fn(*args)
+            self.jit_depth -= 1
+            return result
+        func = self._lookup_func(name, args)
+        fn = self._compiled_for(func)
+        if fn is not None:
+            return self._call_compiled(fn, args)
+        return self._invoke(func, args)
+
+    def _invoke(self, func, args):
+        """Interpret a call to ``func`` to completion and return its value."""
+        base = len(self.call_stack)
+        handlers = self.handlers
+        self.jit_depth += 1
+        self._enter(func, args)
+        while len(self.call_stack) > base:
+            ip = self.ip
+            self.ip = ip + 1
+            handlers[self.ops[ip]](self.args[ip])
+        self.jit_depth -= 1
+        self.sp -= 1
+        return self.stack[self.sp]
+
+    def memo_stats(self):
+        """Hits, misses, hit rate and size of each pure function's cache."""
+        return {name: cache.stats() for name, cache in self.memo.items()}
+
+    def jit_stats(self):
+        """Per function: hotness, whether it was promoted, and call counts."""
+        report = {}
+        for name, hotness in self.hotness.items():
+            entry = self.compiled.get(name)
+            report[name] = {
+                "hotness": hotness,
+                "promoted": entry is not None and entry.fn is not None,
+                "unsupported": entry is not None and entry.fn is None,
+                "compiled_calls": entry.calls if entry else 0,
+                "fallbacks": entry.fallbacks if entry else 0,
+            }
+        return report
+
+    # Metering (see koalacode.limits). Errors raised by the meter are
+    # positioned at the instruction being executed, like any other.
+
+    def _metered(self, charge, handler):
+        def run(arg):
+            charge(arg)
+            handler(arg)
+        return run
+
+    def _refuel(self):
+        """Take the next batch of steps from the meter once ``fuel`` runs out."""
+        self.fuel += self.meter.take(FUEL_BATCH)
+
+    def _return_fuel(self):
+        """Give the steps not spent back to the meter at the end of a run."""
+        if self.fuel > 0:
+            self.meter.fuel += self.fuel
+            self.fuel = 0
+
+    def op_jump_metered(self, arg):
+        if arg < self.ip:
+            self.fuel -= 1
+            if self.fuel < 0:
+                self._refuel()
+        self.ip = arg
+
+    def op_call_func_metered(self, arg):
+        # op_call_func with the step taken first; repeated so a call costs
+        # no extra dispatch.
+        self.fuel -= 1
+        if self.fuel < 0:
+            self._refuel()
+        name, argc = arg
+        sp = self.sp - argc
+        args = self.stack[sp:self.sp]
+        self.sp = sp
+        if name == "len":
+            self._push(len(args[0]))
+            return
+        func = self.funcs.get(name)
+        if func is None or len(func.params) != argc:
+            func = self._lookup_func(name, args)
+        cache = self.memo.get(name)
+        if cache is None:
+            self._enter(func, args)
+            return
+        key = make_key(args)
+        if key is None:
+            self._enter(func, args)
+            return
+        value = cache.get(key)
+        if value is MISSING:
+            self._enter(func, args, (cache, key))
+        else:
+            self._push(value)
+
+    def op_tail_call_metered(self, arg):
+        # A memoized callee turns into a CALL_FUNC, which takes the step.
+        if arg[0] not in self.memo:
+            self.fuel -= 1
+            if self.fuel < 0:
+                self._refuel()
+        self.op_tail_call(arg)
+
+    def op_add_metered(self, arg):
+        stack = self.stack
+        self.sp = sp = self.sp - 1
+        a = stack[sp - 1]
+        if a.__class__ is not int:
+            self.meter.charge_add(a, stack[sp])
+        stack[sp - 1] = a + stack[sp]
+
+    def op_mul_metered(self, arg):
+        stack = self.stack
+        self.sp = sp = self.sp - 1
+        a, b = stack[sp - 1], stack[sp]
+        if a.__class__ is not int or b.__class__ is not int:
+            self.meter.charge_mul(a, b)
+        elif a.bit_length() + b.bit_length() > self.meter.int_bits:
+            self.meter.charge_mul(a, b)
+        stack[sp - 1] = a * b
+
+    def op_build_array_metered(self, arg):
+        meter = self.meter
+        meter.array_elements -= arg
+        if meter.array_elements < 0:
+            meter.check()
+        self.op_build_array(arg)
+
+    def op_input_metered(self, arg):
+        value = self._read()
+        self.meter.charge_string(len(value))
+        sp = self.sp
+        self.stack[sp] = value
+        self.sp = sp + 1
+
+    # INC_* add a constant, which only builds a string if it is one.
+
+    def op_inc_fast_metered(self, arg):
+        slot, const = arg
+        val = self._local(slot)
+        if const.__class__ is str:
+            self.meter.charge_add(val, const)
+        self.locals[slot] = val + const
+
+    def op_inc_global_metered(self, arg):
+        name, const = arg
+        val = self.globals[name]
+        if const.__class__ is str:
+            self.meter.charge_add(val, const)
+        self.globals[name] = val + const
+
+    def _charge_op_fast_const(self, arg):
+        op, slot, const = arg
+        if op == BINARY_ADD:
+            self.meter.charge_add(self.locals[slot], const)
+        elif op == BINARY_MUL:
+            self.meter.charge_mul(self.locals[slot], const)
+
+    # Binary operators replace the left operand with the result in place.
+
+    def op_add(self, arg):
+        stack = self.stack
+        self.sp = sp = self.sp - 1
+        stack[sp - 1] = stack[sp - 1] + stack[sp]
+    def op_sub(self, arg):
+        stack = self.stack
+        self.sp = sp = self.sp - 1
+        stack[sp - 1] = stack[sp - 1] - stack[sp]
+    def op_mul(self, arg):
+        stack = self.stack
+        self.sp = sp = self.sp - 1
+        stack[sp - 1] = stack[sp - 1] * stack[sp]
+    def op_floordiv(self, arg):
+        stack = self.stack
+        self.sp = sp = self.sp - 1
+        stack[sp - 1] = stack[sp - 1] // stack[sp]
+    def op_lt(self, arg):
+        stack = self.stack
+        self.sp = sp = self.sp - 1
+        stack[sp - 1] = stack[sp - 1] < stack[sp]
+    def op_gt(self, arg):
+        stack = self.stack
+        self.sp = sp = self.sp - 1
+        stack[sp - 1] = stack[sp - 1] > stack[sp]
+    def op_le(self, arg):
+        stack = self.stack
+        self.sp = sp = self.sp - 1
+        stack[sp - 1] = stack[sp - 1] <= stack[sp]
+    def op_ge(self, arg):
+        stack = self.stack
+        self.sp = sp = self.sp - 1
+        stack[sp - 1] = stack[sp - 1] >= stack[sp]
+    def op_eq(self, arg):
+        stack = self.stack
+        self.sp = sp = self.sp - 1
+        stack[sp - 1] = stack[sp - 1] == stack[sp]
+    def op_ne(self, arg):
+        stack = self.stack
+        self.sp = sp = self.sp - 1
+        stack[sp - 1] = stack[sp - 1] != stack[sp]
+    def op_and(self, arg):
+        stack = self.stack
+        self.sp = sp = self.sp - 1
+        stack[sp - 1] = stack[sp - 1] and stack[sp]
+    def op_or(self, arg):
+        stack = self.stack
+        self.sp = sp = self.sp - 1
+        stack[sp - 1] = stack[sp - 1] or stack[sp]
+    # Superinstructions: each does the work of the sequence it replaced.
+
+    def _local(self, slot):
+        val = self.locals[slot]
+        if val is UNBOUND:
+            raise RuntimeError(f"Undefined variable {self.func.varnames[slot]}")
+        return val
+
+    def op_inc_fast(self, arg):
+        slot, const = arg
+        self.locals[slot] = self._local(slot) + const
+
+    def op_inc_global(self, arg):
+        name, const = arg
+        self.globals[name] = self.globals[name] + const
+
+    def op_compare_jump_generic(self, arg):
+        op, target = arg
+        stack = self.stack
+        self.sp = sp = self.sp - 2
+        if not BINARY_FUNCS[op](stack[sp], stack[sp + 1]):
+            self.ip = target
+    def op_compare_fast_const_jump_generic(self, arg):
+        op, slot, const, target = arg
+        if not BINARY_FUNCS[op](self._local(slot), const):
+            self.ip = target
+
+    def op_compare_global_const_jump_generic(self, arg):
+        op, name, const, target = arg
+        if not BINARY_FUNCS[op](self.globals[name], const):
+            self.ip = target
+
+    def op_binary_op_fast_const_generic(self, arg):
+        op, slot, const = arg
+        sp = self.sp
+        self.stack[sp] = BINARY_FUNCS[op](self._local(slot), const)
+        self.sp = sp + 1
+    # Quickening. The adaptive handlers below run the generic operation and,
+    # once warm, rewrite the opcode of the instruction that is executing (at
+    # ip - 1, read before any jump) into a specialized or generic form; the
+    # argument stays the same.
+
+    def _warm(self):
+        key = (id(self.ops), self.ip - 1)
+        count = self._warmup.get(key, 0) + 1
+        if count < QUICKEN_AFTER:
+            self._warmup[key] = count
+            return False
+        self._warmup.pop(key, None)
+        return True
+
+    def _specialize(self, op):
+        self.ops[self.ip - 1] = op
+        self.specializations += 1
+
+    def _deopt(self, op):
+        self.misses[op] = self.misses.get(op, 0) + 1
+        self.ops[self.ip - 1] = _SPECIALIZED[op]
+
+    def op_compare_jump(self, arg):
+        if self._warm():
+            a, b = self.stack[self.sp - 2], self.stack[self.sp - 1]
+            op = None
+            if type(a) is int and type(b) is int:
+                op = _COMPARE_JUMP_INT.get(arg[0])
+            self._specialize(op or COMPARE_JUMP_GENERIC)
+        self.op_compare_jump_generic(arg)
+
+    def op_compare_fast_const_jump(self, arg):
+        if self._warm():
+            val, const = self.locals[arg[1]], arg[2]
+            op = None
+            if type(val) is int and type(const) is int:
+                op = _COMPARE_FAST_CONST_JUMP_INT.get(arg[0])
+            self._specialize(op or COMPARE_FAST_CONST_JUMP_GENERIC)
+        self.op_compare_fast_const_jump_generic(arg)
+
+    def op_compare_global_const_jump(self, arg):
+        if self._warm():
+            val, const = self.globals.get(arg[1]), arg[2]
+            op = None
+            if type(val) is int and type(const) is int:
+                op = _COMPARE_GLOBAL_CONST_JUMP_INT.get(arg[0])
+            self._specialize(op or COMPARE_GLOBAL_CONST_JUMP_GENERIC)
+        self.op_compare_global_const_jump_generic(arg)
+
+    def op_binary_op_fast_const(self, arg):
+        if self._warm():
+            val, const = self.locals[arg[1]], arg[2]
+            op = None
+            if type(val) is int and type(const) is int:
+                op = _BINARY_FAST_CONST_INT.get(arg[0])
+            elif type(val) is str and type(const) is str and arg[0] == BINARY_ADD:
+                op = BINARY_ADD_FAST_CONST_STR
+            self._specialize(op or BINARY_OP_FAST_CONST_GENERIC)
+        self.op_binary_op_fast_const_generic(arg)
+
+    # Specialized forms. Each guard also rules out unbound locals, since
+    # UNBOUND is not an int or str.
+
+    def op_compare_lt_jump_int(self, arg):
+        stack = self.stack
+        sp = self.sp
+        a, b = stack[sp - 2], stack[sp - 1]
+        if type(a) is int and type(b) is int:
+            self.sp = sp - 2
+            if not a < b:
+                self.ip = arg[1]
+        else:
+            self._deopt(COMPARE_LT_JUMP_INT)
+            self.op_compare_jump_generic(arg)
+    def op_compare_le_jump_int(self, arg):
+        stack = self.stack
+        sp = self.sp
+        a, b = stack[sp - 2], stack[sp - 1]
+        if type(a) is int and type(b) is int:
+            self.sp = sp - 2
+            if not a <= b:
+                self.ip = arg[1]
+        else:
+            self._deopt(COMPARE_LE_JUMP_INT)
+            self.op_compare_jump_generic(arg)
+    def op_compare_gt_jump_int(self, arg):
+        stack = self.stack
+        sp = self.sp
+        a, b = stack[sp - 2], stack[sp - 1]
+        if type(a) is int and type(b) is int:
+            self.sp = sp - 2
+            if not a > b:
+                self.ip = arg[1]
+        else:
+            self._deopt(COMPARE_GT_JUMP_INT)
+            self.op_compare_jump_generic(arg)
+    def op_compare_ge_jump_int(self, arg):
+        stack = self.stack
+        sp = self.sp
+        a, b = stack[sp - 2], stack[sp - 1]
+        if type(a) is int and type(b) is int:
+            self.sp = sp - 2
+            if not a >= b:
+                self.ip = arg[1]
+        else:
+            self._deopt(COMPARE_GE_JUMP_INT)
+            self.op_compare_jump_generic(arg)
+    def op_compare_fast_const_lt_jump_int(self, arg):
+        _, slot, const, target = arg
+        val = self.locals[slot]
+        if type(val) is int:
+            if not val < const:
+                self.ip = target
+        else:
+            self._deopt(COMPARE_FAST_CONST_LT_JUMP_INT)
+            self.op_compare_fast_const_jump_generic(arg)
+
+    def op_compare_fast_const_le_jump_int(self, arg):
+        _, slot, const, target = arg
+        val = self.locals[slot]
+        if type(val) is int:
+            if not val <= const:
+                self.ip = target
+        else:
+            self._deopt(COMPARE_FAST_CONST_LE_JUMP_INT)
+            self.op_compare_fast_const_jump_generic(arg)
+
+    def op_compare_fast_const_gt_jump_int(self, arg):
+        _, slot, const, target = arg
+        val = self.locals[slot]
+        if type(val) is int:
+            if not val > const:
+                self.ip = target
+        else:
+            self._deopt(COMPARE_FAST_CONST_GT_JUMP_INT)
+            self.op_compare_fast_const_jump_generic(arg)
+
+    def op_compare_fast_const_ge_jump_int(self, arg):
+        _, slot, const, target = arg
+        val = self.locals[slot]
+        if type(val) is int:
+            if not val >= const:
+                self.ip = target
+        else:
+            self._deopt(COMPARE_FAST_CONST_GE_JUMP_INT)
+            self.op_compare_fast_const_jump_generic(arg)
 
-                if name not in self.funcs:
-                    raise RuntimeError(f"Undefined function {name}")
+    def op_compare_global_const_lt_jump_int(self, arg):
+        _, name, const, target = arg
+        val = self.globals[name]
+        if type(val) is int:
+            if not val < const:
+                self.ip = target
+        else:
+            self._deopt(COMPARE_GLOBAL_CONST_LT_JUMP_INT)
+            self.op_compare_global_const_jump_generic(arg)
 
-                params, body = self.funcs[name]
+    def op_compare_global_const_le_jump_int(self, arg):
+        _, name, const, target = arg
+        val = self.globals[name]
+        if type(val) is int:
+            if not val <= const:
+                self.ip = target
+        else:
+            self._deopt(COMPARE_GLOBAL_CONST_LE_JUMP_INT)
+            self.op_compare_global_const_jump_generic(arg)
 
-                if len(params) != len(args):
-                    raise RuntimeError(f"Function {name} expects {len(params)} args, got {len(args)}")
+    def op_compare_global_const_gt_jump_int(self, arg):
+        _, name, const, target = arg
+        val = self.globals[name]
+        if type(val) is int:
+            if not val > const:
+                self.ip = target
+        else:
+            self._deopt(COMPARE_GLOBAL_CONST_GT_JUMP_INT)
+            self.op_compare_global_const_jump_generic(arg)
 
-                self.call_stack.append((self.ip, self.vars.copy(), self.code))
+    def op_compare_global_const_ge_jump_int(self, arg):
+        _, name, const, target = arg
+        val = self.globals[name]
+        if type(val) is int:
+            if not val >= const:
+                self.ip = target
+        else:
+            self._deopt(COMPARE_GLOBAL_CONST_GE_JUMP_INT)
+            self.op_compare_global_const_jump_generic(arg)
 
-                self.vars = dict(zip(params, args))
-                self.code = body
-                self.ip = 0
+    def op_binary_add_fast_const_int(self, arg):
+        _, slot, const = arg
+        val = self.locals[slot]
+        if type(val) is int:
+            sp = self.sp
+            self.stack[sp] = val + const
+            self.sp = sp + 1
+        else:
+            self._deopt(BINARY_ADD_FAST_CONST_INT)
+            self.op_binary_op_fast_const_generic(arg)
+    def op_binary_sub_fast_const_int(self, arg):
+        _, slot, const = arg
+        val = self.locals[slot]
+        if type(val) is int:
+            sp = self.sp
+            self.stack[sp] = val - const
+            self.sp = sp + 1
+        else:
+            self._deopt(BINARY_SUB_FAST_CONST_INT)
+            self.op_binary_op_fast_const_generic(arg)
+    def op_binary_add_fast_const_str(self, arg):
+        _, slot, const = arg
+        val = self.locals[slot]
+        if type(val) is str:
+            sp = self.sp
+            self.stack[sp] = val + const
+            self.sp = sp + 1
+        else:
+            self._deopt(BINARY_ADD_FAST_CONST_STR)
+            self.op_binary_op_fast_const_generic(arg)
+    def op_load_fast_fast(self, arg):
+        a, b = arg
+        stack = self.stack
+        sp = self.sp
+        stack[sp] = self._local(a)
+        stack[sp + 1] = self._local(b)
+        self.sp = sp + 2
+    def op_load_index_fast(self, arg):
+        arr, idx = arg
+        sp = self.sp
+        self.stack[sp] = self._local(arr)[self._local(idx)]
+        self.sp = sp + 1
+    def op_load_index_global(self, arg):
+        arr, idx = arg
+        sp = self.sp
+        self.stack[sp] = self.globals[arr][self.globals[idx]]
+        self.sp = sp + 1
 
-            elif instr == "RETURN":
-                retval = self.stack.pop()
-                self.ip, self.vars, self.code = self.call_stack.pop()
-                self.stack.append(retval)
 
-            else:
-                raise RuntimeError(f"Bad instruction {instr}")
+# Interpreted calls made from compiled code run in this frame.
+_INVOKE_CODE = VM._invoke.__code__
@@ -0,0 +1,54 @@
+"""Run KoalaCode source on each engine and collect what it gives."""
+from koalacode.cache import compile_source
+from koalacode.interpreter import Interpreter, RuntimeError_
+from koalacode.lexer import iter_tokens
+from koalacode.parser import Parser
+from koalacode.regcompiler import compile_source as compile_registers
+from koalacode.regvm import RegisterVM
+from koalacode.stackless import StacklessInterpreter
+from koalacode.streams import ListInput, ListOutput
+from koalacode.transpiler import run as run_program, transpile
+from koalacode.vm import VM
+
+ENGINES = ("interp", "stackless", "vm", "vm-nojit", "register", "py")
+
+
+def parse(source):
+    return Parser(iter_tokens(source)).parse()
+
+
+def execute(source, engine, output, source_input, **options):
+    """Run ``source`` on ``engine`` with the given output sink and input source.
+
+    ``options`` go to the engine's constructor (to ``transpile`` for "py").
+    """
+    if engine in ("interp", "stackless"):
+        cls = Interpreter if engine == "interp" else StacklessInterpreter
+        cls(output=output, input=source_input, **options).eval(parse(source))
+    elif engine in ("vm", "vm-nojit"):
+        if engine == "vm-nojit":
+            options["jit"] = False
+        code, funcs = compile_source(source)
+        VM(funcs, output=output, input=source_input, **options).run(code)
+    elif engine == "register":
+        code, funcs = compile_registers(source)
+        RegisterVM(funcs, output=output, input=source_input, **options).run(code)
+    elif engine == "py":
+        run_program(transpile(parse(source), **options), output=output, input=source_input)
+    else:
+        raise ValueError(f"unknown engine {engine}")
+
+
+def run(source, engine="interp", inputs=(), **options):
+    """Run ``source`` on ``engine``; return ``(lines, error)``.
+
+    ``lines`` is what the program gave and ``error`` the message of the
+    RuntimeError_ that ended it, or None. ``inputs`` are the lines take()
+    reads; ``options`` are passed on as for ``execute``.
+    """
+    output = ListOutput()
+    try:
+        execute(source, engine, output, ListInput(inputs), **options)
+    except RuntimeError_ as exc:
+        return output.lines, str(exc)
+    return output.lines, None
@@ -0,0 +1,89 @@
+import pytest
+
+from koalacode.assembler import (
+    Code, assemble, encode_linetable, linetable_position, max_stack_depth,
+)
+from koalacode.cache import compile_source
+from koalacode.compiler import CompileError
+from koalacode.opcodes import (
+    BINARY_ADD, BUILD_ARRAY, CALL_FUNC, JUMP, JUMP_IF_FALSE, LOAD_FAST, LOAD_GLOBAL, POP,
+    PRINT, PUSH_CONST, RETURN, STORE_GLOBAL,
+)
+
+INSTRUCTIONS = [
+    (PUSH_CONST, 1, (1, 5)),
+    (PUSH_CONST, True, (1, 5)),
+    (PUSH_CONST, 1, (1, 9)),
+    (BUILD_ARRAY, 3, (1, 5)),
+    (STORE_GLOBAL, "a", (1, 1)),
+    (LOAD_GLOBAL, "a", (3, 6)),
+    (CALL_FUNC, ("f", 1), (3, 6)),
+    (LOAD_FAST, 0, None),
+    (BINARY_ADD, None, (2, 300)),
+    (PRINT, None, (2, 1)),
+    (PUSH_CONST, ("f", 1), (2, 1)),
+    (RETURN, None, (2, 1)),
+]
+
+
+def test_assemble_keeps_every_instruction():
+    code = assemble(INSTRUCTIONS)
+    assert len(code) == len(INSTRUCTIONS)
+    assert code.instructions() == [(op, arg) for op, arg, _ in INSTRUCTIONS]
+    assert code.decode() == [arg for _, arg, _ in INSTRUCTIONS]
+
+
+def test_constants_and_names_are_pooled():
+    code = assemble(INSTRUCTIONS)
+    assert code.consts == [1, True, ("f", 1)]
+    assert code.names == ["a"]
+    assert list(code.args[:3]) == [0, 1, 0]
+
+
+def test_positions_come_back_from_the_line_table():
+    code = assemble(INSTRUCTIONS)
+    assert [code.position(i) for i in range(len(code))] == [pos for _, _, pos in INSTRUCTIONS]
+    assert code.position(len(code)) is None
+
+
+def test_line_table_compresses_runs():
+    positions = [(4, 2)] * 1000 + [(1, 7)] + [None] * 3 + [(70000, 1)]
+    table = encode_linetable(positions)
+    assert len(table) < 20
+    assert [linetable_position(table, i) for i in range(len(positions))] == positions
+
+
+def test_code_round_trips_through_a_tuple():
+    code = assemble(INSTRUCTIONS)
+    copy = Code.from_tuple(code.to_tuple())
+    assert copy.instructions() == code.instructions()
+    assert (copy.linetable, copy.stacksize) == (code.linetable, code.stacksize)
+
+
+@pytest.mark.parametrize("source, depth", [
+    ("x = 1;", 1),
+    ("x = [1, [2, 3], 4];", 3),
+    ("give(1 + 2 * (3 + 4));", 4),
+    ("func f(a, b) { return a; } f(1, [2]);", 2),
+])
+def test_stacksize_is_the_deepest_the_stack_gets(source, depth):
+    code, _ = compile_source(source, opt_level=0)
+    assert code.stacksize == depth
+
+
+def test_stacksize_follows_both_sides_of_a_branch():
+    # if (x) { give(1 + 2); } and nothing on the other side.
+    instructions = [
+        (LOAD_GLOBAL, "x", None), (JUMP_IF_FALSE, 6, None),
+        (PUSH_CONST, 1, None), (PUSH_CONST, 2, None), (BINARY_ADD, None, None),
+        (PRINT, None, None), (PUSH_CONST, None, None), (RETURN, None, None),
+    ]
+    assert max_stack_depth(instructions) == 2
+
+
+def test_unbalanced_bytecode_is_rejected():
+    with pytest.raises(CompileError, match="underflow"):
+        max_stack_depth([(POP, None, None)])
+    # The loop body leaves a value behind each time round.
+    with pytest.raises(CompileError, match="Stack depth 1 at 0 was 0"):
+        max_stack_depth([(PUSH_CONST, 1, None), (JUMP, 0, None)])
@@ -0,0 +1,76 @@
+import os
+
+from koalacode import cache
+from koalacode.cache import cache_path, compile_source, dumps, load_program, loads
+from koalacode.optimizer import Optimizer
+from koalacode.streams import ListOutput
+from koalacode.vm import VM
+
+SOURCE = "func f(a) { return a * 2; }\nx = [1, 2];\ngive(f(x[1]) + 1);\n"
+
+
+def give(program):
+    code, funcs = program
+    output = ListOutput()
+    VM(funcs, output=output).run(code)
+    return output.lines
+
+
+def test_dumps_and_loads_round_trip():
+    code, funcs = compile_source(SOURCE)
+    loaded_code, loaded_funcs = loads(dumps(SOURCE, code, funcs), SOURCE)
+    assert loaded_code.instructions() == code.instructions()
+    assert loaded_code.linetable == code.linetable
+    assert loaded_funcs["f"].code.instructions() == funcs["f"].code.instructions()
+    assert give((loaded_code, loaded_funcs)) == ["5"]
+
+
+def test_stale_or_broken_data_is_not_loaded():
+    data = dumps(SOURCE, *compile_source(SOURCE))
+    assert loads(data, SOURCE + "\n") is None
+    assert loads(data, SOURCE, opt_level=0) is None
+    assert loads(data[:10], SOURCE) is None
+    assert loads(data[:-5], SOURCE) is None
+
+
+def test_load_program_writes_and_reuses_the_cache(tmp_path):
+    source_path = tmp_path / "prog.ko"
+    source_path.write_text(SOURCE)
+    assert give(load_program(SOURCE, str(source_path))) == ["5"]
+    path = cache_path(str(source_path))
+    with open(path, "rb") as f:
+        assert loads(f.read(), SOURCE) is not None
+    assert give(load_program(SOURCE, str(source_path))) == ["5"]
+
+
+def test_cache_files_live_in_koalacache(tmp_path):
+    path = cache_path(str(tmp_path / "prog.ko"))
+    assert path == os.path.join(str(tmp_path), "__koalacache__", "prog.koc")
+
+
+def test_a_new_bytecode_version_invalidates_the_cache(monkeypatch):
+    data = dumps(SOURCE, *compile_source(SOURCE))
+    monkeypatch.setattr(cache, "BYTECODE_VERSION", cache.BYTECODE_VERSION + 1)
+    assert loads(data, SOURCE) is None
+
+
+def test_a_cache_hit_skips_compilation(tmp_path, monkeypatch):
+    source_path = str(tmp_path / "prog.ko")
+    load_program(SOURCE, source_path)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("compiled again")
+    monkeypatch.setattr(cache, "compile_source", fail)
+    assert give(load_program(SOURCE, source_path)) == ["5"]
+
+
+def test_an_unwritable_cache_is_ignored(tmp_path):
+    (tmp_path / "__koalacache__").write_text("not a directory")
+    assert give(load_program(SOURCE, str(tmp_path / "prog.ko"))) == ["5"]
+
+
+def test_an_explicit_optimizer_bypasses_the_cache(tmp_path):
+    source_path = str(tmp_path / "prog.ko")
+    optimizer = Optimizer()
+    assert give(load_program(SOURCE, source_path, optimizer=optimizer)) == ["5"]
+    assert not os.path.exists(cache_path(source_path))
@@ -0,0 +1,72 @@
+"""Every engine runs the example programs and the cases below the same way.
+
+The bytecode VMs word some errors differently from the tree-walking engines
+and the Python backend, so each engine's lines and error are compared with a
+reference engine of its family, and its lines alone with the stack VM's.
+"""
+import glob
+import os
+
+import pytest
+
+from tests.engines import ENGINES, run
+
+INPUT = ("koala", "bear")
+
+CASES = {
+    "arithmetic": "give(7 / 2); give(1 + 2 * 3 - 4); give(10 > 3); give(2 >= 3 || 1 < 2);",
+    "strings": 's = "ab"; t = s + "cd"; give(t); give(len(t));',
+    "arrays": "a = [1, [], [2, 3]]; a[0] = 9; give(a); give(len(a[2])); give(a[1]);",
+    "empty array argument": "func pair(a, b) { return [a, b]; } give(pair(1, []));",
+    "calls in loops": "func note(x) { give(x); return 0; } "
+                      "iter2(i = 0; i < 3; i = i + 1) { note(i); }",
+    "locals": "func f(n) { s = 0; iter2(i = 0; i < n; i = i + 1) { s = s + i; } return s; } "
+              "give(f(10));",
+    "maybe assigned": "func f(n) { this (n > 0) { y = 1; } return y; } give(f(1)); give(f(0));",
+    "assigned in both branches": "func f(n) { this (n > 0) { y = 1; } otherwise { y = 2; } "
+                                 "return y; } give(f(0));",
+    "deep recursion": "func d(n) { this (n < 1) { return 0; } return 1 + d(n - 1); } "
+                      "give(d(20000));",
+    "tail recursion": "func t(n, acc) { this (n < 1) { return acc; } return t(n - 1, acc + n); } "
+                      "give(t(50000, 0));",
+    "input": 'take(); give(1); take();',
+    "undefined global": "give(missing);",
+    "undefined function": "give(nope(1));",
+    "argument count": "func f(a) { return a; } give(f(1, 2));",
+    "len without an argument": "func f() { return len(); } give(1); give(len());",
+    "index out of bounds": "a = [1, 2]; give(a[5]);",
+    "division by zero": "x = 0; give(1 / x);",
+    "mixed types": 'a = [1, "x"]; give(a[0] + a[1]);',
+    "error in a function": "func f(a) { return a[3]; } give(1); give(f([1]));",
+    "type error": 'x = 1; x = "s";',
+}
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), "..", "examples")
+for path in sorted(glob.glob(os.path.join(EXAMPLES, "*.ko"))):
+    with open(path, encoding="utf-8") as f:
+        CASES[os.path.basename(path)] = f.read()
+
+REFERENCE = {"vm": "vm", "vm-nojit": "vm", "register": "vm",
+             "interp": "stackless", "stackless": "stackless", "py": "stackless"}
+
+# Engines that recurse on Python's stack and stop at its limit.
+RECURSION_LIMITED = {"interp", "py"}
+DEEP = {"deep recursion", "tail recursion"}
+
+
+def outcome(case, engine):
+    if case in DEEP and engine in RECURSION_LIMITED:
+        pytest.skip("recursion is limited by Python's stack")
+    return run(CASES[case], engine, inputs=INPUT)
+
+
+@pytest.mark.parametrize("engine", [e for e in ENGINES if REFERENCE[e] != e])
+@pytest.mark.parametrize("case", CASES)
+def test_engine_matches_its_family(case, engine):
+    assert outcome(case, engine) == outcome(case, REFERENCE[engine])
+
+
+@pytest.mark.parametrize("engine", [e for e in ENGINES if e != "vm"])
+@pytest.mark.parametrize("case", CASES)
+def test_engine_gives_the_same_lines(case, engine):
+    assert outcome(case, engine)[0] == outcome(case, "vm")[0]
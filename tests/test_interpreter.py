@@ -0,0 +1,62 @@
+import pytest
+
+from koalacode.interpreter import Interpreter, ReturnValue, RuntimeError_
+from koalacode.nodes import Num
+from koalacode.streams import ListOutput
+from tests.engines import parse, run
+
+
+def test_compile_returns_a_closure_over_the_scope():
+    output = ListOutput()
+    interp = Interpreter(typecheck=False, output=output)
+    tree = parse("iter (x < 3) { give(x * 2); x = x + 1; }")
+    program = interp.compile(tree)
+    assert output.lines == []
+    tree.stmts[0].body.stmts[0].expr.right = Num(10)
+    program({'x': 1})
+    program({'x': 2})
+    assert output.lines == ["2", "4", "4"]
+
+
+def test_unknown_nodes_are_rejected_when_compiled():
+    class Weird:
+        kind = 'weird'
+    with pytest.raises(RuntimeError_, match="^Unknown node weird$"):
+        Interpreter().compile(Weird())
+
+
+def test_calls_get_their_own_scope_linked_to_globals():
+    output = ListOutput()
+    interp = Interpreter(output=output)
+    interp.eval(parse("g = 10;\nfunc f(n) { t = n + g; this (n > 0) { t = t + f(n - 1); } "
+                      "return t; }\ngive(f(2));\n"))
+    assert output.lines == ["33"]
+    assert interp.env == {'g': 10}
+
+
+@pytest.mark.parametrize("engine", ("interp", "stackless"))
+def test_assigning_in_a_function_does_not_touch_globals(engine):
+    source = "x = 1;\nfunc f() { x = 5; return x; }\ngive(f());\ngive(x);\n"
+    assert run(source, engine) == (["5", "1"], None)
+
+
+def test_return_is_passed_back_as_a_value():
+    output = ListOutput()
+    program = Interpreter(output=output).compile(parse("this (true) { return 4; } give(9);"))
+    res = program({})
+    assert res.__class__ is ReturnValue and res.value == 4
+    assert output.lines == []
+
+
+@pytest.mark.parametrize("engine", ("interp", "stackless"))
+def test_return_leaves_nested_loops_and_blocks(engine):
+    source = ("func f(n) { iter2(i = 0; i < 10; i = i + 1) { this (i > n - 1) "
+              "{ iter (true) { return i * 2; } } } return 99; }\ngive(f(3));\ngive(f(20));\n")
+    assert run(source, engine) == (["6", "99"], None)
+
+
+@pytest.mark.parametrize("engine", ("interp", "stackless"))
+def test_len_without_an_argument_fails_when_it_runs(engine):
+    assert run("func f() { return len(); }\ngive(1);\n", engine) == (["1"], None)
+    assert run("give(1);\ngive(len());\n", engine) == (
+        ["1"], "[Line 2, Col 6] Function len expects 1 args, got 0")
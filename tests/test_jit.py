@@ -0,0 +1,71 @@
+import pytest
+
+from koalacode.cache import compile_source
+from koalacode.interpreter import RuntimeError_
+from koalacode.jit import translate
+from koalacode.opcodes import LOAD_INDEX_FAST, RETURN
+from koalacode.streams import ListOutput
+from koalacode.vm import VM
+from tests.engines import run
+
+# Calls a function often enough for a VM with these options to compile it.
+HOT = "iter2(k = 0; k < 50; k = k + 1) { %s; }\n"
+JIT = {"jit_threshold": 10, "memoize": False}
+
+
+def position(error):
+    return error[:error.index("]") + 1]
+
+
+def test_translate_maps_generated_lines_to_instructions():
+    _, funcs = compile_source("func f(a, i) { return a[i]; }")
+    func = funcs["f"]
+    source, origins = translate(func)
+    lines = source.splitlines()
+    ops = {lines[n - 1].strip(): func.code.instruction(index)[0] for n, index in origins.items()}
+    assert ops == {"t1 = l0[l1]": LOAD_INDEX_FAST, "return t1": RETURN}
+
+
+CASES = {
+    "index out of bounds": (
+        "a = [1, 2, 3];\nfunc get(a, i) {\n    return a[i];\n}\n"
+        + HOT % "get(a, 1)" + "give(get(a, 7));\n",
+        "[Line 3, Col 8]"),
+    "undefined local": (
+        "func f(n) {\n    this (n > 0) { x = n; }\n    return x;\n}\n"
+        + HOT % "f(1)" + "give(f(0));\n",
+        "[Line 3, Col 8]"),
+    "undefined function": (
+        "func f(n) {\n    this (n > 0) { return n; }\n    return h(n);\n}\n"
+        + HOT % "f(1)" + "give(f(0));\n",
+        "[Line 3, Col 8]"),
+    "interpreted callee": (
+        "func g(n) { return 10 / n; }\n"
+        "func f(n) {\n    this (n > 0) { return n; }\n    return g(n) + 1;\n}\n"
+        + HOT % "f(1)" + "give(f(0));\n",
+        "[Line 1, Col 23]"),
+    "compiled callee": (
+        "func g(n) { return 10 / n; }\nfunc f(n) { return g(n) + 1; }\n"
+        + HOT % "f(1)" + "give(f(0));\n",
+        "[Line 1, Col 23]"),
+}
+
+
+@pytest.mark.parametrize("case", CASES)
+@pytest.mark.parametrize("engine", ("interp", "vm-nojit", "vm"))
+def test_errors_in_hot_functions_keep_their_position(case, engine):
+    source, where = CASES[case]
+    lines, error = run(source, engine, **(JIT if engine == "vm" else {}))
+    assert lines == []
+    assert position(error) == where
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_failing_calls_run_compiled_code(case):
+    source, _ = CASES[case]
+    code, funcs = compile_source(source)
+    vm = VM(funcs, output=ListOutput(), **JIT)
+    with pytest.raises(RuntimeError_):
+        vm.run(code)
+    name = "get" if "get" in funcs else "f"
+    assert vm.jit_stats()[name]["compiled_calls"] > 0
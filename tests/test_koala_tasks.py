@@ -0,0 +1,68 @@
+import asyncio
+
+from koala_tasks import KoalaTasks, run_task
+
+FOREVER = "iter2(i = 0; true; i = i + 1) { x = i; }"
+COUNT = "s = 0; iter2(i = 0; i < 2000; i = i + 1) { s = s + i; } give(s);"
+
+
+def with_tasks(body, **options):
+    async def main():
+        tasks = KoalaTasks(**options)
+        await tasks.start()
+        try:
+            return await body(tasks)
+        finally:
+            await tasks.close()
+    return asyncio.run(main())
+
+
+def test_run_task_collects_output_and_errors():
+    assert asyncio.run(run_task('give(1); give("a");'))[0] == "1\na"
+    assert asyncio.run(run_task("x = 1;"))[0] == "No output"
+    output, _ = asyncio.run(run_task("a = [1];\ngive(a[3]);"))
+    assert output.startswith("Error: [Line 2, Col 6]")
+    assert asyncio.run(run_task("take();"))[0].startswith("Error: ")
+
+
+def test_programs_run_side_by_side():
+    async def body(tasks):
+        return await asyncio.gather(*(tasks.run(COUNT) for _ in range(5)))
+
+    assert with_tasks(body, time_slice=100) == [str(sum(range(2000)))] * 5
+
+
+def test_programs_over_the_limit_wait_for_a_slot():
+    async def body(tasks):
+        await asyncio.gather(*(tasks.run(COUNT) for _ in range(3)))
+        return tasks.metrics.snapshot()
+
+    metrics = with_tasks(body, size=1, time_slice=100)
+    # The first program takes the slot at once; the other two queue.
+    assert (metrics["max_queue_depth"], metrics["completed"], metrics["running"]) == (2, 3, 0)
+
+
+def test_program_over_the_timeout_is_cancelled():
+    async def body(tasks):
+        slow, quick = await asyncio.gather(tasks.run(FOREVER), tasks.run("give(1);"))
+        return slow, quick, tasks.metrics.snapshot()
+
+    slow, quick, metrics = with_tasks(body, timeout=0.1)
+    assert slow == "Error: program did not finish within 0.1 seconds"
+    assert quick == "1"
+    assert (metrics["timeouts"], metrics["running"]) == (1, 0)
+
+
+def test_request_cancelled_in_the_queue_leaves_it():
+    async def body(tasks):
+        busy = asyncio.ensure_future(tasks.run(COUNT))
+        waiting = asyncio.ensure_future(tasks.run("give(1);"))
+        await asyncio.sleep(0)
+        assert tasks.metrics.queued == 1
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        await busy
+        return tasks.metrics.snapshot()
+
+    metrics = with_tasks(body, size=1, time_slice=100)
+    assert (metrics["queue_depth"], metrics["running"], metrics["completed"]) == (0, 0, 1)
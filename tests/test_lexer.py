@@ -0,0 +1,45 @@
+import pytest
+
+from koalacode.lexer import TokenStore, iter_tokens, tokenize
+
+SOURCE = 'func f(a) {\n  # note\n  return a[0] >= "x y";\n}\r\ngive(f([12]));\n'
+
+
+def fields(tokens):
+    return [(t.type, t.value, t.line, t.col) for t in tokens]
+
+
+def test_tokens_carry_types_values_and_positions():
+    # Columns count from the end of the line's leading whitespace.
+    assert fields(tokenize('x = 12 + "ab";\n  iter2 != y')) == [
+        ('ID', 'x', 1, 1), ('ASSIGN', '=', 1, 3), ('NUMBER', 12, 1, 5), ('OP', '+', 1, 8),
+        ('STRING', 'ab', 1, 10), ('SEMI', ';', 1, 14),
+        ('ITER2', 'iter2', 2, 1), ('OP', '!=', 2, 7), ('ID', 'y', 2, 10), ('EOF', None, 2, 10),
+    ]
+
+
+def test_comments_are_skipped_and_line_endings_counted():
+    tokens = tokenize(SOURCE)
+    assert [t.type for t in tokens if t.line == 3][:2] == ['RETURN', 'ID']
+    assert (tokens[-2].type, tokens[-2].line, tokens[-2].col) == ('SEMI', 5, 14)
+    assert not any(t.value == 'note' for t in tokens)
+
+
+def test_bad_character_reports_its_position():
+    with pytest.raises(RuntimeError, match=r"^\[Line 2, Col 3\] Unexpected token: @$"):
+        tokenize("x = 1;\ny @ 2;")
+
+
+def test_tokens_are_produced_lazily():
+    tokens = iter_tokens("give(1); @")
+    assert next(tokens).type == 'GIVE'
+    with pytest.raises(RuntimeError, match="Unexpected token"):
+        list(tokens)
+
+
+def test_token_store_holds_the_same_tokens():
+    store = TokenStore.from_source(SOURCE)
+    assert len(store) == len(tokenize(SOURCE))
+    assert fields(store) == fields(tokenize(SOURCE))
+    assert (store[0].type, store[0].value) == ('FUNC', 'func')
+    assert store[len(store) - 1].type == 'EOF'
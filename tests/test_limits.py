@@ -0,0 +1,123 @@
+import pytest
+
+from koalacode.cache import compile_source
+from koalacode.limits import FUEL_BATCH, LimitExceeded, Limits, Meter
+from koalacode.opcodes import BINARY_ADD, JUMP
+from koalacode.streams import ListOutput
+from koalacode.vm import VM
+from tests.engines import run
+
+# The engines that take limits.
+METERED = ("interp", "stackless", "vm")
+
+COUNT = "iter2(i = 0; i < 10; i = i + 1) { give(i); }\n"
+FOREVER = "give(1);\niter2(i = 0; true; i = i + 1) { x = i; }\n"
+
+
+def test_take_hands_out_fuel_until_none_is_left():
+    meter = Meter(Limits(fuel=100))
+    assert [meter.take(FUEL_BATCH), meter.take(FUEL_BATCH)] == [FUEL_BATCH, 100 - FUEL_BATCH]
+    with pytest.raises(LimitExceeded, match="Step limit exceeded"):
+        meter.take(FUEL_BATCH)
+
+
+@pytest.mark.parametrize("engine", METERED)
+def test_endless_loop_runs_out_of_fuel(engine):
+    assert run(FOREVER, engine, limits=Limits(fuel=1000)) == (
+        ["1"], "[Line 2, Col 1] Step limit exceeded (1000 steps)")
+
+
+@pytest.mark.parametrize("engine", METERED)
+def test_endless_recursion_runs_out_of_fuel(engine):
+    source = "func f(n) { return f(n + 1); }\ngive(f(0));\n"
+    assert run(source, engine, limits=Limits(fuel=50)) == (
+        [], "[Line 1, Col 20] Step limit exceeded (50 steps)")
+
+
+@pytest.mark.parametrize("engine", METERED)
+def test_program_within_its_fuel_runs(engine):
+    assert run(COUNT, engine, limits=Limits(fuel=10)) == ([str(i) for i in range(10)], None)
+
+
+def test_vm_stops_at_the_exact_step():
+    lines, error = run(COUNT, "vm", limits=Limits(fuel=5))
+    assert lines == ["0", "1", "2", "3", "4", "5"]
+    assert error == "[Line 1, Col 1] Step limit exceeded (5 steps)"
+
+
+@pytest.mark.parametrize("engine", ("interp", "stackless"))
+def test_interpreter_loops_overshoot_by_less_than_a_batch(engine):
+    source = "iter2(i = 0; true; i = i + 1) { give(i); }\n"
+    lines, error = run(source, engine, limits=Limits(fuel=100))
+    assert 100 <= len(lines) < 100 + FUEL_BATCH
+    assert error == "[Line 1, Col 1] Step limit exceeded (100 steps)"
+
+
+@pytest.mark.parametrize("engine", ("interp", "stackless"))
+def test_short_loops_charge_their_steps_when_they_end(engine):
+    inner = "iter2(j = 0; j < 3; j = j + 1) { x = j; }"
+    source = f"iter2(i = 0; i < 100; i = i + 1) {{ {inner} }}\n"
+    assert run(source, engine, limits=Limits(fuel=400)) == ([], None)
+    lines, error = run(source, engine, limits=Limits(fuel=300))
+    assert error.endswith("Step limit exceeded (300 steps)")
+
+
+def test_vm_gives_back_the_fuel_it_did_not_spend():
+    code, funcs = compile_source(COUNT)
+    vm = VM(funcs, output=ListOutput(), limits=Limits(fuel=1000))
+    vm.run(code)
+    assert vm.meter.fuel == 990
+    vm.run(code)
+    assert vm.meter.fuel == 990
+
+
+@pytest.mark.parametrize("engine", METERED)
+def test_array_limit(engine):
+    source = "a = [1, 2, 3];\nb = a + a;\ngive(len(b));\n"
+    assert run(source, engine, limits=Limits(array_elements=9)) == (["6"], None)
+    assert run(source, engine, limits=Limits(array_elements=8)) == (
+        [], "[Line 2, Col 7] Array limit exceeded (8 elements)")
+
+
+@pytest.mark.parametrize("engine", METERED)
+def test_string_limit_is_charged_before_building(engine):
+    source = 's = "ab";\ns = s * 1000000000000;\ngive(s);\n'
+    assert run(source, engine, limits=Limits(string_chars=100)) == (
+        [], "[Line 2, Col 7] String limit exceeded (100 characters)")
+
+
+@pytest.mark.parametrize("engine", METERED)
+def test_input_counts_against_the_string_limit(engine):
+    assert run("take();\ngive(1);\n", engine, inputs=["abcdef"], limits=Limits(string_chars=5)) == (
+        [], "[Line 1, Col 1] String limit exceeded (5 characters)")
+
+
+def test_vm_checks_only_the_budgets_that_are_set():
+    fuel = VM(limits=Limits(fuel=10))
+    assert fuel.handlers[BINARY_ADD] == fuel.op_add
+    assert fuel.handlers[JUMP] == fuel.op_jump_metered
+    memory = VM(limits=Limits(string_chars=10))
+    assert memory.handlers[BINARY_ADD] == memory.op_add_metered
+    assert memory.handlers[JUMP] == memory.op_jump
+
+
+SQUARING = "x = 3;\niter(true) { x = x * x; }\n"
+
+
+@pytest.mark.parametrize("engine", METERED)
+def test_repeated_squaring_hits_the_integer_limit(engine):
+    assert run(SQUARING, engine, limits=Limits(int_bits=1000)) == (
+        [], "[Line 2, Col 20] Integer limit exceeded (1000 bits)")
+
+
+@pytest.mark.parametrize("engine", METERED)
+def test_integer_limit_checks_proven_and_constant_products(engine):
+    source = "func sq(n) { return n * n; }\ngive(sq(2 * 1024));\ngive(sq(4096) * 65536);\n"
+    assert run(source, engine, limits=Limits(int_bits=40)) == (
+        ["4194304"], "[Line 3, Col 15] Integer limit exceeded (40 bits)")
+
+
+@pytest.mark.parametrize("engine", METERED)
+def test_integer_limit_leaves_small_numbers_alone(engine):
+    source = "x = 1;\niter2(i = 0; i < 60; i = i + 1) { x = x * 2; }\ngive(x > 0);\n"
+    assert run(source, engine, limits=Limits(int_bits=64)) == (["True"], None)
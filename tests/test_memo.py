@@ -0,0 +1,87 @@
+import pytest
+
+from koalacode.cache import compile_source
+from koalacode.interpreter import Interpreter
+from koalacode.memo import pure_func_defs, still_pure
+from koalacode.stackless import StacklessInterpreter
+from koalacode.streams import ListOutput
+from koalacode.vm import VM
+from tests.engines import parse
+
+INTERPRETERS = (Interpreter, StacklessInterpreter)
+
+
+def session(cls, *programs):
+    """Evaluate ``programs`` in one incremental interpreter, as the REPL does."""
+    output = ListOutput()
+    interp = cls(incremental=True, output=output)
+    for program in programs:
+        interp.eval(parse(program))
+    return interp, output.lines
+
+
+def test_pure_func_defs_maps_pure_defs_to_their_callees():
+    tree = parse("func g(x) { return x; } func f(x) { return g(x) + len([1]); } "
+                 "func h() { give(1); }")
+    g, f, _ = tree.stmts
+    assert pure_func_defs(tree) == {id(g): set(), id(f): {"g", "len"}}
+
+
+def test_still_pure_drops_transitive_callers_of_impure_functions():
+    calls = {"f": {"g"}, "g": {"h"}, "k": set(), "m": {"later"}}
+    assert still_pure(calls, {"f", "g", "h", "k", "m"}) == {"k", "m"}
+
+
+@pytest.mark.parametrize("cls", INTERPRETERS)
+def test_repeated_calls_are_memoized(cls):
+    interp, lines = session(cls, "func sq(x) { return x * x; } give(sq(3)); give(sq(3));")
+    assert lines == ["9", "9"]
+    assert interp.memo_stats()["sq"]["hits"] == 1
+
+
+@pytest.mark.parametrize("cls", INTERPRETERS)
+def test_redefining_a_callee_as_impure_stops_memoizing_its_callers(cls):
+    interp, lines = session(
+        cls,
+        "func g(x) { return x; } func f(x) { return g(x); }",
+        'func g(x) { give("side"); return x; }',
+        "give(f(1)); give(f(1));",
+    )
+    assert lines == ["side", "1", "side", "1"]
+    assert interp.memo_stats() == {}
+
+
+@pytest.mark.parametrize("cls", INTERPRETERS)
+def test_impure_redefinition_reaches_indirect_callers(cls):
+    interp, lines = session(
+        cls,
+        "func h(x) { return x; } func g(x) { return h(x); } func f(x) { return g(x); } "
+        "func other(x) { return x; }",
+        'func h(x) { give("side"); return x; }',
+        "give(f(1)); give(f(1)); give(other(2));",
+    )
+    assert lines == ["side", "1", "side", "1", "2"]
+    assert set(interp.memo_stats()) == {"other"}
+
+
+@pytest.mark.parametrize("cls", INTERPRETERS)
+def test_pure_redefinition_clears_cached_results(cls):
+    _, lines = session(
+        cls,
+        "func g(x) { return x; } func f(x) { return g(x); } give(f(1));",
+        "func g(x) { return x + 10; }",
+        "give(f(1));",
+    )
+    assert lines == ["1", "11"]
+
+
+def test_vm_finds_pure_functions_again_on_each_run():
+    output = ListOutput()
+    vm = VM(output=output)
+    for program in ("func g(x) { return x; } func f(x) { return g(x); }",
+                    'func g(x) { give("side"); return x; }',
+                    "give(f(1)); give(f(1));"):
+        code, funcs = compile_source(program)
+        vm.funcs.update(funcs)
+        vm.run(code)
+    assert output.lines == ["side", "1", "side", "1"]
@@ -0,0 +1,50 @@
+import pickle
+
+import pytest
+
+from koalacode.nodes import BinOp, Num, Var, positions_of
+from tests.engines import parse
+
+SOURCE = "x = 1;\ngive(x + [2, y]);\n"
+
+
+def test_nodes_have_no_instance_dict():
+    node = parse(SOURCE).stmts[0]
+    assert not hasattr(node, '__dict__')
+    with pytest.raises(AttributeError):
+        node.line = 1
+
+
+def test_positions_are_kept_in_the_side_table():
+    tree = parse(SOURCE)
+    positions = positions_of(tree)
+    give = tree.stmts[1]
+    add = give.expr
+    array = add.right
+    assert positions.get(give) == (2, 1)
+    assert positions.get(add) == (2, 8)
+    assert positions.get(array) == (2, 10)
+    assert positions.get(array.elems[1]) == (2, 14)
+    assert positions.where(add) == "[Line 2, Col 8] "
+
+
+def test_literals_and_unknown_nodes_have_no_position():
+    tree = parse(SOURCE)
+    positions = positions_of(tree)
+    assert positions.get(tree.stmts[0].value) is None
+    assert positions.get(Var('x')) is None
+    assert positions.where(None) == ""
+
+
+def test_hand_built_trees_have_an_empty_table():
+    node = BinOp('+', Num(1), Var('a'))
+    assert positions_of(node).get(node) is None
+    assert list(node.children()) == [node.left, node.right]
+
+
+def test_positions_survive_pickling():
+    tree = parse(SOURCE)
+    positions_of(tree).get(tree)
+    copy = pickle.loads(pickle.dumps(tree))
+    assert repr(copy) == repr(tree)
+    assert positions_of(copy).get(copy.stmts[1].expr) == (2, 8)
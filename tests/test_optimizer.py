@@ -0,0 +1,149 @@
+from koalacode.cache import compile_source
+from koalacode.cli import main
+from koalacode.opcodes import (
+    PUSH_CONST, POP, LOAD_GLOBAL, STORE_GLOBAL, LOAD_FAST, STORE_FAST, DUP_TOP,
+    PRINT, JUMP, JUMP_IF_FALSE, RETURN, BINARY_ADD, BINARY_MUL, BINARY_FLOORDIV,
+    COMPARE_LT, INC_FAST, COMPARE_FAST_CONST_JUMP, COMPARE_JUMP,
+)
+from koalacode.optimizer import (
+    MAX_FOLDED_STR, Optimizer, eliminate_dead_code, fold_constants,
+    fuse_superinstructions, remove_redundant_loads, thread_jumps,
+)
+
+
+def code(*instructions):
+    """Instructions without positions, which the passes carry along untouched."""
+    return [(op, arg, None) for op, arg in instructions]
+
+
+def ops(instructions):
+    return [(op, arg) for op, arg, _ in instructions]
+
+
+# fold_constants
+
+def test_fold_constants_evaluates_binary_operators():
+    folded = fold_constants(code((PUSH_CONST, 2), (PUSH_CONST, 3), (BINARY_ADD, None),
+                                 (PUSH_CONST, 4), (BINARY_MUL, None), (PRINT, None)))
+    assert ops(folded) == [(PUSH_CONST, 20), (PRINT, None)]
+
+
+def test_fold_constants_keeps_operations_that_raise():
+    division = code((PUSH_CONST, 1), (PUSH_CONST, 0), (BINARY_FLOORDIV, None), (PRINT, None))
+    assert fold_constants(division) == division
+
+
+def test_fold_constants_keeps_long_string_repetition():
+    repeat = code((PUSH_CONST, "ab"), (PUSH_CONST, MAX_FOLDED_STR), (BINARY_MUL, None))
+    assert fold_constants(repeat) == repeat
+
+
+def test_fold_constants_resolves_branches_on_constants():
+    taken = fold_constants(code((PUSH_CONST, True), (JUMP_IF_FALSE, 3),
+                                (PUSH_CONST, 1), (PRINT, None)))
+    assert ops(taken) == [(PUSH_CONST, 1), (PRINT, None)]
+    skipped = fold_constants(code((PUSH_CONST, False), (JUMP_IF_FALSE, 3),
+                                  (PUSH_CONST, 1), (PRINT, None)))
+    assert ops(skipped) == [(JUMP, 2), (PUSH_CONST, 1), (PRINT, None)]
+
+
+def test_fold_constants_leaves_jump_targets_alone():
+    target = code((PUSH_CONST, 1), (PUSH_CONST, 2), (BINARY_ADD, None), (JUMP, 1))
+    assert fold_constants(target) == target
+
+
+# thread_jumps
+
+def test_thread_jumps_follows_chains_of_jumps():
+    threaded = thread_jumps(code((JUMP_IF_FALSE, 3), (PUSH_CONST, 1), (PRINT, None),
+                                 (JUMP, 5), (PUSH_CONST, 2), (PUSH_CONST, 3), (PRINT, None)))
+    assert threaded[0][:2] == (JUMP_IF_FALSE, 5)
+
+
+def test_thread_jumps_drops_jumps_to_the_next_instruction():
+    assert ops(thread_jumps(code((JUMP, 1), (PUSH_CONST, 1)))) == [(PUSH_CONST, 1)]
+    assert ops(thread_jumps(code((JUMP_IF_FALSE, 1), (PUSH_CONST, 1)))) == [
+        (POP, None), (PUSH_CONST, 1)]
+
+
+def test_thread_jumps_keeps_loop_back_edges_on_a_jump():
+    # The condition's exit jumps to a JUMP back to the loop head; it must
+    # not become a backward conditional jump.
+    loop = code((LOAD_GLOBAL, "x"), (JUMP_IF_FALSE, 3), (JUMP, 0), (JUMP, 0))
+    assert thread_jumps(loop)[1][:2] == (JUMP_IF_FALSE, 3)
+
+
+# eliminate_dead_code
+
+def test_eliminate_dead_code_removes_unreachable_instructions():
+    pruned = eliminate_dead_code(code((JUMP, 3), (PUSH_CONST, 1), (PRINT, None),
+                                      (PUSH_CONST, 2), (RETURN, None), (PUSH_CONST, None),
+                                      (RETURN, None)))
+    assert ops(pruned) == [(JUMP, 1), (PUSH_CONST, 2), (RETURN, None)]
+
+
+def test_eliminate_dead_code_keeps_jump_targets():
+    live = code((PUSH_CONST, 1), (JUMP_IF_FALSE, 3), (JUMP, 4), (PUSH_CONST, 2), (RETURN, None))
+    assert eliminate_dead_code(live) == live
+
+
+# remove_redundant_loads
+
+def test_remove_redundant_loads_reuses_a_stored_value():
+    for store, load in ((STORE_FAST, LOAD_FAST), (STORE_GLOBAL, LOAD_GLOBAL)):
+        assert ops(remove_redundant_loads(code((store, 0), (load, 0), (PRINT, None)))) == [
+            (DUP_TOP, None), (store, 0), (PRINT, None)]
+
+
+def test_remove_redundant_loads_drops_discarded_constants_only():
+    assert remove_redundant_loads(code((PUSH_CONST, 1), (POP, None))) == []
+    # Loading a variable can raise "Undefined variable", so it stays.
+    undefined = code((LOAD_GLOBAL, "x"), (POP, None))
+    assert remove_redundant_loads(undefined) == undefined
+
+
+# fuse_superinstructions
+
+def test_fuse_superinstructions_builds_increments_and_compares():
+    fused = fuse_superinstructions(code((LOAD_FAST, 0), (PUSH_CONST, 1), (BINARY_ADD, None),
+                                        (STORE_FAST, 0), (LOAD_FAST, 0), (PUSH_CONST, 10),
+                                        (COMPARE_LT, None), (JUMP_IF_FALSE, 0)))
+    assert ops(fused) == [(INC_FAST, (0, 1)),
+                          (COMPARE_FAST_CONST_JUMP, (COMPARE_LT, 0, 10, 0))]
+
+
+def test_fuse_superinstructions_prefers_the_longest_pattern():
+    fused = fuse_superinstructions(code((LOAD_GLOBAL, "a"), (LOAD_GLOBAL, "b"),
+                                        (COMPARE_LT, None), (JUMP_IF_FALSE, 0)))
+    assert ops(fused) == [(LOAD_GLOBAL, "a"), (LOAD_GLOBAL, "b"), (COMPARE_JUMP, (COMPARE_LT, 0))]
+
+
+def test_fuse_superinstructions_does_not_swallow_jump_targets():
+    increment = code((LOAD_FAST, 0), (PUSH_CONST, 1), (BINARY_ADD, None), (STORE_FAST, 0),
+                     (JUMP, 1))
+    assert fuse_superinstructions(increment)[0][0] == LOAD_FAST
+
+
+# Optimizer
+
+def test_optimizer_counts_removed_instructions():
+    optimizer = Optimizer()
+    compile_source("x = 2 + 3;\ngive(x);\n", optimizer=optimizer)
+    assert optimizer.before > optimizer.after
+    assert optimizer.stats["fold_constants"] == 2
+    assert sum(optimizer.stats.values()) == optimizer.before - optimizer.after
+
+
+def test_level_zero_runs_no_passes():
+    optimizer = Optimizer(0)
+    compile_source("give(2 + 3);\n", optimizer=optimizer)
+    assert optimizer.stats == {} and optimizer.before == optimizer.after
+
+
+def test_cli_prints_optimizer_stats(tmp_path, capsys):
+    program = tmp_path / "p.ko"
+    program.write_text("give(2 + 3);\n")
+    main(["--backend=vm", "--opt-stats", str(program)])
+    captured = capsys.readouterr()
+    assert captured.out == "5\n"
+    assert "fold_constants: -2" in captured.err
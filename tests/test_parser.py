@@ -0,0 +1,75 @@
+import gc
+import sys
+
+import pytest
+
+from koalacode.lexer import TokenStore, tokenize
+from koalacode.parser import Parser
+from tests.engines import parse
+
+
+def expr(source):
+    return repr(parse(f"x = {source};").stmts[0].value)
+
+
+def test_multiplication_binds_tighter_than_addition():
+    assert expr("1 + 2 * 3 - 4") == (
+        "BinOp('-', BinOp('+', Num(1), BinOp('*', Num(2), Num(3))), Num(4))")
+
+
+def test_operators_of_a_level_associate_to_the_left():
+    assert expr("8 / 4 / 2") == "BinOp('/', BinOp('/', Num(8), Num(4)), Num(2))"
+    assert expr("a < b && c") == "BinOp('&&', BinOp('<', Var('a'), Var('b')), Var('c'))"
+
+
+def test_parentheses_group():
+    assert expr("(1 + 2) * f(a[0], [3])") == (
+        "BinOp('*', BinOp('+', Num(1), Num(2)), "
+        "FuncCall('f', [Index('a', Num(0)), Array([Num(3)])]))")
+
+
+def test_compound_statements_nest():
+    tree = parse("func f(n) { this (n < 1) { return 0; } otherwise { iter (n > 0) { n = n - 1; } } "
+                 "iter2(i = 0; i < n; i = i + 1) { give(i); } }")
+    func, = tree.stmts
+    assert (func.kind, func.name, func.params) == ('func_def', 'f', ['n'])
+    branch, loop = func.body.stmts
+    assert (branch.kind, branch.then.stmts[0].kind) == ('if', 'return')
+    assert branch.orelse.stmts[0].kind == 'while'
+    assert (loop.kind, loop.init.name, loop.body.stmts[0].kind) == ('for', 'i', 'give')
+
+
+def test_deep_nesting_does_not_recurse():
+    depth = sys.getrecursionlimit() * 2
+    tree = parse("this (true) { " * depth + "give(1);" + " }" * depth)
+    node, levels = tree.stmts[0], 0
+    while node.kind == 'if':
+        node, levels = node.then.stmts[0], levels + 1
+    assert (levels, node.kind) == (depth, 'give')
+
+
+def test_any_token_source_gives_the_same_tree():
+    source = "a = [1, 2];\nfunc f(x) { return x * 2; }\ngive(f(a[1]) + 1);\n"
+    assert repr(Parser(tokenize(source)).parse()) == repr(parse(source))
+    assert repr(Parser(TokenStore.from_source(source)).parse()) == repr(parse(source))
+
+
+def test_syntax_errors_name_the_expected_token():
+    with pytest.raises(RuntimeError, match="^Expected SEMI at line 2, col 1, got GIVE$"):
+        parse("x = 1\ngive(x);")
+    with pytest.raises(RuntimeError, match=r"^\[Line 1, Col 5\] Unexpected token in factor"):
+        parse("x = ;")
+
+
+def test_trees_are_freed_without_the_cycle_collector():
+    source = "func f(a) { return a + 1; }\ngive(f(2));\n"
+    gc.collect()
+    gc.disable()
+    try:
+        parser = Parser(tokenize(source))
+        tree = parser.parse()
+        assert tree.positions.get(tree) is None
+        del tree
+        assert gc.collect() == 0
+    finally:
+        gc.enable()
@@ -0,0 +1,111 @@
+import asyncio
+
+import koala_pool
+from koala_pool import KoalaPool, PoolMetrics
+from koala_runner import run_koala_code
+
+FOREVER = "iter2(i = 0; true; i = i + 1) { x = i; }"
+
+
+def with_pool(body, **options):
+    async def main():
+        pool = KoalaPool(**options)
+        await pool.start()
+        try:
+            return await body(pool)
+        finally:
+            await pool.close()
+    return asyncio.run(main())
+
+
+def test_run_koala_code_collects_output_and_errors():
+    assert run_koala_code("give(1); give(\"a\");") == "1\na"
+    assert run_koala_code("x = 1;") == "No output"
+    assert run_koala_code("take();").startswith("Error: ")
+
+
+def test_pool_runs_programs_concurrently():
+    async def body(pool):
+        return await asyncio.gather(*(pool.run(f"give({i} * 2);") for i in range(6)))
+
+    assert with_pool(body, workers=2) == [str(i * 2) for i in range(6)]
+
+
+def test_program_over_the_timeout_is_stopped_and_its_worker_replaced():
+    async def body(pool):
+        slow = await pool.run(FOREVER)
+        after = await asyncio.gather(pool.run("give(1);"), pool.run("give(2);"))
+        return slow, after, pool.metrics.snapshot()
+
+    slow, after, metrics = with_pool(body, workers=1, timeout=0.2)
+    assert slow == "Error: program did not finish within 0.2 seconds"
+    assert after == ["1", "2"]
+    assert (metrics["timeouts"], metrics["completed"], metrics["running"]) == (1, 3, 0)
+
+
+def test_metrics_track_the_queue_and_the_cache():
+    metrics = PoolMetrics()
+    for _ in range(3):
+        metrics.enqueue()
+    metrics.start()
+    metrics.finish(0.001, 0.002, "miss")
+    metrics.start()
+    metrics.finish(0.001, 0.004, "hit")
+    snapshot = metrics.snapshot()
+    assert (snapshot["queue_depth"], snapshot["max_queue_depth"], snapshot["completed"]) == (1, 3, 2)
+    assert snapshot["latency_ms"]["p99"] == 4.0
+    assert metrics.cache_snapshot() == {"hits": 1, "shared_hits": 0, "misses": 1, "hit_rate": 0.5}
+
+
+def test_failed_respawn_is_retried(monkeypatch):
+    attempts = []
+    worker = koala_pool.Worker
+
+    def flaky_worker(context):
+        attempts.append(context)
+        if len(attempts) == 2:
+            raise OSError("no more processes")
+        return worker(context)
+
+    monkeypatch.setattr(koala_pool, "RESPAWN_DELAY", 0)
+    monkeypatch.setattr(koala_pool, "Worker", flaky_worker)
+
+    async def body(pool):
+        await pool.run(FOREVER)
+        return await pool.run("give(1);"), pool.metrics.snapshot()
+
+    output, metrics = with_pool(body, workers=1, timeout=0.2)
+    assert output == "1"
+    assert (metrics["timeouts"], metrics["spawn_failures"], len(attempts)) == (1, 1, 3)
+
+
+def test_request_cancelled_in_the_queue_leaves_it():
+    async def body(pool):
+        busy = asyncio.ensure_future(pool.run(FOREVER))
+        waiting = asyncio.ensure_future(pool.run("give(1);"))
+        await asyncio.sleep(0.05)
+        assert pool.metrics.queued == 1
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        queued = pool.metrics.queued
+        await busy
+        return queued
+
+    assert with_pool(body, workers=1, timeout=0.3) == 0
+
+
+def test_close_kills_busy_workers():
+    async def main():
+        pool = KoalaPool(workers=1, timeout=30)
+        await pool.start()
+        worker, = pool.workers
+        running = asyncio.ensure_future(pool.run(FOREVER))
+        await asyncio.sleep(0.1)
+        await pool.close()
+        output = await running
+        return worker, output, pool.workers
+
+    worker, output, workers = asyncio.run(main())
+    assert not worker.process.is_alive()
+    assert output.startswith("Error: ")
+    assert not workers
@@ -0,0 +1,121 @@
+import json
+import pickle
+import sqlite3
+import sys
+
+import pytest
+
+from koalacode import __version__
+from koalacode.cache import source_hash
+from koalacode.nodes import decode_tree, encode_tree
+from program_cache import ProgramCache, SQLiteStore, parse
+
+SOURCES = [f"give({i});" for i in range(3)]
+CALLED = []
+
+
+def _record_call():
+    CALLED.append(True)
+
+
+class _Payload:
+    def __reduce__(self):
+        return _record_call, ()
+
+
+def test_repeated_sources_are_parsed_once():
+    cache = ProgramCache()
+    tree = cache.parse(SOURCES[0])
+    assert cache.last == "miss"
+    assert cache.parse(SOURCES[0]) is tree
+    assert cache.last == "hit"
+    assert cache.stats() == {"size": 1, "maxsize": 256, "hits": 1, "shared_hits": 0, "misses": 1}
+
+
+def test_least_recently_used_source_is_dropped():
+    cache = ProgramCache(maxsize=2)
+    cache.parse(SOURCES[0])
+    cache.parse(SOURCES[1])
+    cache.parse(SOURCES[0])
+    cache.parse(SOURCES[2])
+    cache.parse(SOURCES[0])
+    assert cache.last == "hit"
+    cache.parse(SOURCES[1])
+    assert cache.last == "miss"
+
+
+def test_parse_errors_are_not_cached():
+    cache = ProgramCache()
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            cache.parse("give(;")
+    assert cache.stats()["size"] == 0
+
+
+def test_store_shares_trees_between_caches(tmp_path):
+    path = str(tmp_path / "programs.db")
+    first = ProgramCache(store=SQLiteStore(path))
+    second = ProgramCache(store=SQLiteStore(path))
+    tree = first.parse(SOURCES[0])
+    shared = second.parse(SOURCES[0])
+    assert second.last == "shared"
+    assert repr(shared) == repr(tree)
+    assert shared.positions.get(shared.stmts[0]) == (1, 1)
+    assert second.parse(SOURCES[0]) is shared and second.last == "hit"
+
+
+def test_store_keeps_only_the_newest_rows(tmp_path):
+    store = SQLiteStore(str(tmp_path / "programs.db"), maxsize=2)
+    ProgramCache(store=store).parse(SOURCES[0])
+    for source in SOURCES[1:]:
+        ProgramCache(store=store).parse(source)
+    cache = ProgramCache(store=store)
+    cache.parse(SOURCES[0])
+    assert cache.last == "miss"
+    cache.parse(SOURCES[2])
+    assert cache.last == "shared"
+
+
+def test_unusable_store_is_a_miss(tmp_path):
+    cache = ProgramCache(store=SQLiteStore(str(tmp_path / "missing" / "programs.db")))
+    assert cache.parse(SOURCES[0]) is not None
+    assert cache.last == "miss"
+
+
+def test_trees_round_trip_through_plain_data():
+    tree = parse("func f(a, b) { this (a < b) { return [a, b]; } otherwise { return a[0]; } }\n"
+                 "iter2(i = 0; i < 3; i = i + 1) { give(f(i, \"x\")); take(); }\n")
+    copy = decode_tree(json.loads(json.dumps(encode_tree(tree))))
+    assert repr(copy) == repr(tree)
+    give = copy.stmts[1].body.stmts[0]
+    assert copy.positions.get(give) == tree.positions.get(tree.stmts[1].body.stmts[0]) == (2, 34)
+
+
+def test_deep_trees_can_be_stored(tmp_path):
+    depth = sys.getrecursionlimit() * 2
+    source = "this (true) { " * depth + "give(1);" + " }" * depth
+    first = ProgramCache(store=SQLiteStore(str(tmp_path / "programs.db")))
+    second = ProgramCache(store=SQLiteStore(str(tmp_path / "programs.db")))
+    first.parse(source)
+    second.parse(source)
+    assert second.last == "shared"
+
+
+def test_stored_rows_are_never_unpickled(tmp_path):
+    path = str(tmp_path / "programs.db")
+    store = SQLiteStore(path)
+    ProgramCache(store=store).parse(SOURCES[0])
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE programs SET tree = ? WHERE version = ?",
+                     (pickle.dumps(_Payload()), __version__))
+    cache = ProgramCache(store=SQLiteStore(path))
+    assert repr(cache.parse(SOURCES[0])) == repr(parse(SOURCES[0]))
+    assert cache.last == "miss"
+    assert not CALLED
+    assert SQLiteStore(path).get(source_hash(SOURCES[0])) is not None
+
+
+def test_malformed_tree_data_is_rejected():
+    for data in ([[["Nope"]], []], [[["Num", 1, 2]], []], [[["Give", 5]], []], "x"):
+        with pytest.raises(ValueError, match="malformed tree data"):
+            decode_tree(data)
@@ -0,0 +1,51 @@
+from koalacode.cache import compile_source
+from koalacode.opcodes import (
+    BINARY_ADD_FAST_CONST_STR, COMPARE_JUMP, COMPARE_JUMP_GENERIC, COMPARE_LT_JUMP_INT,
+)
+from koalacode.streams import ListOutput
+from koalacode.vm import QUICKEN_AFTER, VM
+
+LT = "func lt(a, b) { this (a < b) { return 1; } return 0; }\n"
+
+
+def run_vm(source, **options):
+    code, funcs = compile_source(source)
+    output = ListOutput()
+    vm = VM(funcs, output=output, jit=False, memoize=False, **options)
+    vm.run(code)
+    return vm, funcs, output.lines
+
+
+def calls(call, times):
+    return "".join(f"give({call});\n" for _ in range(times))
+
+
+def test_compare_is_specialized_for_ints_once_warm():
+    _, funcs, lines = run_vm(LT + calls("lt(1, 2)", QUICKEN_AFTER))
+    assert lines == ["1"] * QUICKEN_AFTER
+    assert COMPARE_LT_JUMP_INT in funcs["lt"].code.ops
+
+
+def test_compare_stays_adaptive_until_warm():
+    _, funcs, _ = run_vm(LT + calls("lt(1, 2)", QUICKEN_AFTER - 1))
+    assert COMPARE_JUMP in funcs["lt"].code.ops
+
+
+def test_guard_miss_falls_back_to_the_generic_form():
+    vm, funcs, lines = run_vm(LT + calls("lt(1, 2)", QUICKEN_AFTER) + 'give(lt("b", "a"));\n',
+                              stats=True)
+    assert lines == ["1"] * QUICKEN_AFTER + ["0"]
+    assert COMPARE_JUMP_GENERIC in funcs["lt"].code.ops
+    assert vm.specialization_stats()["misses"] == {"COMPARE_LT_JUMP_INT": 1}
+
+
+def test_string_concatenation_with_a_constant_is_specialized():
+    source = 'func bang(s) { return s + "!"; }\n' + calls('bang("a")', QUICKEN_AFTER)
+    _, funcs, lines = run_vm(source)
+    assert lines == ["a!"] * QUICKEN_AFTER
+    assert BINARY_ADD_FAST_CONST_STR in funcs["bang"].code.ops
+
+
+def test_without_quickening_code_is_not_rewritten():
+    _, funcs, _ = run_vm(LT + calls("lt(1, 2)", 10), quicken=False)
+    assert COMPARE_JUMP in funcs["lt"].code.ops
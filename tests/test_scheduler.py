@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+from koalacode.cache import compile_source
+from koalacode.interpreter import RuntimeError_
+from koalacode.streams import ListInput, ListOutput
+from koalacode.vm import SLICE_OVER, WAIT_INPUT, VM
+
+LONG = "iter2(i = 0; i < 300; i = i + 1) { give(i); }\n"
+SHORT = "give(1);\n"
+SLICE = 100
+
+
+def new_vm(source, inputs=()):
+    code, funcs = compile_source(source)
+    output = ListOutput()
+    return VM(funcs, output=output, input=ListInput(inputs)), code, output
+
+
+def test_task_yields_after_each_slice():
+    vm, code, output = new_vm(LONG)
+    reasons = list(vm.task(code, time_slice=SLICE))
+    assert len(reasons) > 1 and set(reasons) == {SLICE_OVER}
+    assert output.lines == [str(i) for i in range(300)]
+
+
+def test_take_suspends_the_task_until_a_line_is_sent():
+    vm, code, output = new_vm('give("name?"); take(); give("done");')
+    task = vm.task(code)
+    assert next(task) == WAIT_INPUT
+    assert output.lines == ["name?"]
+    with pytest.raises(StopIteration):
+        task.send("koala")
+    assert output.lines == ["name?", "done"]
+
+
+def test_task_restores_the_vm_afterwards():
+    vm, code, _ = new_vm(LONG)
+    handlers = vm.handlers
+    for _ in vm.task(code, time_slice=SLICE):
+        pass
+    assert vm.handlers is handlers
+
+
+def test_programs_take_fair_turns():
+    runs = [new_vm(LONG) for _ in range(4)]
+    spreads = []
+
+    async def watch(tasks):
+        while not all(task.done() for task in tasks):
+            given = [len(output.lines) for _, _, output in runs]
+            spreads.append(max(given) - min(given))
+            await asyncio.sleep(0)
+
+    async def main():
+        tasks = [asyncio.ensure_future(vm.run_async(code, time_slice=SLICE))
+                 for vm, code, _ in runs]
+        await asyncio.gather(watch(tasks), *tasks)
+
+    asyncio.run(main())
+    # The watcher runs after each round of turns, when every program has
+    # run the same number of slices.
+    assert max(spreads) == 0
+    assert all(output.lines == [str(i) for i in range(300)] for _, _, output in runs)
+
+
+def test_short_program_finishes_while_long_ones_run():
+    longs = [new_vm(LONG) for _ in range(4)]
+    short_vm, short_code, short_output = new_vm(SHORT)
+
+    async def main():
+        tasks = [asyncio.ensure_future(vm.run_async(code, time_slice=SLICE))
+                 for vm, code, _ in longs]
+        await asyncio.sleep(0)
+        await short_vm.run_async(short_code, time_slice=SLICE)
+        progress = [len(output.lines) for _, _, output in longs]
+        await asyncio.gather(*tasks)
+        return progress
+
+    progress = asyncio.run(main())
+    assert short_output.lines == ["1"]
+    assert all(0 < given < 300 for given in progress)
+
+
+def test_waiting_for_input_lets_other_programs_run():
+    waiting_vm, waiting_code, waiting_output = new_vm("take(); give(2);")
+    other_vm, other_code, other_output = new_vm(LONG)
+
+    async def main():
+        line = asyncio.get_running_loop().create_future()
+
+        async def read():
+            return await line
+
+        waiting = asyncio.ensure_future(waiting_vm.run_async(waiting_code, read=read))
+        await other_vm.run_async(other_code, time_slice=SLICE)
+        assert not waiting.done()
+        line.set_result("x")
+        await waiting
+
+    asyncio.run(main())
+    assert other_output.lines == [str(i) for i in range(300)]
+    assert waiting_output.lines == ["2"]
+
+
+def test_cancelled_task_stops_between_slices():
+    vm, code, output = new_vm("iter2(i = 0; true; i = i + 1) { give(i); }")
+    handlers = vm.handlers
+
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(vm.run_async(code, time_slice=SLICE), 0.05)
+
+    asyncio.run(main())
+    assert output.lines
+    assert vm.handlers is handlers
+
+
+def test_errors_in_tasks_keep_their_position():
+    vm, code, output = new_vm("give(1);\na = [1];\ngive(a[4]);\n")
+    with pytest.raises(RuntimeError_, match=r"^\[Line 3, Col 6\]"):
+        asyncio.run(vm.run_async(code, time_slice=SLICE))
+    assert output.lines == ["1"]
@@ -0,0 +1,129 @@
+import io
+
+import pytest
+
+from koalacode.interpreter import RuntimeError_
+from koalacode.streams import (
+    BufferedOutput, CallbackInput, CallbackOutput, ListInput, ListOutput,
+)
+from koalacode.transpiler import run as run_program, to_python, transpile_source
+from tests.engines import ENGINES, execute, run
+
+
+class RecordingOutput(ListOutput):
+    """A ListOutput that also logs writes and flushes into ``events``."""
+
+    def __init__(self, events):
+        super().__init__()
+        self.events = events
+
+    def write(self, value):
+        super().write(value)
+        self.events.append(("write", str(value)))
+
+    def flush(self):
+        self.events.append(("flush",))
+
+
+class RecordingInput(ListInput):
+    def __init__(self, lines, events):
+        super().__init__(lines)
+        self.events = events
+
+    def read(self):
+        self.events.append(("read",))
+        return super().read()
+
+
+def test_buffered_output_writes_in_batches():
+    file = io.StringIO()
+    output = BufferedOutput(file, size=3)
+    output.write(1)
+    output.write("a")
+    assert file.getvalue() == ""
+    output.write(True)
+    assert file.getvalue() == "1\na\nTrue\n"
+    output.write([1, 2])
+    output.flush()
+    assert file.getvalue() == "1\na\nTrue\n[1, 2]\n"
+
+
+def test_buffered_output_defaults_to_current_stdout(capsys):
+    output = BufferedOutput()
+    output.write(5)
+    output.flush()
+    assert capsys.readouterr().out == "5\n"
+
+
+def test_callback_output_hands_on_batches():
+    batches = []
+    output = CallbackOutput(batches.append, size=2)
+    for value in range(5):
+        output.write(value)
+    output.flush()
+    assert batches == ["0\n1\n", "2\n3\n", "4\n"]
+
+
+def test_list_output_keeps_lines():
+    output = ListOutput()
+    output.write(1)
+    output.write("x")
+    assert output.lines == ["1", "x"]
+    assert output.getvalue() == "1\nx\n"
+
+
+def test_list_input_raises_eof_when_empty():
+    source = ListInput(["a"])
+    assert source.read() == "a"
+    with pytest.raises(EOFError):
+        source.read()
+
+
+def test_callback_input_calls_for_each_line():
+    lines = iter(["x", "y"])
+    source = CallbackInput(lambda: next(lines))
+    assert [source.read(), source.read()] == ["x", "y"]
+
+
+def events_of(source, engine, inputs=()):
+    """Run ``source`` on ``engine`` with recording streams; return the events."""
+    events = []
+    execute(source, engine, RecordingOutput(events), RecordingInput(inputs, events))
+    return events
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_give_and_take_use_the_streams(engine):
+    assert run('give("name?"); take(); give("hi");', engine, inputs=["koala"]) == (
+        ["name?", "hi"], None)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_output_is_flushed_before_take_and_at_the_end(engine):
+    events = events_of('give("name?"); take(); give("hi");', engine, ["koala"])
+    assert events == [("write", "name?"), ("flush",), ("read",), ("write", "hi"), ("flush",)]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_take_past_the_end_of_input_raises_eof(engine):
+    with pytest.raises(EOFError):
+        run('give(1); take();', engine)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_output_is_flushed_when_a_run_fails(engine):
+    events = []
+    with pytest.raises(RuntimeError_):
+        execute("give(1); x = 1 / 0;", engine, RecordingOutput(events), ListInput(()))
+    assert events == [("write", "1"), ("flush",)]
+
+
+def test_generated_python_gives_through_the_sink():
+    source = to_python('give("a"); take();')
+    assert "print(" not in source and "input(" not in source
+    assert "write('a')" in source and "read()" in source
+
+
+def test_python_backend_defaults_to_buffered_stdout(capsys):
+    run_program(transpile_source("give(1); give(2);"))
+    assert capsys.readouterr().out == "1\n2\n"
@@ -0,0 +1,72 @@
+import sys
+import tracemalloc
+
+import pytest
+
+from koalacode.cache import compile_source
+from koalacode.interpreter import RuntimeError_
+from koalacode.opcodes import TAIL_CALL
+from koalacode.streams import ListOutput
+from koalacode.vm import VM
+from tests.engines import run
+
+# t ends with a tail call and d does not; both fail at the bottom.
+SOURCE = ("a = [1];\n"
+          "func t(n) { this (n < 1) { return a[3]; } return t(n - 1); }\n"
+          "func d(n) { this (n < 1) { return a[3]; } return 1 + d(n - 1); }\n")
+
+
+def call_stack_at_error(call):
+    code, funcs = compile_source(SOURCE + f"give({call});\n")
+    vm = VM(funcs, output=ListOutput(), jit=False, memoize=False)
+    with pytest.raises(RuntimeError_, match="Index out of bounds"):
+        vm.run(code)
+    return len(vm.call_stack)
+
+
+def test_compiler_emits_tail_calls_only_in_tail_position():
+    code, funcs = compile_source(SOURCE + "return t(1);\n")
+    assert TAIL_CALL in funcs["t"].code.ops
+    assert TAIL_CALL not in funcs["d"].code.ops
+    assert TAIL_CALL not in code.ops
+
+
+def test_vm_tail_recursion_reuses_the_callers_frame():
+    assert call_stack_at_error("t(1000)") == 1
+    assert call_stack_at_error("d(1000)") == 1001
+
+
+@pytest.mark.parametrize("engine", ("vm", "vm-nojit", "stackless"))
+def test_recursion_is_not_limited_by_the_python_stack(engine):
+    n = sys.getrecursionlimit() * 5
+    source = ("func t(n, acc) { this (n < 1) { return acc; } return t(n - 1, acc + 1); }\n"
+              "func d(n) { this (n < 1) { return 0; } return 1 + d(n - 1); }\n"
+              f"give(t({n}, 0));\ngive(d({n}));\n")
+    assert run(source, engine) == ([str(n), str(n)], None)
+
+
+def test_stackless_tail_recursion_runs_in_constant_memory():
+    def peak(n):
+        source = f"func t(n) {{ this (n < 1) {{ return 0; }} return t(n - 1); }}\ngive(t({n}));\n"
+        tracemalloc.start()
+        try:
+            assert run(source, "stackless", memoize=False) == (["0"], None)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    assert peak(20000) < 2 * peak(2000)
+
+
+@pytest.mark.parametrize("engine", ("interp", "stackless", "vm"))
+def test_mutual_tail_calls(engine):
+    source = ("func even(n) { this (n < 1) { return 1; } return odd(n - 1); }\n"
+              "func odd(n) { this (n < 1) { return 0; } return even(n - 1); }\n"
+              "give(even(10)); give(odd(7)); give(even(3));\n")
+    assert run(source, engine) == (["1", "1", "0"], None)
+
+
+@pytest.mark.parametrize("engine", ("interp", "stackless"))
+def test_error_in_a_tail_called_function_is_reported_there(engine):
+    lines, error = run(SOURCE + "give(t(3));\n", engine)
+    assert error.startswith("[Line 2, Col 35]")
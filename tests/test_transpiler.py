@@ -0,0 +1,41 @@
+import sys
+
+import pytest
+
+from koalacode.transpiler import to_python
+from tests.engines import run
+
+# Expressions get their own positions from CPython's instruction columns.
+needs_columns = pytest.mark.skipif(sys.version_info < (3, 11),
+                                   reason="instruction columns need Python 3.11")
+
+ERRORS = {
+    "division by zero": "give(5 / 0);",
+    "invalid operation": 'give(1 + "a");',
+    "comparison": 'give(1 < "a");',
+    "operand from a call": 'func g() { return "s"; }\ngive(g() - 1);',
+    "nested operation": 'func f(a) {\n  return 2 * (a + "x");\n}\ngive(f(1));',
+    "after non-ASCII text": 's = "héé";\ngive(s + 1 + q);',
+    "index": "a = [1, 2];\ni = 0;\ngive(a[i + 4] + 1);",
+    "index into a number": "x = 5;\ngive(x[0]);",
+    "assign to index": "a = [1];\nfunc f(i) { a[i * 2] = 5; return 0; }\nf(3);",
+    "undefined array": "give(q[1]);",
+    "undefined variable": "give(1);\ngive(y);",
+    "undefined local": "func f(n) { this (n > 0) { x = n; } return x + 1; }\ngive(f(0));",
+    "undefined function": "give(nope(1));",
+    "wrong argument count": "func f(a) { return a; }\ngive(f(1, 2));",
+    "argument count of redefined function": (
+        "func f(a, b) { return a; }\nfunc f(a) { return a; }\ngive(f(1, 2, 3));"),
+}
+
+
+@needs_columns
+@pytest.mark.parametrize("case", ERRORS)
+def test_errors_match_the_interpreter(case):
+    source = ERRORS[case]
+    assert run(source, "py") == run(source, "interp")
+
+
+def test_generated_source_has_no_marks():
+    source = to_python("a = [1];\nfunc f(x) { return a[x] + g(x); }\na[0] = f(0);")
+    assert not any(c in source for c in "\x01\x02\x03")
@@ -0,0 +1,75 @@
+import pytest
+
+from koalacode.cli import main
+from koalacode.typecheck import check
+from tests.engines import ENGINES, parse, run
+
+
+def warnings(source):
+    found = []
+    check(parse(source), warn=found.append)
+    return found
+
+
+def test_check_warns_about_certain_errors_in_source_order():
+    source = 'x = 1;\nfunc f() { return "a" + 1; }\nx = "s";\n'
+    assert warnings(source) == [
+        "[Line 2, Col 23] Invalid operation + between str and int",
+        "[Line 3, Col 1] x was int, got str",
+    ]
+
+
+def test_check_does_not_warn_about_consistent_types():
+    assert warnings('x = 1; x = x + 2; s = "a"; s = s + "b";') == []
+
+
+def test_check_proves_first_and_same_type_assignments():
+    tree = parse("x = 1; x = 2;")
+    first, second = tree.stmts
+    assert check(tree) == {id(first), id(second)}
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_type_error_in_dead_branch_runs(engine):
+    assert run('x = 1; this (false) { x = "s"; } give(x);', engine) == (["1"], None)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_type_error_in_uncalled_function_runs(engine):
+    assert run('func f() { return "a" + 1; } give(3);', engine) == (["3"], None)
+
+
+@pytest.mark.parametrize("engine", ("interp", "stackless"))
+def test_reached_type_error_keeps_earlier_output(engine):
+    assert run('give(1);\nx = 1;\nx = "s";\ngive(2);\n', engine) == (
+        ["1"], "[Line 3, Col 1] Type error: x was int, got str")
+
+
+@pytest.mark.parametrize("engine", ("interp", "stackless"))
+def test_reached_invalid_operation_keeps_earlier_output(engine):
+    assert run('func f() { return "a" + 1; }\ngive(1);\ngive(f());\n', engine) == (
+        ["1"], "[Line 1, Col 23] Invalid operation + between str and int")
+
+
+def test_interpreter_passes_warnings_on():
+    found = []
+    assert run('x = 1; this (false) { x = "s"; } give(x);', warn=found.append) == (["1"], None)
+    assert found == ["[Line 1, Col 23] x was int, got str"]
+
+
+@pytest.mark.parametrize("backend", (["--backend=interp"], ["--backend=vm", "--no-cache"],
+                                     ["--backend=vm", "--vm=register"], ["--backend=py"]))
+def test_cli_prints_warnings_to_stderr(backend, tmp_path, capsys):
+    program = tmp_path / "p.ko"
+    program.write_text('x = 1; this (false) { x = "s"; } give(x);\n')
+    main(backend + [str(program)])
+    captured = capsys.readouterr()
+    assert captured.out == "1\n"
+    assert captured.err == "Type Warning: [Line 1, Col 23] x was int, got str\n"
+
+
+def test_cli_reports_reached_type_error_as_runtime_error(tmp_path, capsys):
+    program = tmp_path / "p.ko"
+    program.write_text('give(1);\nx = 1;\nx = "s";\n')
+    main([str(program)])
+    assert capsys.readouterr().out == "1\nRuntime Error: [Line 3, Col 1] Type error: x was int, got str\n"
@@ -0,0 +1,145 @@
+from array import array
+
+import pytest
+
+from koalacode.assembler import Code
+from koalacode.cache import compile_source
+from koalacode.compiler import Compiler
+from koalacode.interpreter import RuntimeError_
+from koalacode.opcodes import (
+    BINARY_ADD, BINARY_FLOORDIV, BINARY_MUL, COMPARE_LT, LOAD_FAST, LOAD_GLOBAL, NUM_OPCODES,
+    OPNAMES, PRINT, PUSH_CONST, RETURN, STORE_FAST, STORE_GLOBAL,
+)
+from koalacode.streams import ListInput, ListOutput
+from koalacode.vm import STACK_SIZE, VM, Frame
+from tests.engines import ENGINES, parse, run
+
+# give(2 + 3); built by hand so the test controls every opcode.
+ADD_CODE = Code(array('i', [PUSH_CONST, PUSH_CONST, BINARY_ADD, PRINT, PUSH_CONST, RETURN]),
+                array('i', [0, 1, 0, 0, 0, 0]), [2, 3], [], b"", 2)
+
+
+def test_every_opcode_has_a_handler():
+    vm = VM()
+    assert len(vm.handlers) == NUM_OPCODES
+    assert [OPNAMES[op] for op in OPNAMES if vm.handlers[op] == vm.op_bad] == []
+
+
+def test_each_operator_compiles_to_its_own_opcode():
+    comp = Compiler()
+    comp.compile(parse("give(1 + 2 * 3 / 4 < 5);"))
+    assert [op for op, _, _ in comp.bytecode if op not in (PUSH_CONST, PRINT, RETURN)] == [
+        BINARY_MUL, BINARY_FLOORDIV, BINARY_ADD, COMPARE_LT]
+
+
+def test_instructions_run_through_the_handler_table():
+    output = ListOutput()
+    vm = VM(output=output)
+    vm.run(ADD_CODE)
+    vm.handlers[BINARY_ADD] = vm.handlers[BINARY_MUL]
+    vm.run(ADD_CODE)
+    assert output.lines == ["5", "6"]
+
+
+def test_opcode_without_a_handler_is_reported():
+    vm = VM(output=ListOutput())
+    vm.handlers[BINARY_ADD] = vm.op_bad
+    with pytest.raises(RuntimeError_, match="^Bad instruction 16$"):
+        vm.run(ADD_CODE)
+
+
+
+def test_function_locals_are_resolved_to_slots():
+    source = "g = 1;\nfunc f(a, b) { t = a + g; u = t * b; return u; }\ngive(f(2, 3));\n"
+    code, funcs = compile_source(source, opt_level=0)
+    f = funcs["f"]
+    assert (f.params, f.varnames, f.nlocals) == (["a", "b"], ["a", "b", "t", "u"], 4)
+    assert f.code.instructions()[:4] == [
+        (LOAD_FAST, 0), (LOAD_GLOBAL, "g"), (BINARY_ADD, None), (STORE_FAST, 2)]
+    assert code.instructions()[:2] == [(PUSH_CONST, 1), (STORE_GLOBAL, "g")]
+
+
+def test_locals_do_not_leak_into_globals():
+    source = "x = 1;\nfunc f(n) { x = n; return x; }\ngive(f(5));\ngive(x);\n"
+    assert run(source, "vm-nojit") == (["5", "1"], None)
+
+
+def test_frames_have_no_instance_dict():
+    frame = Frame([], [], 0, [], None)
+    assert not hasattr(frame, "__dict__")
+    with pytest.raises(AttributeError):
+        frame.extra = 1
+
+
+FUSED_SOURCE = (
+    "func f(a, n) { s = 0; i = 0; iter (i < n) { s = s + a[i] * i; i = i + 1; } return s + n - 1; }\n"
+    "a = [3, 1, 4, 1, 5];\nj = 0;\niter (j < 3) { give(f(a, 5) + a[j]); j = j + 1; }\n")
+
+
+def fused_opnames(opt_level):
+    code, funcs = compile_source(FUSED_SOURCE, opt_level=opt_level)
+    return {OPNAMES[op] for c in (code, funcs["f"].code) for op, _ in c.instructions()}
+
+
+def test_superinstructions_are_emitted_at_level_two():
+    fused = {"INC_FAST", "INC_GLOBAL", "LOAD_FAST_FAST", "COMPARE_JUMP",
+             "COMPARE_GLOBAL_CONST_JUMP", "LOAD_INDEX_GLOBAL"}
+    assert fused <= fused_opnames(2)
+    assert not fused & fused_opnames(1)
+
+
+def test_superinstructions_give_the_same_output():
+    outputs = []
+    for opt_level in (1, 2):
+        code, funcs = compile_source(FUSED_SOURCE, opt_level=opt_level)
+        output = ListOutput()
+        VM(funcs, output=output, jit=False, quicken=False).run(code)
+        outputs.append(output.lines)
+    assert outputs[0] == outputs[1] == ["39", "37", "40"]
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_return_at_module_level_ends_the_program(engine):
+    assert run("give(1);\nreturn 5;\ngive(2);\n", engine) == (["1"], None)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_return_inside_function_still_returns(engine):
+    source = "func f(n) { return n + 1; }\ngive(f(1));\nreturn 0;\n"
+    assert run(source, engine) == (["2"], None)
+
+
+@pytest.mark.parametrize("engine", ("vm-nojit", "register"))
+def test_error_after_a_return_is_reported_in_the_caller(engine):
+    source = "func f(n) { return n; }\nx = f(1);\ngive(x / 0);\n"
+    lines, error = run(source, engine)
+    assert error.startswith("[Line 3, Col 8]")
+
+
+@pytest.mark.parametrize("engine", ("vm-nojit", "register"))
+def test_error_in_a_tail_called_function_is_reported_there(engine):
+    source = ("func g(n) { return 10 / n; }\nfunc f(n) { return g(n); }\n"
+              "give(f(5));\ngive(f(0));\n")
+    lines, error = run(source, engine)
+    assert lines == ["2"]
+    assert error.startswith("[Line 1, Col 23]")
+
+
+def test_calls_and_input_used_as_statements_leave_the_stack_empty():
+    code, funcs = compile_source("func f(a) { return a; }\n"
+                                 "iter2(i = 0; i < 100; i = i + 1) { f(i); take(); }\n")
+    vm = VM(funcs, output=ListOutput(), input=ListInput(["x"] * 100), jit=False)
+    vm.run(code)
+    assert vm.sp == 0
+    assert len(vm.stack) == STACK_SIZE
+
+
+def test_operand_stack_grows_for_deep_recursion():
+    n = STACK_SIZE * 4
+    code, funcs = compile_source(
+        "func d(n) { this (n < 1) { return 0; } return len([n, [], [n]]) - 2 + d(n - 1); }\n"
+        f"give(d({n}));\n")
+    output = ListOutput()
+    vm = VM(funcs, output=output, jit=False)
+    vm.run(code)
+    assert output.lines == [str(n)]
+    assert len(vm.stack) > n